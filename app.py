@@ -2,21 +2,35 @@
 # Main entry point that sets up the Flask application
 
 import os
+import time
+import logging
 from flask import Flask
 from dotenv import load_dotenv
 
 # Import components
 from config import Config
-from database import init_db
-from webhook_handler import webhook_bp
-from health_check import health_bp
-from message_handler import message_bp
+from logging_setup import configure_logging
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def create_app(config_class=Config):
     """Create and configure the Flask application"""
+    started = time.perf_counter()
+    configure_logging()
+    
+    # Imported here so `import app` stays cheap and boot time below covers the whole stack
+    from webhook_handler import webhook_bp
+    from health_check import health_bp
+    from message_handler import message_bp
+    from metrics import metrics_bp
+    from export import export_bp
+    from flows import flows_bp
+    from migrations import check_schema
+    imported = time.perf_counter()
+    
     app = Flask(__name__)
     app.config.from_object(config_class)
     
@@ -24,18 +38,26 @@ def create_app(config_class=Config):
     app.register_blueprint(webhook_bp)
     app.register_blueprint(health_bp)
     app.register_blueprint(message_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(flows_bp)
     
-    # Initialize database at startup
-    with app.app_context():
-        init_db()
+    # Schema changes are applied by `python manage.py migrate`; workers only check the version
+    if config_class.SCHEMA_CHECK:
+        check_schema()
     
     @app.route('/')
     def index():
         return "TTD Survey Bot is running. Webhook endpoint: /webhook"
     
+    finished = time.perf_counter()
+    logger.info("App created in %.0f ms (imports %.0f ms, setup %.0f ms)",
+                (finished - started) * 1000, (imported - started) * 1000, (finished - imported) * 1000)
     return app
 
 if __name__ == '__main__':
+    from metrics import clear_metrics_dir
+    clear_metrics_dir()
     app = create_app()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
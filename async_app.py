@@ -0,0 +1,457 @@
+# async_app.py - Asyncio Serving Mode
+# ASGI application: webhooks and conversations run on one event loop with async Graph API and MySQL clients
+#
+# Usage: uvicorn async_app:create_async_app --factory --host 0.0.0.0 --port 5000
+#
+# /webhook is served natively. Every other endpoint comes from the Flask app built by
+# create_app(), mounted as WSGI. Conversation logic is the same decide() the sync workers use.
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import httpx
+import aiomysql
+from starlette.applications import Starlette
+from starlette.responses import Response, PlainTextResponse, JSONResponse
+from starlette.routing import Route, Mount
+from a2wsgi import WSGIMiddleware
+from config import Config
+from app import create_app
+from database import (
+    INSERT_FEEDBACK_SQL, UPDATE_CATEGORY_STATS_SQL, INSERT_RESPONDENT_SQL, INCREMENT_COUNTER_SQL, feedback_rollups
+)
+from session_manager import SessionManager, get_feedback_writer, _upsert_state_query
+from session_cache import get_session_cache
+from dedup import get_deduplicator, CLAIM_SQL, PURGE_SQL
+from delivery_tracking import record_sent, record_statuses
+from outbound import response_error_code, classify_failure, retry_delay
+from message_handler import decide
+from conversation import NEW
+from webhook_handler import signature_valid, wants_payload
+from webhook_parser import classify, parse_payload
+from logging_setup import redact
+from throttle import admit, ALLOWED, NOTICE, NOTICE_TEXT
+from whatsapp_api import text_message, get_bucket
+from metrics import (
+    WEBHOOK_REQUESTS, SESSION_DB_SECONDS, GRAPH_API_SECONDS, OUTBOUND_MESSAGES,
+    HANDLE_MESSAGE_SECONDS, HANDLE_MESSAGE_ERRORS
+)
+
+logger = logging.getLogger(__name__)
+
+class AsyncWhatsAppClient:
+    """Async counterpart of WhatsAppClient plus OutboundQueue.deliver: throttled, retrying sends"""
+    
+    def __init__(self, phone_number_id, access_token, bucket, pool_size, connect_timeout, read_timeout,
+                 max_retries, backoff_base, backoff_max, on_sent=None):
+        self.url = f"{Config.GRAPH_API_URL}/{Config.GRAPH_API_VERSION}/{phone_number_id}/messages"
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_sent = on_sent
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+        self._counts = {'sent': 0, 'retried': 0, 'dropped': 0, 'failed': 0, 'throttled': 0}
+    
+    async def deliver(self, recipient, data, description):
+        """Send one message, retrying 429/5xx with backoff. Returns the response or None."""
+        for attempt in range(self.max_retries + 1):
+            throttled = False
+            while True:
+                wait = self.bucket.try_acquire()
+                if not wait:
+                    break
+                throttled = True
+                await asyncio.sleep(wait)
+            if throttled:
+                self._counts['throttled'] += 1
+            
+            response = None
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(self.url, content=data)
+                GRAPH_API_SECONDS.labels(description).observe(time.perf_counter() - started)
+                if response.is_success:
+                    self._counts['sent'] += 1
+                    OUTBOUND_MESSAGES.labels(description, 'sent').inc()
+                    logger.debug("Sent %s to %s", description, redact(recipient))
+                    if self.on_sent is not None:
+                        try:
+                            self.on_sent(recipient, description, response)
+                        except Exception as e:
+                            logger.error("Error in on_sent hook for %s to %s: %s", description, redact(recipient), e)
+                    return response
+                
+                rate_limited, retryable = classify_failure(response.status_code, response_error_code(response))
+                error = f"HTTP {response.status_code}: {response.text}"
+            except httpx.HTTPError as e:
+                GRAPH_API_SECONDS.labels(description).observe(time.perf_counter() - started)
+                rate_limited = False
+                retryable = True
+                error = str(e)
+            
+            if not retryable:
+                self._counts['failed'] += 1
+                OUTBOUND_MESSAGES.labels(description, 'failed').inc()
+                logger.error("Failed to send %s to %s: %s", description, redact(recipient), error)
+                return None
+            
+            if attempt == self.max_retries:
+                break
+            
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            delay = retry_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+            self._counts['retried'] += 1
+            OUTBOUND_MESSAGES.labels(description, 'retried').inc()
+            logger.warning("Retrying %s to %s in %.2fs (%s)", description, redact(recipient), delay, error)
+            if rate_limited:
+                # The next try_acquire() waits this out, along with every other sender
+                self.bucket.penalize(delay)
+            else:
+                await asyncio.sleep(delay)
+        
+        self._counts['dropped'] += 1
+        OUTBOUND_MESSAGES.labels(description, 'dropped').inc()
+        logger.error("Failed to send %s to %s after %d attempts: %s", description, redact(recipient), self.max_retries + 1, error)
+        return None
+    
+    async def close(self):
+        await self.client.aclose()
+    
+    def stats(self):
+        """Delivery counters"""
+        return dict(self._counts)
+
+class AsyncDatabase:
+    """Async counterparts of the SessionManager and dedup queries, on an aiomysql pool"""
+    
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.pool = None
+    
+    async def start(self):
+        # Autocommit, so plain reads never hold a snapshot open; writes begin() explicitly
+        self.pool = await aiomysql.create_pool(
+            host=Config.DB_HOST,
+            user=Config.DB_USERNAME,
+            password=Config.DB_PASSWORD,
+            db=Config.DB_NAME,
+            minsize=1,
+            maxsize=self.pool_size,
+            pool_recycle=Config.DB_POOL_RECYCLE,
+            autocommit=True
+        )
+    
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+    
+    async def get_user_state(self, phone_number):
+        """Cache-first user_state lookup, as SessionManager.get_user_state"""
+        cache = get_session_cache()
+        token = None
+        if cache is not None:
+            hit, row = cache.get(phone_number)
+            if hit:
+                return row
+            # Read the generation before the DB so a concurrent write invalidates what we load
+            token = cache.generation(phone_number)
+        
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute("SELECT * FROM user_state WHERE phone_number = %s", (phone_number,))
+                    result = await cursor.fetchone()
+            if cache is not None:
+                cache.put(phone_number, result, token)
+            return result
+        except Exception as e:
+            logger.error("Error getting user state: %s", e)
+            return None
+        finally:
+            SESSION_DB_SECONDS.labels('get_user_state').observe(time.perf_counter() - started)
+    
+    async def _record_feedback(self, cursor, rows):
+        # Same statements as database.record_feedback
+        await cursor.executemany(INSERT_FEEDBACK_SQL, rows)
+        category_totals, phones = feedback_rollups(rows)
+        for totals in category_totals:
+            await cursor.execute(UPDATE_CATEGORY_STATS_SQL, totals)
+        if not phones:
+            return
+        await cursor.executemany(INSERT_RESPONDENT_SQL, [(phone,) for phone in phones])
+        if cursor.rowcount > 0:
+            await cursor.execute(INCREMENT_COUNTER_SQL, ('unique_users', cursor.rowcount))
+    
+    async def apply(self, phone_number, decision):
+        """Persist a decision's feedback and state change in one transaction"""
+        if decision.state is None and decision.feedback is None:
+            return
+        
+        writer = get_feedback_writer()
+        loop = asyncio.get_running_loop()
+        buffered = []
+        staged = None
+        state_changes = [(phone_number, decision.state, decision.category)]
+        operation = 'transaction' if decision.feedback is not None else 'set_user_state'
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.begin()
+                try:
+                    async with conn.cursor() as cursor:
+                        if decision.feedback is not None:
+                            category, rating = decision.feedback
+                            row = [phone_number, category, rating, None]
+                            if writer is not None:
+                                buffered.append(row)
+                            else:
+                                await self._record_feedback(cursor, [tuple(row)])
+                        await cursor.execute(*_upsert_state_query(phone_number, decision.state, decision.category))
+                    if buffered:
+                        # Journaled before the commit as in SessionManager.transaction; the fsync runs off the loop
+                        staged = await loop.run_in_executor(None, writer.stage, buffered)
+                    await conn.commit()
+                except BaseException:
+                    await conn.rollback()
+                    if staged is not None:
+                        await loop.run_in_executor(None, writer.discard, staged)
+                    raise
+        except Exception as e:
+            SessionManager._invalidate_states(state_changes)
+            if decision.feedback is not None:
+                logger.error("Error in session transaction, rolled back: %s", e)
+                raise
+            # Like SessionManager.set_user_state, a failed state write alone does not stop the replies
+            logger.error("Error setting user state: %s", e)
+            return
+        finally:
+            SESSION_DB_SECONDS.labels(operation).observe(time.perf_counter() - started)
+        
+        if staged is not None:
+            writer.release(staged)
+        SessionManager._cache_state(phone_number, decision.state, decision.category)
+    
+    async def claim(self, message_id):
+        """MessageDeduplicator.claim against the async pool"""
+        if not message_id:
+            return True
+        
+        deduplicator = get_deduplicator()
+        key = deduplicator.digest(message_id)
+        if deduplicator.seen_recently(key):
+            return False
+        
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(CLAIM_SQL, (key,))
+                    claimed = cursor.rowcount == 1
+                    if deduplicator.purge_due():
+                        await cursor.execute(PURGE_SQL, (int(deduplicator.ttl),))
+        except Exception as e:
+            # Fail open: better a possible duplicate reply than dropping a real message
+            deduplicator.store_failed(e)
+            claimed = True
+        return deduplicator.record_claim(key, claimed)
+
+class ConversationRunner:
+    """Runs webhook payloads as tasks; each sender's messages are handled one at a time, in order"""
+    
+    def __init__(self, db, client, max_in_flight):
+        self.db = db
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self._tasks = set()
+        self._senders = {}
+        
+        # Metrics
+        self._accepted = 0
+        self._rejected = 0
+        self._handled = 0
+        self._failed = 0
+    
+    def submit(self, raw):
+        """Start processing a raw webhook body. Returns False when too many are already in flight."""
+        if len(self._tasks) >= self.max_in_flight:
+            self._rejected += 1
+            return False
+        task = asyncio.create_task(self._process(raw))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._accepted += 1
+        return True
+    
+    async def _process(self, raw):
+        try:
+            messages, statuses = parse_payload(raw)
+            if statuses:
+                record_statuses(statuses)
+            
+            for message in messages:
+                # Meta redelivers when our 200 is slow; drop repeats before any work
+                if not await self.db.claim(message.id):
+                    logger.info("Duplicate delivery of message %s suppressed", message.id)
+                    continue
+                verdict = admit(message)
+                if verdict == NOTICE:
+                    description, data = text_message(message.wa_id, NOTICE_TEXT)
+                    await self.client.deliver(message.wa_id, data, description)
+                if verdict != ALLOWED:
+                    continue
+                await self._handle_in_order(message)
+        except Exception as e:
+            self._failed += 1
+            logger.error("Error processing webhook: %s", e)
+    
+    async def _handle_in_order(self, message):
+        # One lock per sender with messages in flight, dropped when the last one finishes
+        entry = self._senders.get(message.wa_id)
+        if entry is None:
+            entry = self._senders[message.wa_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self.handle_message(message, message.wa_id)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._senders[message.wa_id]
+    
+    async def handle_message(self, message, phone_number):
+        """Async handle_message: same decision, async persistence and sends"""
+        started = time.perf_counter()
+        user_state = await self.db.get_user_state(phone_number)
+        state = user_state['current_state'] if user_state else NEW
+        try:
+            decision = decide(message, phone_number, user_state)
+            await self.db.apply(phone_number, decision)
+            for description, data in decision.replies:
+                await self.client.deliver(phone_number, data, description)
+            self._handled += 1
+        except Exception:
+            HANDLE_MESSAGE_ERRORS.labels(state).inc()
+            raise
+        finally:
+            HANDLE_MESSAGE_SECONDS.labels(state).observe(time.perf_counter() - started)
+    
+    async def drain(self, timeout):
+        """Wait for in-flight webhooks to finish"""
+        if self._tasks:
+            logger.info("Draining %d in-flight webhook(s)", len(self._tasks))
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+    
+    def stats(self):
+        """In-flight and completed work counters"""
+        return {
+            'in_flight': len(self._tasks),
+            'active_senders': len(self._senders),
+            'accepted': self._accepted,
+            'rejected': self._rejected,
+            'handled': self._handled,
+            'failed': self._failed
+        }
+
+async def webhook(request):
+    """Async /webhook with the same contract as webhook_handler.webhook"""
+    # Handle verification request from WhatsApp
+    if request.method == 'GET':
+        mode = request.query_params.get('hub.mode')
+        token = request.query_params.get('hub.verify_token')
+        challenge = request.query_params.get('hub.challenge')
+        if mode == 'subscribe' and token and token == Config.VERIFY_TOKEN:
+            logger.info("Webhook verified")
+            return PlainTextResponse(challenge)
+        logger.warning("Failed webhook verification")
+        return Response(status_code=403)
+    
+    # Enforce the size limit before reading or parsing anything
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > Config.MAX_WEBHOOK_BYTES:
+        logger.warning("Webhook body too large: %s bytes", content_length)
+        WEBHOOK_REQUESTS.labels('too_large').inc()
+        return Response(status_code=413)
+    raw = await request.body()
+    if len(raw) > Config.MAX_WEBHOOK_BYTES:
+        logger.warning("Webhook body too large: %d bytes", len(raw))
+        WEBHOOK_REQUESTS.labels('too_large').inc()
+        return Response(status_code=413)
+    
+    if not signature_valid(raw, request.headers.get('X-Hub-Signature-256', '')):
+        logger.warning("Invalid signature")
+        WEBHOOK_REQUESTS.labels('invalid_signature').inc()
+        return Response(status_code=403)
+    
+    kind = classify(raw)
+    logger.debug("Received %s webhook (%d bytes)", kind, len(raw))
+    if not wants_payload(kind):
+        WEBHOOK_REQUESTS.labels('ignored').inc()
+        return Response(status_code=200)
+    
+    # Acknowledge now; too much in flight asks Meta to retry later
+    if not request.app.state.runner.submit(raw):
+        WEBHOOK_REQUESTS.labels('queue_full').inc()
+        return Response(status_code=503, headers={'Retry-After': '5'})
+    
+    WEBHOOK_REQUESTS.labels('accepted').inc()
+    return Response(status_code=200)
+
+async def async_stats(request):
+    """Runtime metrics for the event loop's conversations and sends"""
+    runner = request.app.state.runner
+    pool = runner.db.pool
+    return JSONResponse({
+        "conversations": runner.stats(),
+        "outbound": runner.client.stats(),
+        "db_pool": {
+            'size': pool.size if pool else 0,
+            'free': pool.freesize if pool else 0,
+            'max_size': runner.db.pool_size
+        }
+    })
+
+def create_async_app():
+    """Create the ASGI application around create_app()"""
+    flask_app = create_app()
+    
+    db = AsyncDatabase(Config.ASYNC_DB_POOL_SIZE)
+    client = AsyncWhatsAppClient(
+        Config.PHONE_NUMBER_ID,
+        Config.ACCESS_TOKEN,
+        get_bucket(Config.PHONE_NUMBER_ID),
+        pool_size=Config.ASYNC_GRAPH_API_POOL_SIZE,
+        connect_timeout=Config.GRAPH_API_CONNECT_TIMEOUT,
+        read_timeout=Config.GRAPH_API_READ_TIMEOUT,
+        max_retries=Config.OUTBOUND_MAX_RETRIES,
+        backoff_base=Config.OUTBOUND_BACKOFF_BASE,
+        backoff_max=Config.OUTBOUND_BACKOFF_MAX,
+        on_sent=record_sent if Config.STATUS_TRACKING else None
+    )
+    runner = ConversationRunner(db, client, Config.ASYNC_MAX_IN_FLIGHT)
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        await db.start()
+        app.state.runner = runner
+        yield
+        await runner.drain(Config.WEBHOOK_DRAIN_TIMEOUT)
+        await client.close()
+        await db.close()
+    
+    return Starlette(
+        routes=[
+            Route('/webhook', webhook, methods=['GET', 'POST']),
+            Route('/health/async', async_stats, methods=['GET']),
+            Mount('/', app=WSGIMiddleware(flask_app))
+        ],
+        lifespan=lifespan
+    )
\ No newline at end of file
@@ -0,0 +1,365 @@
+# batch_writer.py - Buffered Batch Writer
+# Collects rows in memory and flushes them in batches, with an optional crash-safe journal
+
+import os
+import glob
+import json
+import time
+import fcntl
+import logging
+import threading
+from worker_pool import register_drain
+
+logger = logging.getLogger(__name__)
+
+# A segment still under its temporary name after this many seconds was abandoned mid-creation
+STALE_SEGMENT_AGE = 60
+
+def _fsync_dir(path):
+    """Make a file's creation, rename or removal in `path` durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class JournalSegment:
+    """One append-only journal file, locked for as long as its rows are unflushed. Rows are JSON arrays,
+    one per line; a {"discard": [line, count]} line cancels rows staged by a rolled-back transaction."""
+    
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+        self.lines = 0
+    
+    @classmethod
+    def create(cls, path):
+        """A new segment, locked before it appears under a name that _recover() would adopt"""
+        temp = path + '.new'
+        file = os.fdopen(os.open(temp, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644), 'a+b')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            os.rename(temp, path)
+        except OSError:
+            file.close()
+            raise
+        _fsync_dir(os.path.dirname(path))
+        return cls(path, file)
+    
+    @classmethod
+    def adopt(cls, path):
+        """Lock a segment left behind; raises OSError while the process that wrote it is alive"""
+        file = open(path, 'a+b')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            raise
+        return cls(path, file)
+    
+    def _write(self, lines):
+        self.file.write(b''.join(json.dumps(line).encode('utf-8') + b'\n' for line in lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        first = self.lines
+        self.lines += len(lines)
+        return first
+    
+    def append(self, row):
+        return self._write([row])
+    
+    def extend(self, rows):
+        """Write rows with one fsync; returns the line number of the first"""
+        return self._write(rows)
+    
+    def cancel(self, first, count):
+        self._write([{'discard': [first, count]}])
+    
+    def read(self):
+        self.file.seek(0)
+        rows = {}
+        discarded = set()
+        for number, line in enumerate(self.file):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-write was never acknowledged
+                logger.warning("Skipping unreadable line in journal %s", self.path)
+                continue
+            if isinstance(entry, dict):
+                first, count = entry['discard']
+                discarded.update(range(first, first + count))
+            else:
+                rows[number] = entry
+            self.lines = number + 1
+        return [row for number, row in rows.items() if number not in discarded]
+    
+    def remove(self):
+        os.unlink(self.path)
+        self.file.close()
+        _fsync_dir(os.path.dirname(self.path))
+
+class _Block:
+    """Rows journaled in one segment. They are flushed together, so the segment goes once they are written."""
+    
+    def __init__(self, segment=None, rows=None):
+        self.segment = segment
+        self.rows = rows or []
+        self.staged = 0         # staged tickets not yet released or discarded
+        self.closed = False     # a flush has started on it, so it takes no new rows
+        self.queued = False     # in BatchWriter._blocks, waiting for a flush
+
+class BatchWriter:
+    """Buffers rows and passes them to flush(rows) once max_batch rows or max_delay seconds accumulate.
+    With a journal, each segment holds at most about max_batch rows and is removed as soon as the batch
+    that wrote them commits, so a failure later in a flush never replays rows already written."""
+    
+    def __init__(self, name, flush, max_batch, max_delay, journal_dir=None, drain_order=3):
+        self.name = name
+        self.flush_rows = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.journal_dir = journal_dir
+        self.drain_order = drain_order
+        
+        self._blocks = []
+        self._open = None
+        self._buffered = 0
+        self._first_buffered = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._running = True
+        self._segment_seq = 0
+        
+        # Metrics
+        self._batches = 0
+        self._rows = 0
+        self._failures = 0
+        self._replayed = 0
+        self._last_batch = 0
+        self._max_batch_seen = 0
+        self._flush_last = 0.0
+        self._flush_max = 0.0
+        self._flush_total = 0.0
+        
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+            self._recover()
+        
+        self._thread = threading.Thread(target=self._run, name=f"{name}-flusher", daemon=True)
+        self._thread.start()
+        register_drain(self)
+    
+    def _new_segment(self):
+        self._segment_seq += 1
+        path = os.path.join(self.journal_dir, f"{self.name}-{os.getpid()}-{int(time.time())}-{self._segment_seq}.jsonl")
+        return JournalSegment.create(path)
+    
+    def _recover(self):
+        """Adopt journal segments left behind by dead processes and re-buffer their rows"""
+        pattern = os.path.join(self.journal_dir, f"{self.name}-*.jsonl")
+        for path in glob.glob(pattern + '.new'):
+            # Left by a crash between creating a segment and naming it, so nothing was written to it
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_SEGMENT_AGE:
+                    JournalSegment.adopt(path).remove()
+            except OSError:
+                continue
+        for path in sorted(glob.glob(pattern)):
+            try:
+                segment = JournalSegment.adopt(path)
+            except OSError:
+                # Still owned by a live worker
+                continue
+            block = _Block(segment, segment.read())
+            block.closed = True
+            with self._cond:
+                self._queue(block, len(block.rows))
+            self._replayed += len(block.rows)
+        if self._replayed:
+            logger.warning("Replaying %d unflushed %s row(s) from journal", self._replayed, self.name)
+    
+    def _queue(self, block, count):
+        """Queue a block for the next flush with `count` more rows; call holding self._cond"""
+        if not block.queued:
+            block.queued = True
+            self._blocks.append(block)
+        if count and not self._buffered:
+            self._first_buffered = time.monotonic()
+        self._buffered += count
+        if self._buffered >= self.max_batch:
+            self._cond.notify()
+    
+    def _open_block(self):
+        """The block taking new rows, rotated once its segment reaches max_batch lines; call holding self._cond"""
+        block = self._open
+        if block is not None:
+            size = block.segment.lines if block.segment is not None else len(block.rows)
+            if size < self.max_batch:
+                return block
+            block.closed = True
+        block = self._open = _Block(self._new_segment() if self.journal_dir else None)
+        self._queue(block, 0)
+        return block
+    
+    def add(self, row):
+        """Buffer a row. With a journal, the row is on disk when this returns."""
+        with self._cond:
+            block = self._open_block()
+            if block.segment is not None:
+                block.segment.append(row)
+            block.rows.append(row)
+            self._queue(block, 1)
+    
+    def stage(self, rows):
+        """Journal rows without buffering them: for callers that must make rows durable before their own
+        commit. Pass the returned ticket to release() after the commit or discard() if it fails."""
+        with self._cond:
+            block = self._open_block()
+            first = block.segment.extend(rows) if block.segment is not None else None
+            block.staged += 1
+            return rows, block, first
+    
+    def release(self, ticket):
+        """Buffer staged rows for flushing in their segment's block"""
+        rows, block, _ = ticket
+        with self._cond:
+            block.staged -= 1
+            block.rows.extend(rows)
+            self._queue(block, len(rows))
+    
+    def discard(self, ticket):
+        """Drop staged rows whose transaction rolled back"""
+        rows, block, first = ticket
+        with self._cond:
+            block.staged -= 1
+            finished = self._take_finished(block)
+            if finished is None and block.segment is not None:
+                block.segment.cancel(first, len(rows))
+        if finished is not None:
+            self._remove_segments([finished])
+    
+    def _take_finished(self, block):
+        """Detach and return a block's segment once everything in it is written or cancelled, so exactly
+        one caller removes it; call holding self._cond"""
+        if block.segment is None or not block.closed or block.staged or block.rows or block.queued:
+            return None
+        segment, block.segment = block.segment, None
+        return segment
+    
+    def _remove_segments(self, segments):
+        for segment in segments:
+            try:
+                segment.remove()
+            except OSError as e:
+                # Its rows are written; a leftover file only means they are replayed once more
+                logger.error("Could not remove %s journal %s: %s", self.name, segment.path, e)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._buffered >= self.max_batch:
+                        break
+                    if self._buffered and time.monotonic() - self._first_buffered >= self.max_delay:
+                        break
+                    timeout = self.max_delay
+                    if self._buffered:
+                        timeout = max(self.max_delay - (time.monotonic() - self._first_buffered), 0.001)
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+            self.flush()
+    
+    def flush(self):
+        """Write everything buffered so far. Returns False if the flush failed (unwritten rows stay buffered)."""
+        with self._flush_lock:
+            with self._cond:
+                if not self._blocks:
+                    return True
+                # Rows added during the flush go to a new block and segment
+                if self._open is not None:
+                    self._open.closed = True
+                    self._open = None
+                taken = []
+                for block in self._blocks:
+                    block.queued = False
+                    taken.append((block, block.rows))
+                    block.rows = []
+                self._blocks = []
+                self._buffered = 0
+            
+            started = time.monotonic()
+            written = 0
+            done = 0
+            try:
+                while done < len(taken):
+                    # Whole blocks per batch, so each segment is removed as soon as its rows commit
+                    end = done
+                    batch = []
+                    while end < len(taken) and (not batch or len(batch) + len(taken[end][1]) <= self.max_batch):
+                        batch.extend(taken[end][1])
+                        end += 1
+                    if batch:
+                        self.flush_rows(batch)
+                    written += len(batch)
+                    with self._cond:
+                        finished = [self._take_finished(block) for block, _ in taken[done:end]]
+                    done = end
+                    self._remove_segments([segment for segment in finished if segment is not None])
+            except Exception as e:
+                with self._cond:
+                    # Put the unwritten blocks back in front of anything added meanwhile and retry next cycle
+                    unwritten = []
+                    for block, rows in taken[done:]:
+                        block.rows = rows + block.rows
+                        if block.queued:
+                            self._blocks.remove(block)
+                        block.queued = True
+                        unwritten.append(block)
+                    self._blocks = unwritten + self._blocks
+                    self._buffered = sum(len(block.rows) for block in self._blocks)
+                    self._first_buffered = time.monotonic()
+                    self._failures += 1
+                    unwritten_rows = sum(len(rows) for _, rows in taken[done:])
+                logger.error("Error flushing %d %s row(s): %s", unwritten_rows, self.name, e)
+                return False
+            
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._batches += 1
+                self._rows += written
+                self._last_batch = written
+                self._max_batch_seen = max(self._max_batch_seen, written)
+                self._flush_last = elapsed
+                self._flush_max = max(self._flush_max, elapsed)
+                self._flush_total += elapsed
+            return True
+    
+    def shutdown(self):
+        """Stop the flusher thread and force a final flush"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=self.max_delay + 1)
+        if not self.flush():
+            logger.error("Final %s flush failed; rows remain in the journal for replay", self.name)
+    
+    def stats(self):
+        """Batch size and flush latency metrics"""
+        with self._cond:
+            return {
+                'buffered': self._buffered,
+                'batches': self._batches,
+                'rows': self._rows,
+                'failures': self._failures,
+                'replayed': self._replayed,
+                'batch_size_last': self._last_batch,
+                'batch_size_max': self._max_batch_seen,
+                'batch_size_avg': round(self._rows / self._batches, 2) if self._batches else 0.0,
+                'flush_latency_last': round(self._flush_last, 6),
+                'flush_latency_max': round(self._flush_max, 6),
+                'flush_latency_avg': round(self._flush_total / self._batches, 6) if self._batches else 0.0
+            }
\ No newline at end of file
@@ -0,0 +1,93 @@
+# bench_async.py - Sync vs Async Serving Benchmark
+# Drives new conversations through gunicorn (sync) and uvicorn (async_app) against a stub Graph API
+#
+# Usage: python benchmarks/bench_async.py [--mode both] [--conversations 2000] [--concurrency 50]
+#                                         [--graph-latency 0.1] [--workers 4]
+#
+# Needs the MySQL settings from .env; every run uses fresh phone numbers.
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import StubGraphAPI, text_webhook, sign, start_server, stop_server, percentile
+from config import Config
+
+# A new user's "hi" is answered with a welcome text and the category list, one send when coalesced
+REPLIES_PER_CONVERSATION = 1 if Config.COALESCE_REPLIES else 2
+
+def run(mode, args, graph_port, port):
+    stub = StubGraphAPI(graph_port, latency=args.graph_latency)
+    process = start_server(mode, port, graph_port, args.workers)
+    url = f"http://127.0.0.1:{port}/webhook"
+    prefix = f"9{random.randint(10 ** 8, 10 ** 9 - 1)}"
+    phones = [f"{prefix}{i:04d}" for i in range(args.conversations)]
+    sent_at = {}
+    local = threading.local()
+    
+    def post(wa_id):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        body, headers = sign(text_webhook(wa_id, f"wamid.bench.{wa_id}", "hi"))
+        sent_at[wa_id] = time.monotonic()
+        return local.session.post(url, data=body, headers=headers, timeout=30).status_code
+    
+    try:
+        started = time.monotonic()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            statuses = list(pool.map(post, phones))
+        acked = time.monotonic() - started
+        
+        deadline = time.monotonic() + args.timeout
+        while stub.completed(REPLIES_PER_CONVERSATION) < len(phones) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - started
+    finally:
+        stop_server(process)
+        stub.shutdown()
+    
+    latencies = [
+        stub.replies[phone][REPLIES_PER_CONVERSATION - 1][0] - sent_at[phone]
+        for phone in phones if len(stub.replies.get(phone, ())) >= REPLIES_PER_CONVERSATION
+    ]
+    return {
+        'mode': mode,
+        'accepted': statuses.count(200),
+        'ack_rate': len(phones) / acked,
+        'completed': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync (gunicorn) and async (uvicorn) serving throughput")
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50, help="Concurrent webhook senders")
+    parser.add_argument('--graph-latency', type=float, default=0.1, help="Stub Graph API latency in seconds")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers in sync mode")
+    parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for all replies")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--graph-port', type=int, default=5056)
+    args = parser.parse_args()
+    
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    results = [run(mode, args, args.graph_port, args.port) for mode in modes]
+    
+    print(f"{'mode':<7}{'accepted':>10}{'ack/s':>10}{'completed':>11}{'conv/s':>9}{'p50 (s)':>9}{'p95 (s)':>9}{'p99 (s)':>9}")
+    for r in results:
+        print(f"{r['mode']:<7}{r['accepted']:>10}{r['ack_rate']:>10.0f}{r['completed']:>11}{r['throughput']:>9.1f}"
+              f"{r['p50']:>9.3f}{r['p95']:>9.3f}{r['p99']:>9.3f}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
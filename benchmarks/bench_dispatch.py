@@ -0,0 +1,69 @@
+# bench_dispatch.py - Conversation Dispatch Benchmark
+# Per-message cost of the compiled transition table, and how it scales with the number of survey steps
+#
+# Usage: python benchmarks/bench_dispatch.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from conversation import ConversationEngine, SURVEY_FLOW, NEW, event_of
+from message_handler import decide
+from webhook_parser import InboundMessage
+
+PHONE = "919876543210"
+
+def message(reply_type=None, reply_id=None, text=None):
+    return InboundMessage('wamid.bench', PHONE, 'interactive' if reply_type else 'text', '0',
+                          text, reply_type, reply_id, reply_id)
+
+# (stored state, message) pairs in the proportions one survey produces them
+MESSAGES = [
+    (None, message(text="hi")),
+    ({'current_state': 'WELCOME', 'selected_category': None}, message('list_reply', Config.CATEGORIES[0])),
+    ({'current_state': 'AWAITING_RATING', 'selected_category': Config.CATEGORIES[0]}, message('button_reply', 'rating_4')),
+    ({'current_state': 'AWAITING_MORE_FEEDBACK', 'selected_category': Config.CATEGORIES[0]}, message('button_reply', 'btn_1')),
+    ({'current_state': 'COMPLETED', 'selected_category': None}, message(text="thanks"))
+]
+
+def padded_flow(extra_states):
+    """The survey plus a chain of extra button steps, as a longer survey would add"""
+    flow = {state: dict(steps) for state, steps in SURVEY_FLOW.items()}
+    previous = 'COMPLETED'
+    for i in range(extra_states):
+        name = f"EXTRA_{i}"
+        flow[previous] = dict(flow.get(previous, {}), **{'button_reply:next': {'to': name, 'text': f"Step {i}"}})
+        flow[name] = {}
+        previous = name
+    return flow
+
+def lookup_cost(engine, iterations):
+    keys = [((state or {}).get('current_state', NEW),) + event_of(m) for state, m in MESSAGES]
+    lookup = engine.lookup
+    
+    def run():
+        for key in keys:
+            lookup(*key)
+    return min(timeit.repeat(run, number=iterations, repeat=3)) / (iterations * len(keys)) * 1e9
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    
+    def run_decide():
+        for state, m in MESSAGES:
+            decide(m, PHONE, state)
+    decide_ns = min(timeit.repeat(run_decide, number=iterations // 10, repeat=3)) / (iterations // 10 * len(MESSAGES)) * 1e9
+    print(f"decide() incl. rendering: {decide_ns / 1000:.2f} us/message")
+    
+    print(f"{'extra states':>12}{'transitions':>13}{'compile (ms)':>14}{'lookup (ns)':>13}")
+    for extra in (0, 10, 100, 1000):
+        flow = padded_flow(extra)
+        compile_ms = min(timeit.repeat(lambda: ConversationEngine(flow), number=1, repeat=3)) * 1000
+        engine = ConversationEngine(flow)
+        print(f"{extra:>12}{len(engine.table):>13}{compile_ms:>14.2f}{lookup_cost(engine, iterations):>13.0f}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,81 @@
+# bench_logging.py - Logging Overhead Benchmark
+# Compares the per-request cost of synchronous f-string logging with the queued, lazy setup
+#
+# Usage: python benchmarks/bench_logging.py [requests]
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_setup import configure_logging, stop_logging, redact, redact_payload, should_log_payload
+
+PHONE = "919876543210"
+PAYLOAD = json.dumps({
+    "object": "whatsapp_business_account",
+    "entry": [{"changes": [{"value": {
+        "contacts": [{"wa_id": PHONE}],
+        "messages": [{"from": PHONE, "id": "wamid.HBgM", "type": "interactive",
+                      "interactive": {"type": "button_reply", "button_reply": {"id": "rating_4", "title": "4 ★★★★"}}}]
+    }}]}]
+}).encode('utf-8')
+
+def old_request(logger):
+    # What one rating reply used to log: the whole body, a state change and three sends, all at INFO
+    logger.info(f"Received webhook: {json.loads(PAYLOAD)}")
+    logger.info(f"Feedback saved: {PHONE} -> QLINE (4 stars)")
+    logger.info(f"User state updated: {PHONE} -> AWAITING_MORE_FEEDBACK (N/A)")
+    for description in ("message", "interactive message", "category list"):
+        logger.info(f"{description.capitalize()} sent to {PHONE}")
+
+def new_request(logger):
+    logger.debug("Received %s webhook (%d bytes)", "messages", len(PAYLOAD))
+    if should_log_payload(logger):
+        logger.debug("Webhook payload: %s", redact_payload(PAYLOAD))
+    logger.debug("Feedback saved: %s -> %s (%s stars)", redact(PHONE), "QLINE", 4)
+    logger.debug("User state updated: %s -> %s (%s)", redact(PHONE), "AWAITING_MORE_FEEDBACK", 'N/A')
+    for description in ("message", "interactive message", "category list"):
+        logger.debug("Sent %s to %s", description, redact(PHONE))
+    # The one line a request still logs at INFO goes through the queue
+    logger.info("Duplicate delivery of message %s suppressed", "wamid.HBgM")
+
+def measure(request, logger, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        request(logger)
+    return (time.perf_counter() - started) / requests * 1e6
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    root = logging.getLogger()
+    sink = open(os.path.join(tempfile.gettempdir(), 'bench_logging.log'), 'w')
+    
+    # Before: a synchronous stream handler formatting on the calling thread
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    old_time = measure(old_request, logging.getLogger('bench.old'), requests)
+    root.removeHandler(handler)
+    
+    # After: the queued setup, with the listener writing to the same file
+    sys.stderr, stderr = sink, sys.stderr
+    try:
+        configure_logging()
+        new_time = measure(new_request, logging.getLogger('bench.new'), requests)
+        stop_logging()
+    finally:
+        sys.stderr = stderr
+    sink.close()
+    
+    print(f"{'setup':<25}{'per request (us)':>18}")
+    print(f"{'sync f-string, INFO':<25}{old_time:>18.2f}")
+    print(f"{'queued, lazy, gated':<25}{new_time:>18.2f}")
+    print(f"speedup: {old_time / new_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
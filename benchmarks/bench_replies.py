@@ -0,0 +1,83 @@
+# bench_replies.py - Reply Coalescing Benchmark
+# Walks simulated surveys through decide() and counts outbound Graph API calls per completed survey
+#
+# Usage: python benchmarks/bench_replies.py [--surveys 10000] [--more-feedback 0.5] [--max-rounds 3]
+#                                           [--graph-latency 0.15]
+#
+# No database or network: only the conversation logic runs, once with COALESCE_REPLIES off and once on.
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from message_handler import decide
+from webhook_parser import InboundMessage
+
+PHONE = "919876543210"
+
+def text(body):
+    return InboundMessage('wamid.bench', PHONE, 'text', '0', body, None, None, None)
+
+def reply(reply_type, reply_id):
+    return InboundMessage('wamid.bench', PHONE, 'interactive', '0', None, reply_type, reply_id, reply_id)
+
+def survey(rng, args):
+    """One respondent from "hi" to the closing message; returns (calls, payload bytes)"""
+    state = None
+    calls = 0
+    sent_bytes = 0
+    
+    def step(message):
+        nonlocal state, calls, sent_bytes
+        decision = decide(message, PHONE, state)
+        if decision.state is not None:
+            category = decision.category if decision.category is not None else (state or {}).get('selected_category')
+            state = {'current_state': decision.state, 'selected_category': category}
+        calls += len(decision.replies)
+        sent_bytes += sum(len(data) for _, data in decision.replies)
+    
+    step(text("hi"))
+    for round_number in range(args.max_rounds):
+        step(reply('list_reply', rng.choice(Config.CATEGORIES)))
+        step(reply('button_reply', f"rating_{rng.randint(1, 5)}"))
+        if round_number + 1 < args.max_rounds and rng.random() < args.more_feedback:
+            step(reply('button_reply', 'btn_1'))
+            continue
+        break
+    step(reply('button_reply', 'btn_2'))
+    assert state['current_state'] == 'COMPLETED'
+    return calls, sent_bytes
+
+def run(coalesce, args):
+    Config.COALESCE_REPLIES = coalesce
+    # Same respondents for both settings
+    rng = random.Random(args.seed)
+    results = [survey(rng, args) for _ in range(args.surveys)]
+    calls = sum(c for c, _ in results)
+    sent_bytes = sum(b for _, b in results)
+    return calls / args.surveys, sent_bytes / args.surveys
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound calls per completed survey, with and without coalescing")
+    parser.add_argument('--surveys', type=int, default=10000)
+    parser.add_argument('--more-feedback', type=float, default=0.5, help="Chance of rating another category")
+    parser.add_argument('--max-rounds', type=int, default=3, help="Most categories one user rates")
+    parser.add_argument('--graph-latency', type=float, default=0.15, help="Assumed Graph API round trip in seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    # A user's replies are sent one after another, so each call adds a round trip to their wait
+    print(f"{'coalesce':<10}{'calls/survey':>14}{'bytes/survey':>14}{'graph wait/survey (s)':>24}")
+    baseline = None
+    for coalesce in (False, True):
+        calls, sent_bytes = run(coalesce, args)
+        print(f"{'on' if coalesce else 'off':<10}{calls:>14.2f}{sent_bytes:>14.0f}{calls * args.graph_latency:>24.2f}")
+        baseline = baseline or calls
+    print(f"Outbound calls saved: {1 - calls / baseline:.1%}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+# bench_templates.py - Payload Template Benchmark
+# Compares building + serializing message dicts per send with rendering pre-serialized templates
+#
+# Usage: python benchmarks/bench_templates.py [iterations]
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whatsapp_api import (
+    build_text_payload, build_buttons_payload, build_rating_payload, build_category_list_payload,
+    TEXT_TEMPLATE, RATING_TEMPLATE, CATEGORY_LIST_TEMPLATE, RATING_BODY, CATEGORY_LIST_BODY, _buttons_template
+)
+
+PHONE = "919876543210"
+BUTTONS = ["Yes", "No"]
+
+def dict_path(builder, *args):
+    # What requests does with json=: build the dict, then serialize it
+    return json.dumps(builder(PHONE, *args)).encode('utf-8')
+
+CASES = [
+    (
+        "text",
+        lambda: dict_path(build_text_payload, "Please rate your experience with QLINE:"),
+        lambda: TEXT_TEMPLATE.render(to=PHONE, body="Please rate your experience with QLINE:")
+    ),
+    (
+        "buttons",
+        lambda: dict_path(build_buttons_payload, "Provide More Feedback?", "Another category?", BUTTONS),
+        lambda: _buttons_template("Provide More Feedback?", tuple(BUTTONS)).render(to=PHONE, body="Another category?")
+    ),
+    (
+        "rating",
+        lambda: dict_path(build_rating_payload),
+        lambda: RATING_TEMPLATE.render(to=PHONE, body=RATING_BODY)
+    ),
+    (
+        "category_list",
+        lambda: dict_path(build_category_list_payload),
+        lambda: CATEGORY_LIST_TEMPLATE.render(to=PHONE, body=CATEGORY_LIST_BODY)
+    )
+]
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{'payload':<15}{'dict+json (us)':>16}{'template (us)':>16}{'speedup':>10}")
+    for name, old, new in CASES:
+        # Both paths must produce the same message
+        assert json.loads(old()) == json.loads(new()), name
+        old_time = min(timeit.repeat(old, number=iterations, repeat=3)) / iterations * 1e6
+        new_time = min(timeit.repeat(new, number=iterations, repeat=3)) / iterations * 1e6
+        print(f"{name:<15}{old_time:>16.2f}{new_time:>16.2f}{old_time / new_time:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
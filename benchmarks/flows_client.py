@@ -0,0 +1,88 @@
+# flows_client.py - Local WhatsApp Flows Client
+# Encrypts data-exchange requests the way the WhatsApp client does and decrypts the endpoint's replies
+#
+# Usage: python benchmarks/flows_client.py [--url http://127.0.0.1:5000/flows] [--phone 919876543210]
+#
+# Runs ping, INIT and a full RATE submission. Signs requests with APP_SECRET and mints the flow
+# token with it, so use the same .env as the app.
+
+import os
+import sys
+import json
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import requests
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+def load_public_key(path=None):
+    with open(path or Config.PUBLIC_KEY_PATH, 'rb') as f:
+        return serialization.load_pem_public_key(f.read())
+
+def encrypt_request(payload, public_key):
+    """Encrypt a request body with a fresh AES-128 key; returns (body dict, aes_key, iv)"""
+    aes_key = AESGCM.generate_key(bit_length=128)
+    iv = os.urandom(16)
+    encrypted_data = AESGCM(aes_key).encrypt(iv, json.dumps(payload).encode('utf-8'), None)
+    encrypted_key = public_key.encrypt(aes_key, padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    ))
+    return {
+        "encrypted_flow_data": base64.b64encode(encrypted_data).decode('ascii'),
+        "encrypted_aes_key": base64.b64encode(encrypted_key).decode('ascii'),
+        "initial_vector": base64.b64encode(iv).decode('ascii')
+    }, aes_key, iv
+
+def decrypt_response(text, aes_key, iv):
+    """Decrypt a base64 response body encrypted with the flipped IV"""
+    flipped_iv = bytes(byte ^ 0xFF for byte in iv)
+    return json.loads(AESGCM(aes_key).decrypt(flipped_iv, base64.b64decode(text), None))
+
+def call(session, url, public_key, payload):
+    body, aes_key, iv = encrypt_request(payload, public_key)
+    raw = json.dumps(body).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if Config.APP_SECRET:
+        signature = hmac.new(Config.APP_SECRET.encode('utf-8'), raw, hashlib.sha256).hexdigest()
+        headers['X-Hub-Signature-256'] = f"sha256={signature}"
+    response = session.post(url, data=raw, headers=headers, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f"{payload['action']}: HTTP {response.status_code}")
+    return decrypt_response(response.text, aes_key, iv)
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the Flows data-exchange endpoint like the WhatsApp client")
+    parser.add_argument('--url', default='http://127.0.0.1:5000/flows')
+    parser.add_argument('--phone', default='919876543210', help="Respondent the flow token is minted for")
+    parser.add_argument('--public-key', help="Public key file (default: PUBLIC_KEY_PATH)")
+    args = parser.parse_args()
+    
+    from whatsapp_api import make_flow_token
+    
+    public_key = load_public_key(args.public_key)
+    flow_token = make_flow_token(args.phone)
+    session = requests.Session()
+    
+    print("ping:", call(session, args.url, public_key, {"version": "3.0", "action": "ping"}))
+    screen = call(session, args.url, public_key, {"version": "3.0", "action": "INIT", "flow_token": flow_token})
+    print("INIT:", screen["screen"], [category["id"] for category in screen["data"]["categories"]])
+    
+    ratings = {category["id"]: str(random.randint(1, 5)) for category in screen["data"]["categories"]}
+    done = call(session, args.url, public_key, {
+        "version": "3.0", "action": "data_exchange", "screen": screen["screen"],
+        "flow_token": flow_token, "data": dict(ratings, feedback="Submitted by flows_client.py")
+    })
+    print("submit:", done["screen"], ratings)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+# harness.py - Benchmark Harness
+# Stub Graph API, signed webhook payloads and server launchers shared by the end-to-end benchmarks
+
+import os
+import sys
+import json
+import hmac
+import time
+import random
+import hashlib
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SECRET = 'bench-secret'
+
+class StubGraphAPI:
+    """Threaded stand-in for the messages endpoint with configurable latency and failure rates.
+    Every accepted message is recorded per recipient; wait_for() blocks until a recipient has enough."""
+    
+    def __init__(self, port, latency=0.0, error_rate=0.0, throttle_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.replies = {}
+        self.injected = {'errors': 0, 'throttled': 0}
+        self.cond = threading.Condition()
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, out = stub.respond(body)
+                out = json.dumps(out).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def respond(self, body):
+        roll = random.random()
+        if roll < self.throttle_rate:
+            with self.cond:
+                self.injected['throttled'] += 1
+            return 429, {"error": {"code": 130429, "message": "Rate limit hit"}}
+        if roll < self.throttle_rate + self.error_rate:
+            with self.cond:
+                self.injected['errors'] += 1
+            return 500, {"error": {"code": 1, "message": "Injected failure"}}
+        with self.cond:
+            self.replies.setdefault(body['to'], []).append((time.monotonic(), body))
+            self.cond.notify_all()
+        return 200, {"messages": [{"id": f"wamid.{random.getrandbits(64):x}"}]}
+    
+    def count(self, recipient):
+        with self.cond:
+            return len(self.replies.get(recipient, ()))
+    
+    def wait_for(self, recipient, count, timeout):
+        """Wait until `recipient` has received `count` messages; returns the time of the last one, or None"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while len(self.replies.get(recipient, ())) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            return self.replies[recipient][count - 1][0]
+    
+    def completed(self, count):
+        with self.cond:
+            return sum(1 for replies in self.replies.values() if len(replies) >= count)
+    
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _envelope(wa_id, message):
+    message = dict(message, **{"from": wa_id, "timestamp": str(int(time.time()))})
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": os.getenv('PHONE_NUMBER_ID', 'bench')},
+            "contacts": [{"profile": {"name": "Load Test"}, "wa_id": wa_id}],
+            "messages": [message]
+        }}]}]
+    }
+
+def text_webhook(wa_id, message_id, text):
+    return _envelope(wa_id, {"id": message_id, "type": "text", "text": {"body": text}})
+
+def list_reply_webhook(wa_id, message_id, row_id, title):
+    return _envelope(wa_id, {"id": message_id, "type": "interactive", "interactive": {
+        "type": "list_reply", "list_reply": {"id": row_id, "title": title}
+    }})
+
+def button_reply_webhook(wa_id, message_id, button_id, title):
+    return _envelope(wa_id, {"id": message_id, "type": "interactive", "interactive": {
+        "type": "button_reply", "button_reply": {"id": button_id, "title": title}
+    }})
+
+def sign(payload, secret=APP_SECRET):
+    """Serialize a webhook payload and return (body, headers) signed like Meta does"""
+    body = json.dumps(payload).encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return body, {'X-Hub-Signature-256': f"sha256={signature}", 'Content-Type': 'application/json'}
+
+def start_server(mode, port, graph_port, workers=4, extra_env=None):
+    """Launch the app under gunicorn (sync) or uvicorn (async) pointed at the stub Graph API"""
+    env = dict(os.environ, APP_SECRET=APP_SECRET, GRAPH_API_URL=f"http://127.0.0.1:{graph_port}",
+               PHONE_NUMBER_ID=os.getenv('PHONE_NUMBER_ID', 'bench'), LOG_LEVEL='WARNING',
+               GRAPH_API_RATE='100000', GRAPH_API_BURST='100000', **(extra_env or {}))
+    # Workers only check the schema version; bring the benchmark database up to date first
+    subprocess.run([sys.executable, 'manage.py', 'migrate'], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    
+    if mode == 'sync':
+        command = ['gunicorn', '-w', str(workers), '-b', f"127.0.0.1:{port}", 'app:create_app()']
+    else:
+        command = ['uvicorn', 'async_app:create_async_app', '--factory', '--port', str(port), '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{mode} server did not start")
+
+def stop_server(process):
+    process.terminate()
+    process.wait()
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))] if values else 0.0
\ No newline at end of file
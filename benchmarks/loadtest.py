@@ -0,0 +1,213 @@
+# loadtest.py - End-to-End Load Test
+# Simulates whole survey conversations from many wa_ids against the app and a local Graph API stub
+#
+# Usage: python benchmarks/loadtest.py [--mode sync|async] [--url URL] [--users 5000] [--concurrency 200]
+#                                      [--graph-latency 0.05] [--error-rate 0.01] [--throttle-rate 0.0]
+#                                      [--max-p95 SECONDS] [--max-error-rate FRACTION]
+#
+# Uses the MySQL server from .env with its own database (--db-name), created and migrated on launch.
+# With --url the app is not started; point its GRAPH_API_URL at the stub port yourself.
+# Exits 1 when a --max-* threshold is exceeded, so it can gate a deployment.
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import (
+    StubGraphAPI, text_webhook, list_reply_webhook, button_reply_webhook, sign,
+    start_server, stop_server, percentile
+)
+from config import Config
+
+# A text followed by an interactive message is one send when coalesced (same env as the app)
+PAIR = 1 if Config.COALESCE_REPLIES else 2
+
+# Each step of a conversation and how many replies the bot sends for it
+STEP_REPLIES = {
+    'welcome': PAIR,       # welcome text + category list
+    'category': PAIR,      # rating prompt + rating buttons
+    'rating': PAIR,        # thank-you text + "more feedback?" buttons
+    'more_feedback': 1,    # category list again
+    'finish': 1            # closing text
+}
+
+class Conversation:
+    """One simulated respondent walking through the survey, waiting for the bot's replies at each step"""
+    
+    def __init__(self, wa_id, session, url, stub, args, results):
+        self.wa_id = wa_id
+        self.session = session
+        self.url = url
+        self.stub = stub
+        self.args = args
+        self.results = results
+        self.expected = stub.count(wa_id)
+        self.sequence = 0
+    
+    def step(self, name, payload):
+        body, headers = sign(payload)
+        started = time.monotonic()
+        try:
+            status = self.session.post(self.url, data=body, headers=headers, timeout=30).status_code
+        except requests.exceptions.RequestException:
+            status = 'connection error'
+        acked = time.monotonic()
+        self.results.record_ack(acked - started, status)
+        if status != 200:
+            return False
+        
+        self.expected += STEP_REPLIES[name]
+        replied = self.stub.wait_for(self.wa_id, self.expected, self.args.step_timeout)
+        if replied is None:
+            self.results.record_error(f"{name} timeout")
+            return False
+        self.results.record_step(name, replied - started)
+        return True
+    
+    def message_id(self):
+        self.sequence += 1
+        return f"wamid.load.{self.wa_id}.{self.sequence}"
+    
+    def run(self):
+        started = time.monotonic()
+        if not self.step('welcome', text_webhook(self.wa_id, self.message_id(), "hi")):
+            return
+        for round_number in range(self.args.max_rounds):
+            category = random.choice(Config.CATEGORIES)
+            if not self.step('category', list_reply_webhook(self.wa_id, self.message_id(), category, category.title())):
+                return
+            rating = random.randint(1, 5)
+            if not self.step('rating', button_reply_webhook(self.wa_id, self.message_id(), f"rating_{rating}", str(rating))):
+                return
+            if round_number + 1 < self.args.max_rounds and random.random() < self.args.more_feedback:
+                if not self.step('more_feedback', button_reply_webhook(self.wa_id, self.message_id(), 'btn_1', "Yes")):
+                    return
+                continue
+            break
+        if self.step('finish', button_reply_webhook(self.wa_id, self.message_id(), 'btn_2', "No")):
+            self.results.record_conversation(time.monotonic() - started)
+
+class Results:
+    """Thread-safe latency samples and error counts"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acks = []
+        self.steps = {name: [] for name in STEP_REPLIES}
+        self.conversations = []
+        self.errors = Counter()
+    
+    def record_ack(self, seconds, status):
+        with self.lock:
+            self.acks.append(seconds)
+            if status != 200:
+                self.errors[f"webhook {status}"] += 1
+    
+    def record_step(self, name, seconds):
+        with self.lock:
+            self.steps[name].append(seconds)
+    
+    def record_error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+    
+    def record_conversation(self, seconds):
+        with self.lock:
+            self.conversations.append(seconds)
+
+def report(results, stub, users, elapsed):
+    def row(name, values):
+        print(f"{name:<16}{len(values):>9}{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}"
+              f"{percentile(values, 99):>10.3f}{(max(values) if values else 0.0):>10.3f}")
+    
+    webhooks = len(results.acks)
+    print(f"Users: {users}   completed: {len(results.conversations)}   elapsed: {elapsed:.1f}s")
+    print(f"Throughput: {webhooks / elapsed:.1f} webhooks/s, {len(results.conversations) / elapsed:.1f} conversations/s")
+    print()
+    print(f"{'latency (s)':<16}{'count':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    row('webhook ack', results.acks)
+    for name, values in results.steps.items():
+        row(f"step {name}", values)
+    row('conversation', results.conversations)
+    print()
+    print(f"Stub Graph API: injected {stub.injected['errors']} error(s), {stub.injected['throttled']} throttle(s)")
+    if results.errors:
+        for kind, count in results.errors.most_common():
+            print(f"Error: {kind}: {count}")
+    else:
+        print("Errors: none")
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end survey load test against a stub Graph API")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync', help="How to launch the app")
+    parser.add_argument('--url', help="Webhook URL of an already running app (skips launching one)")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers in sync mode")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--graph-port', type=int, default=5056)
+    parser.add_argument('--db-name', default='ttd_survey_loadtest', help="Database the launched app uses")
+    parser.add_argument('--users', type=int, default=5000, help="Simulated wa_ids")
+    parser.add_argument('--concurrency', type=int, default=200, help="Conversations in progress at once")
+    parser.add_argument('--max-rounds', type=int, default=3, help="Most categories one user rates")
+    parser.add_argument('--more-feedback', type=float, default=0.5, help="Chance of rating another category")
+    parser.add_argument('--graph-latency', type=float, default=0.05, help="Stub Graph API latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="Fraction of sends answered with HTTP 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of sends answered with 429")
+    parser.add_argument('--step-timeout', type=float, default=60, help="Seconds to wait for a step's replies")
+    parser.add_argument('--max-p95', type=float, help="Fail if the p95 step latency exceeds this")
+    parser.add_argument('--max-error-rate', type=float, help="Fail if more than this fraction of users hit an error")
+    args = parser.parse_args()
+    
+    stub = StubGraphAPI(args.graph_port, latency=args.graph_latency,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    process = None
+    url = args.url
+    if url is None:
+        # Retries with short backoff so injected failures cost milliseconds, not the default seconds
+        process = start_server(args.mode, args.port, args.graph_port, args.workers, extra_env={
+            'DB_NAME': args.db_name, 'OUTBOUND_BACKOFF_BASE': '0.05', 'OUTBOUND_BACKOFF_MAX': '1'
+        })
+        url = f"http://127.0.0.1:{args.port}/webhook"
+    
+    prefix = f"8{random.randint(10 ** 6, 10 ** 7 - 1)}"
+    results = Results()
+    local = threading.local()
+    
+    def converse(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        Conversation(f"{prefix}{index:05d}", local.session, url, stub, args, results).run()
+    
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(converse, range(args.users)))
+    finally:
+        elapsed = time.monotonic() - started
+        if process is not None:
+            stop_server(process)
+        stub.shutdown()
+    
+    report(results, stub, args.users, elapsed)
+    
+    failed = False
+    step_latencies = [value for values in results.steps.values() for value in values]
+    if args.max_p95 is not None and percentile(step_latencies, 95) > args.max_p95:
+        print(f"FAIL: p95 step latency {percentile(step_latencies, 95):.3f}s exceeds {args.max_p95}s")
+        failed = True
+    error_rate = (args.users - len(results.conversations)) / args.users if args.users else 0.0
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        print(f"FAIL: {error_rate:.2%} of conversations failed, limit {args.max_error_rate:.2%}")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,404 @@
+# broadcast.py - Survey Invitation Broadcasts
+# Streams a recipient file and sends survey invitations under the Graph API rate limit, resumably
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+from database import get_db_connection
+from session_manager import SessionManager
+from batch_writer import BatchWriter
+from worker_pool import WorkerPool, shutdown_all
+from whatsapp_api import get_outbound, template_message
+from outbound import SharedTokenBucket
+from shared_state import SharedSlots
+from conversation import engine, NEW
+from logging_setup import redact
+
+logger = logging.getLogger(__name__)
+
+# broadcast_recipients.status
+QUEUED = 0      # claimed for sending; if the run died, whether it was sent is unknown
+SENT = 1
+FAILED = 2
+RELEASED = 3    # claimed but never attempted because the run was interrupted; sent first on resume
+STATUS_NAMES = {QUEUED: 'unknown', SENT: 'sent', FAILED: 'failed', RELEASED: 'released'}
+
+CLAIM_SQL = """
+    INSERT INTO broadcast_recipients (campaign, phone_number, status, seeded_state, previous_state)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+RESULT_SQL = """
+    INSERT INTO broadcast_recipients (campaign, phone_number, status, message_id) VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE status = VALUES(status), message_id = VALUES(message_id)
+"""
+# Put back the state of recipients the invitation never reached, unless they have moved on since
+RESTORE_STATES_SQL = """
+    UPDATE user_state us JOIN broadcast_recipients br ON br.phone_number = us.phone_number
+    SET us.current_state = COALESCE(br.previous_state, %s)
+    WHERE br.campaign = %s AND br.phone_number IN ({placeholders})
+        AND br.seeded_state IS NOT NULL AND us.current_state = br.seeded_state
+"""
+
+# Only recipients with nothing in progress are moved to the invitation's state; anyone part way
+# through a survey keeps their state, so their next tap still lands where they are
+SEEDABLE_STATES = (NEW, 'COMPLETED')
+
+# Campaign names also name the MySQL lock, which is limited to 64 characters
+_CAMPAIGN_RE = re.compile(r'^[A-Za-z0-9_.-]{1,48}$')
+
+# wa_id: country code and subscriber number without the +, 8 to 15 digits
+_PHONE_RE = re.compile(r'^[1-9][0-9]{7,14}$')
+_PHONE_PUNCTUATION = str.maketrans('', '', '+-(). ')
+
+class BroadcastError(RuntimeError):
+    """A campaign cannot start or continue"""
+
+def normalize_phone(value):
+    """wa_id for a recipient field ('+91 98765-43210' -> '919876543210'), or None if it is not a phone number"""
+    phone = value.strip().strip('"').translate(_PHONE_PUNCTUATION)
+    return phone if _PHONE_RE.match(phone) else None
+
+def read_recipients(path, offset=0):
+    """Yield (phone_number, offset after its line) for each non-blank line from `offset`, reading the
+    first CSV column. Lines without a phone number (such as a header) yield None."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            field = line.split(b',', 1)[0].decode('utf-8', 'replace')
+            if field.strip():
+                yield normalize_phone(field), offset
+
+def invitation(template=None, language='en'):
+    """(render, state) for a campaign: render(phone) gives the messages to send, state is what to seed"""
+    if template:
+        # Whatever the recipient replies to the template, NEW answers with the welcome and survey start
+        return (lambda phone_number: (template_message(phone_number, template, language),)), NEW
+    # Inside the 24-hour window, send what a new sender would get and seed the state that leaves them in
+    transition = engine.defaults[NEW]
+    return (lambda phone_number: engine.replies(transition, phone_number, None)), transition.state
+
+@contextmanager
+def campaign_lock(campaign):
+    """Hold a named MySQL lock for the run so two processes never send the same campaign"""
+    name = f"ttd_broadcast:{campaign}"
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        if cursor.fetchone()[0] != 1:
+            raise BroadcastError(f"Campaign {campaign} is being sent by another process")
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+            cursor.fetchone()
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def open_campaign(campaign, source, message_type):
+    """Create the campaign on its first run; returns its stored (source, message_type, file_offset)"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT IGNORE INTO broadcast_campaigns (name, source, message_type) VALUES (%s, %s, %s)",
+            (campaign, source, message_type)
+        )
+        cursor.execute("SELECT source, message_type, file_offset FROM broadcast_campaigns WHERE name = %s", (campaign,))
+        row = cursor.fetchone()
+        conn.commit()
+        return row
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def _seed_states(work, phone_numbers, state):
+    """Seed `state` for the recipients with nothing in progress; returns {phone: (seeded_state, previous_state)}"""
+    if not phone_numbers:
+        return {}
+    placeholders = ', '.join(['%s'] * len(phone_numbers))
+    # Locked so a message arriving meanwhile cannot move a recipient between the check and the seed
+    work.cursor.execute(
+        f"SELECT phone_number, current_state FROM user_state WHERE phone_number IN ({placeholders}) FOR UPDATE",
+        tuple(phone_numbers)
+    )
+    current = dict(work.cursor.fetchall())
+    seeded = [
+        phone_number for phone_number in phone_numbers
+        if current.get(phone_number, NEW) in SEEDABLE_STATES and current.get(phone_number) != state
+    ]
+    work.set_user_states(seeded, state)
+    return {phone_number: (state, current.get(phone_number)) for phone_number in seeded}
+
+def claim_recipients(campaign, phone_numbers, state, file_offset, on_claimed=None):
+    """Claim the recipients this campaign has not claimed before, seed their user_state and advance the
+    checkpoint, all in one transaction. Returns the newly claimed phone numbers, which are also passed
+    to on_claimed() before the commit."""
+    with SessionManager.transaction() as work:
+        claimed = set()
+        if phone_numbers:
+            placeholders = ', '.join(['%s'] * len(phone_numbers))
+            work.cursor.execute(
+                f"SELECT phone_number FROM broadcast_recipients WHERE campaign = %s AND phone_number IN ({placeholders})",
+                (campaign, *phone_numbers)
+            )
+            claimed = {row[0] for row in work.cursor.fetchall()}
+        fresh = [phone_number for phone_number in phone_numbers if phone_number not in claimed]
+        if fresh:
+            seeded = _seed_states(work, fresh, state)
+            work.cursor.executemany(CLAIM_SQL, [
+                (campaign, phone_number, QUEUED) + seeded.get(phone_number, (None, None)) for phone_number in fresh
+            ])
+        work.cursor.execute("UPDATE broadcast_campaigns SET file_offset = %s WHERE name = %s", (file_offset, campaign))
+        if on_claimed is not None:
+            on_claimed(fresh)
+    return fresh
+
+def reclaim_recipients(campaign, statuses, state, on_claimed=None):
+    """Claim again the recipients left in `statuses` by earlier runs; returns their phone numbers, which
+    are also passed to on_claimed() before the commit"""
+    placeholders = ', '.join(['%s'] * len(statuses))
+    with SessionManager.transaction() as work:
+        work.cursor.execute(
+            f"SELECT phone_number, status FROM broadcast_recipients WHERE campaign = %s AND status IN ({placeholders})",
+            (campaign, *statuses)
+        )
+        rows = work.cursor.fetchall()
+        # Released recipients had their state put back, so they are seeded again; unknown outcomes keep theirs
+        released = [phone_number for phone_number, status in rows if status == RELEASED]
+        seeded = _seed_states(work, released, state)
+        if released:
+            work.cursor.executemany(
+                "UPDATE broadcast_recipients SET status = %s, seeded_state = %s, previous_state = %s "
+                "WHERE campaign = %s AND phone_number = %s",
+                [(QUEUED,) + seeded.get(phone_number, (None, None)) + (campaign, phone_number) for phone_number in released]
+            )
+        reclaimed = [phone_number for phone_number, _ in rows]
+        if on_claimed is not None:
+            on_claimed(reclaimed)
+    return reclaimed
+
+def write_results(rows):
+    """Store (campaign, phone_number, status, message_id) rows; recipients never reached get their state back"""
+    with SessionManager.transaction() as work:
+        work.cursor.executemany(RESULT_SQL, rows)
+        unreached = {}
+        for campaign, phone_number, status, _ in rows:
+            if status in (FAILED, RELEASED):
+                unreached.setdefault(campaign, []).append(phone_number)
+        for campaign, phone_numbers in unreached.items():
+            placeholders = ', '.join(['%s'] * len(phone_numbers))
+            work.cursor.execute(RESTORE_STATES_SQL.format(placeholders=placeholders), (NEW, campaign, *phone_numbers))
+            work.states_changed(phone_numbers)
+
+def campaign_summary(campaign):
+    """Recipient counts by status name"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE campaign = %s GROUP BY status", (campaign,)
+        )
+        return {STATUS_NAMES.get(status, str(status)): count for status, count in cursor.fetchall()}
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def _message_id(response):
+    try:
+        return response.json()['messages'][0]['id']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def format_progress(progress):
+    """One status line: counts, send rate, share of the file read and ETA"""
+    eta = progress['eta']
+    eta = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+    return (f"sent {progress['sent']}  failed {progress['failed']}  skipped {progress['skipped']}  "
+            f"| {progress['rate']:.1f} msg/s | {progress['fraction']:.1%} of file | ETA {eta}")
+
+class Broadcast:
+    """One run of a campaign. Recipients are claimed a chunk at a time (the claim is what prevents a resumed
+    run from sending twice) and sent by a bounded pool of threads. Sends draw from the Graph API token bucket
+    like every other send, and from a BROADCAST_RATE bucket that leaves the rest of it to live replies."""
+    
+    def __init__(self, campaign, path, template=None, language='en', concurrency=None, chunk_size=None):
+        if not _CAMPAIGN_RE.match(campaign):
+            raise BroadcastError("Campaign names are 1-48 letters, digits, '.', '_' or '-'")
+        self.campaign = campaign
+        self.path = path
+        self.chunk_size = chunk_size or Config.BROADCAST_CHUNK_SIZE
+        self.message_type = f"template:{template}" if template else "interactive"
+        self.render, self.state = invitation(template, language)
+        self.interrupted = False
+        
+        concurrency = concurrency or Config.BROADCAST_CONCURRENCY
+        self.outbound = get_outbound()
+        self.bucket = SharedTokenBucket(
+            Config.BROADCAST_RATE,
+            max(int(Config.BROADCAST_RATE), 1),
+            SharedSlots(f"broadcast_{Config.PHONE_NUMBER_ID}", 1, fields=2)
+        )
+        # A short queue keeps claimed-but-unsent recipients few; a stalled queue is waited on, not dropped
+        self.pool = WorkerPool(
+            'broadcast',
+            self._send,
+            workers=concurrency,
+            queue_size=concurrency * 2,
+            enqueue_timeout=Config.OUTBOUND_BACKOFF_MAX * (Config.OUTBOUND_MAX_RETRIES + 1),
+            drain_timeout=Config.OUTBOUND_BACKOFF_MAX * (Config.OUTBOUND_MAX_RETRIES + 1)
+        )
+        self.results = BatchWriter(
+            'broadcast',
+            write_results,
+            max_batch=Config.BROADCAST_RESULT_BATCH,
+            max_delay=Config.BROADCAST_RESULT_FLUSH_INTERVAL,
+            journal_dir=Config.BROADCAST_JOURNAL_DIR
+        )
+        
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {'sent': 0, 'failed': 0, 'released': 0, 'skipped': 0, 'invalid': 0, 'resumed': 0}
+        self._size = 0
+        self._start_offset = 0
+        self._offset = 0
+        self._started = time.monotonic()
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+    
+    def _send(self, item):
+        phone_number, offset = item
+        if self._stopping.is_set():
+            self._finish(phone_number, offset, RELEASED)
+            return
+        response = None
+        for description, data in self.render(phone_number):
+            self.bucket.acquire()
+            response = self.outbound.deliver(phone_number, data, description)
+            if response is None:
+                break
+        if response is None:
+            logger.warning("Invitation to %s failed", redact(phone_number))
+            self._finish(phone_number, offset, FAILED)
+        else:
+            self._finish(phone_number, offset, SENT, _message_id(response))
+    
+    def _finish(self, phone_number, offset, status, message_id=None):
+        self.results.add([self.campaign, phone_number, status, message_id])
+        with self._lock:
+            self._counts[STATUS_NAMES[status]] += 1
+            self._offset = max(self._offset, offset)
+    
+    def _chunks(self, offset):
+        """Yield ({phone_number: offset}, offset after the chunk) for the file from `offset`, deduplicated"""
+        chunk = {}
+        end = offset
+        for phone_number, end in read_recipients(self.path, offset):
+            if phone_number is None:
+                self._count('invalid')
+                continue
+            chunk[phone_number] = end
+            if len(chunk) >= self.chunk_size:
+                yield chunk, end
+                chunk = {}
+                offset = end
+        # The last chunk also moves the checkpoint past any trailing lines without a number
+        if chunk or end > offset:
+            yield chunk, end
+    
+    def _submit_all(self, pending):
+        while pending:
+            # Popped before the hand-off, so a recipient the pool has taken is never also released by a
+            # Ctrl-C; an interrupt in between leaves that one recipient unknown rather than sent twice
+            item = pending.popleft()
+            if not self.pool.submit(item):
+                pending.appendleft(item)
+                raise BroadcastError("Send queue stalled; the Graph API is not accepting messages")
+    
+    def progress(self):
+        """Counts for this run with its send rate, the share of the file read and an ETA in seconds"""
+        with self._lock:
+            progress = dict(self._counts)
+            offset = self._offset
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        read_rate = (offset - self._start_offset) / elapsed
+        progress.update(
+            rate=(progress['sent'] + progress['failed']) / elapsed,
+            fraction=offset / self._size if self._size else 1.0,
+            eta=(self._size - offset) / read_rate if read_rate > 0 else None,
+            elapsed=elapsed
+        )
+        return progress
+    
+    def _report(self, callback, done):
+        while not done.wait(Config.BROADCAST_PROGRESS_INTERVAL):
+            callback(self.progress())
+    
+    def run(self, resend_unknown=False, on_progress=None):
+        """Send the campaign from its checkpoint. Ctrl-C stops it cleanly for a later run to resume.
+        Returns the campaign's recipient counts by status."""
+        source = os.path.abspath(self.path)
+        self._size = os.path.getsize(self.path)
+        with campaign_lock(self.campaign):
+            stored_source, message_type, offset = open_campaign(self.campaign, source, self.message_type)
+            if message_type != self.message_type:
+                raise BroadcastError(f"Campaign {self.campaign} sends {message_type} invitations, not {self.message_type}")
+            if stored_source != source:
+                logger.warning("Campaign %s was started from %s; resuming %s at byte %d",
+                               self.campaign, stored_source, source, offset)
+            
+            self._start_offset = self._offset = offset
+            self._started = time.monotonic()
+            
+            done = threading.Event()
+            if on_progress is not None:
+                threading.Thread(target=self._report, args=(on_progress, done), name='broadcast-progress', daemon=True).start()
+            
+            # Recipients an interrupted run never attempted go first; unknown outcomes only when asked
+            statuses = (RELEASED, QUEUED) if resend_unknown else (RELEASED,)
+            # Claims are added to `pending` before they commit, so a Ctrl-C right after a commit still
+            # finds them there and releases them
+            pending = deque()
+            try:
+                resumed = reclaim_recipients(
+                    self.campaign, statuses, self.state,
+                    on_claimed=lambda phone_numbers: pending.extend((phone_number, offset) for phone_number in phone_numbers)
+                )
+                self._count('resumed', len(resumed))
+                self._submit_all(pending)
+                for chunk, end in self._chunks(offset):
+                    fresh = claim_recipients(
+                        self.campaign, list(chunk), self.state, end,
+                        on_claimed=lambda phone_numbers: pending.extend((phone_number, chunk[phone_number]) for phone_number in phone_numbers)
+                    )
+                    self._count('skipped', len(chunk) - len(fresh))
+                    self._submit_all(pending)
+            except KeyboardInterrupt:
+                self.interrupted = True
+                self._stopping.set()
+                logger.warning("Broadcast %s interrupted; unsent recipients are released for the next run", self.campaign)
+            finally:
+                for phone_number, offset in pending:
+                    self._finish(phone_number, offset, RELEASED)
+                self.pool.shutdown()
+                # Flush results and delivery tracking before reading the summary
+                shutdown_all()
+                done.set()
+            if on_progress is not None:
+                on_progress(self.progress())
+            return campaign_summary(self.campaign)
\ No newline at end of file
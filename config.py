@@ -2,6 +2,7 @@
 # Centralized configuration for credentials and settings
 
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,15 +17,136 @@ class Config:
     PHONE_NUMBER_ID = os.getenv('PHONE_NUMBER_ID')
     VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
     
+    # Graph API client
+    GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.facebook.com')
+    GRAPH_API_VERSION = os.getenv('GRAPH_API_VERSION', 'v18.0')
+    GRAPH_API_POOL_SIZE = int(os.getenv('GRAPH_API_POOL_SIZE', 16))
+    GRAPH_API_CONNECT_TIMEOUT = float(os.getenv('GRAPH_API_CONNECT_TIMEOUT', 3.05))
+    GRAPH_API_READ_TIMEOUT = float(os.getenv('GRAPH_API_READ_TIMEOUT', 10))
+    
+    # Outbound send pipeline (0 shards sends inline on the caller's thread)
+    # The rate is shared by every process on a host; with several hosts, divide the account's limit among them
+    GRAPH_API_RATE = float(os.getenv('GRAPH_API_RATE', 80))
+    GRAPH_API_BURST = int(os.getenv('GRAPH_API_BURST', 80))
+    OUTBOUND_SHARDS = int(os.getenv('OUTBOUND_SHARDS', 8))
+    OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', 500))
+    OUTBOUND_ENQUEUE_TIMEOUT = float(os.getenv('OUTBOUND_ENQUEUE_TIMEOUT', 2))
+    OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+    OUTBOUND_BACKOFF_BASE = float(os.getenv('OUTBOUND_BACKOFF_BASE', 0.5))
+    OUTBOUND_BACKOFF_MAX = float(os.getenv('OUTBOUND_BACKOFF_MAX', 30))
+    
+    # Merge a text reply into the interactive message that follows it, when it fits (one send instead of two)
+    COALESCE_REPLIES = os.getenv('COALESCE_REPLIES', 'true').lower() == 'true'
+    
     # Database configuration
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_USERNAME = os.getenv('DB_USERNAME')
     DB_PASSWORD = os.getenv('DB_PASSWORD')
     DB_NAME = os.getenv('DB_NAME', 'ttd_survey')
     
+    # Database connection pool
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', 30))
+    
+    # Refuse to start workers against a database older than the code (run `python manage.py migrate`)
+    SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', 'true').lower() == 'true'
+    
+    # Webhook bodies larger than this are rejected before parsing
+    MAX_WEBHOOK_BYTES = int(os.getenv('MAX_WEBHOOK_BYTES', 256 * 1024))
+    
+    # Background webhook parsing (0 processes inline, 1 on a background thread). One thread keeps receive
+    # order up to the per-sender shards, so larger values are ignored with a warning; the per-message work
+    # runs on the shards. Order holds within one process only: two gunicorn workers can each receive a
+    # webhook for the same sender and handle them in either order.
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 1))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+    WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 0.5))
+    WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 25))
+    
+    # Per-user ordered message dispatch (0 shards processes inline)
+    MESSAGE_SHARDS = int(os.getenv('MESSAGE_SHARDS', 8))
+    MESSAGE_SHARD_QUEUE_SIZE = int(os.getenv('MESSAGE_SHARD_QUEUE_SIZE', 200))
+    # How long the webhook thread waits on a full shard before dropping the message (0 never waits), so
+    # one backed-up shard cannot stall parsing for every other sender
+    MESSAGE_SHARD_ENQUEUE_TIMEOUT = float(os.getenv('MESSAGE_SHARD_ENQUEUE_TIMEOUT', 0.1))
+    
+    # Asyncio serving mode (async_app.py)
+    ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', 20))
+    ASYNC_GRAPH_API_POOL_SIZE = int(os.getenv('ASYNC_GRAPH_API_POOL_SIZE', 100))
+    ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 5000))
+    
+    # In-process user state cache (0 disables it). Workers on one host invalidate each other exactly; a
+    # worker on another host can act on a row up to SESSION_CACHE_TTL seconds old (say, repeat a rating
+    # step), so keep the TTL short with several hosts behind the webhook, or disable the cache there
+    SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+    SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 5))
+    SESSION_CACHE_SLOTS = int(os.getenv('SESSION_CACHE_SLOTS', 65536))
+    
+    # Buffered feedback writes: journaled, then bulk-inserted by size or age
+    FEEDBACK_BATCHING = os.getenv('FEEDBACK_BATCHING', 'false').lower() == 'true'
+    FEEDBACK_BATCH_SIZE = int(os.getenv('FEEDBACK_BATCH_SIZE', 200))
+    FEEDBACK_FLUSH_INTERVAL = float(os.getenv('FEEDBACK_FLUSH_INTERVAL', 1.0))
+    FEEDBACK_JOURNAL_DIR = os.getenv('FEEDBACK_JOURNAL_DIR', 'feedback_journal')
+    
+    # Duplicate webhook suppression (Meta retries deliveries for up to 7 days)
+    DEDUP_MEMORY_SIZE = int(os.getenv('DEDUP_MEMORY_SIZE', 50000))
+    DEDUP_TTL = int(os.getenv('DEDUP_TTL', 7 * 24 * 3600))
+    
+    # Invitation broadcasts (manage.py broadcast). Sends draw from the host-wide GRAPH_API_RATE bucket and are
+    # also held to BROADCAST_RATE (host-wide too), so a campaign leaves the rest of the limit to live replies
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 40))
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 16))
+    BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 200))
+    BROADCAST_RESULT_BATCH = int(os.getenv('BROADCAST_RESULT_BATCH', 500))
+    BROADCAST_RESULT_FLUSH_INTERVAL = float(os.getenv('BROADCAST_RESULT_FLUSH_INTERVAL', 1.0))
+    BROADCAST_JOURNAL_DIR = os.getenv('BROADCAST_JOURNAL_DIR', 'broadcast_journal')
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 2.0))
+    
+    # Per-sender rate limit (sliding window) and debounce of repeated taps, shared by the workers on a host
+    THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'true').lower() == 'true'
+    THROTTLE_LIMIT = int(os.getenv('THROTTLE_LIMIT', 20))
+    THROTTLE_WINDOW = float(os.getenv('THROTTLE_WINDOW', 60))
+    THROTTLE_DEBOUNCE = float(os.getenv('THROTTLE_DEBOUNCE', 2.0))
+    THROTTLE_SLOTS = int(os.getenv('THROTTLE_SLOTS', 65536))
+    
+    # Delivery status tracking: sent message ids and status callbacks, bulk-inserted
+    STATUS_TRACKING = os.getenv('STATUS_TRACKING', 'true').lower() == 'true'
+    STATUS_BATCH_SIZE = int(os.getenv('STATUS_BATCH_SIZE', 500))
+    STATUS_FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', 2.0))
+    STATUS_RETENTION_DAYS = int(os.getenv('STATUS_RETENTION_DAYS', 30))
+    
+    # Logging: records are queued and written by a background thread
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    LOG_REDACT_PHONES = os.getenv('LOG_REDACT_PHONES', 'true').lower() == 'true'
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.01))
+    
+    # Directory for state shared by all workers on this host
+    SHARED_STATE_DIR = os.getenv('SHARED_STATE_DIR', os.path.join(tempfile.gettempdir(), 'ttd_survey'))
+    
+    # Prometheus metrics, summed across workers from per-process files in METRICS_DIR
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(SHARED_STATE_DIR, 'metrics'))
+    
     # Server configuration
     SERVER_URL = os.getenv('SERVER_URL')
     
+    # Streaming export of user_responses at /export/responses (disabled unless a token is set)
+    EXPORT_TOKEN = os.getenv('EXPORT_TOKEN')
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 1000))
+    EXPORT_NET_WRITE_TIMEOUT = int(os.getenv('EXPORT_NET_WRITE_TIMEOUT', 600))
+    
+    # Background database probe behind /health and /health/ready; older results count as not ready
+    HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', 5))
+    HEALTH_PROBE_TTL = float(os.getenv('HEALTH_PROBE_TTL', 15))
+    
+    # Bearer token for the runtime metrics at /health/stats (disabled unless set)
+    STATS_TOKEN = os.getenv('STATS_TOKEN')
+    
     # Categories for the survey
     CATEGORIES = [
         "CLEANLINESS",
@@ -38,4 +160,8 @@ class Config:
     
     # Path to key files
     PRIVATE_KEY_PATH = os.getenv('PRIVATE_KEY_PATH', 'private.pem')
-    PUBLIC_KEY_PATH = os.getenv('PUBLIC_KEY_PATH', 'public.pem')
\ No newline at end of file
+    PUBLIC_KEY_PATH = os.getenv('PUBLIC_KEY_PATH', 'public.pem')
+    PRIVATE_KEY_PASSWORD = os.getenv('PRIVATE_KEY_PASSWORD')
+    
+    # WhatsApp Flow that collects every rating in one submission (flows.py); unset keeps the chat survey
+    SURVEY_FLOW_ID = os.getenv('SURVEY_FLOW_ID')
\ No newline at end of file
@@ -0,0 +1,246 @@
+# conversation.py - Conversation Flow Engine
+# Declarative survey flow compiled at startup into a transition table keyed by (state, event, reply id)
+
+import string
+import logging
+from collections import namedtuple, deque
+from itertools import product
+from config import Config
+from whatsapp_api import text_message, interactive_buttons, rating_buttons, category_list, survey_flow, with_intro
+
+logger = logging.getLogger(__name__)
+
+# Stored state of a sender we have no row for
+NEW = 'NEW'
+
+# `state: '*'` transitions apply in every state except NEW unless the state defines the same key itself
+ANY_STATE = '*'
+
+# Event types, derived from an InboundMessage by event_of()
+TEXT = 'text'
+BUTTON_REPLY = 'button_reply'
+LIST_REPLY = 'list_reply'
+OTHER = 'other'
+
+# Values a {placeholder} in a reply id expands over; the chosen value is also available to the texts
+PARAMETERS = {
+    'category': lambda: Config.CATEGORIES,
+    'rating': lambda: range(1, 6)
+}
+
+# Interactive messages a step can send after its optional intro text
+def _more_feedback_buttons(phone_number, intro=None):
+    return interactive_buttons(
+        phone_number,
+        "Provide More Feedback?",
+        "Would you like to provide feedback on another category?",
+        ["Yes", "No"],
+        intro=intro
+    )
+
+def _survey_start(phone_number, intro=None):
+    # With a Flow configured, every rating is collected in one form (flows.py) instead of chat steps
+    render = survey_flow if Config.SURVEY_FLOW_ID else category_list
+    return render(phone_number, intro=intro)
+
+INTERACTIVES = {
+    'survey_start': _survey_start,
+    'category_list': category_list,
+    'rating_buttons': rating_buttons,
+    'more_feedback_buttons': _more_feedback_buttons
+}
+
+# The survey. Each state maps "event" or "event:reply_id" to a step:
+#   to        - next state
+#   text      - message to send (may use {category} / {rating})
+#   then      - interactive message to send after the text (merged into it when it fits)
+#   category  - True to store the category named by the reply id
+#   rating    - True to save the rating named by the reply id for the stored category
+# A state's "*" key is its default for any message no other key matches.
+SURVEY_FLOW = {
+    NEW: {
+        '*': {'to': 'WELCOME', 'then': 'survey_start',
+              'text': "Welcome to the Tirumala Tirupati Devasthanam Feedback Survey. Your opinion matters to us!"}
+    },
+    ANY_STATE: {
+        'text:restart': {'to': 'WELCOME', 'text': "Welcome back to the TTD Feedback Survey.", 'then': 'survey_start'},
+        'list_reply:{category}': {'to': 'AWAITING_RATING', 'category': True, 'then': 'rating_buttons',
+                                  'text': "Please rate your experience with {category}:"}
+    },
+    'WELCOME': {},
+    'AWAITING_RATING': {
+        'button_reply:rating_{rating}': {
+            'to': 'AWAITING_MORE_FEEDBACK', 'rating': True, 'then': 'more_feedback_buttons',
+            'text': "Thank you for your {rating}-star rating for {category}. Your feedback is valuable to us."
+        }
+    },
+    'AWAITING_MORE_FEEDBACK': {
+        'button_reply:btn_1': {'to': 'WELCOME', 'then': 'category_list'},
+        'button_reply:btn_2': {'to': 'COMPLETED',
+                               'text': "Thank you for completing our survey. Your feedback helps us improve. Have a blessed day! 🙏"}
+    },
+    'COMPLETED': {}
+}
+
+# A compiled step: everything but the recipient (and the stored category, for texts that name it) is fixed
+Transition = namedtuple('Transition', [
+    'state',        # next state
+    'category',     # category to store, or None to keep the stored one
+    'rating',       # rating to save for the stored category, or None
+    'text',         # intro text, or None
+    'needs_category',  # text names the stored category, formatted per message
+    'interactive'   # render function for the interactive message, or None
+])
+
+class FlowDefinitionError(ValueError):
+    """The flow definition is inconsistent; raised at startup"""
+
+def _placeholders(template):
+    return [name for _, name, _, _ in string.Formatter().parse(template or '') if name]
+
+def _expand(key):
+    """'event:id_{param}' -> [(event, reply_id, {param: value})] for every parameter value"""
+    event, _, reply_id = key.partition(':')
+    names = _placeholders(reply_id)
+    if not names:
+        return [(event, reply_id or None, {})]
+    combos = product(*(PARAMETERS[name]() for name in names))
+    return [
+        (event, reply_id.format(**values), values)
+        for values in (dict(zip(names, combo)) for combo in combos)
+    ]
+
+def validate_flow(flow):
+    """Problems with a flow definition: unknown targets, parameters or messages, dead ends, unreachable states"""
+    problems = []
+    states = set(flow) - {ANY_STATE}
+    if NEW not in states:
+        problems.append(f"no {NEW} state")
+    
+    edges = {state: set() for state in states}
+    for state, steps in flow.items():
+        for key, step in steps.items():
+            where = f"{state} [{key}]"
+            event = key.partition(':')[0]
+            if key != '*' and event not in (TEXT, BUTTON_REPLY, LIST_REPLY, OTHER):
+                problems.append(f"{where}: unknown event {event!r}")
+            unknown = [name for name in _placeholders(key) if name not in PARAMETERS]
+            if unknown:
+                problems.append(f"{where}: unknown parameter(s) {', '.join(unknown)}")
+            if step.get('to') not in states:
+                problems.append(f"{where}: goes to undefined state {step.get('to')!r}")
+            if step.get('then') is not None and step['then'] not in INTERACTIVES:
+                problems.append(f"{where}: unknown interactive message {step['then']!r}")
+            if event in (TEXT, BUTTON_REPLY, LIST_REPLY) and not key.partition(':')[2]:
+                problems.append(f"{where}: {event} needs a reply id")
+            known = set(_placeholders(key)) | {'category'}
+            unknown = [name for name in _placeholders(step.get('text')) if name not in known]
+            if unknown:
+                problems.append(f"{where}: text uses unknown placeholder(s) {', '.join(unknown)}")
+            if not step.get('text') and not step.get('then'):
+                problems.append(f"{where}: sends nothing")
+            if step.get('rating') and 'rating' not in _placeholders(key):
+                problems.append(f"{where}: saves a rating but its reply id has no {{rating}}")
+            if step.get('category') and 'category' not in _placeholders(key):
+                problems.append(f"{where}: stores a category but its reply id has no {{category}}")
+            sources = states - {NEW} if state == ANY_STATE else {state}
+            for source in sources:
+                edges[source].add(step.get('to'))
+    
+    # Dead ends: states a sender could reach but never leave
+    for state in sorted(states):
+        if not edges[state]:
+            problems.append(f"{state}: dead end, no transitions out")
+    
+    # Unreachable: states no path from NEW leads to
+    if NEW in states:
+        seen = {NEW}
+        pending = deque([NEW])
+        while pending:
+            for target in edges[pending.popleft()]:
+                if target in states and target not in seen:
+                    seen.add(target)
+                    pending.append(target)
+        for state in sorted(states - seen):
+            problems.append(f"{state}: unreachable from {NEW}")
+    return problems
+
+def compile_flow(flow):
+    """Validate a flow and build its transition table: {(state, event, reply_id): Transition}, plus defaults"""
+    problems = validate_flow(flow)
+    if problems:
+        raise FlowDefinitionError("Invalid conversation flow:\n  " + "\n  ".join(problems))
+    
+    def build(step, values):
+        text = step.get('text')
+        needs_category = False
+        if text:
+            # Bake in everything known now; only the stored category is left for dispatch time
+            fixed = {name: values[name] for name in _placeholders(text) if name in values}
+            needs_category = 'category' in _placeholders(text) and 'category' not in fixed
+            text = text.format(**fixed, **({'category': '{category}'} if needs_category else {}))
+        return Transition(
+            step['to'],
+            values['category'] if step.get('category') else None,
+            values['rating'] if step.get('rating') else None,
+            text,
+            needs_category,
+            INTERACTIVES[step['then']] if step.get('then') else None
+        )
+    
+    table = {}
+    defaults = {}
+    states = [state for state in flow if state != ANY_STATE]
+    for state in states:
+        steps = dict(flow.get(ANY_STATE, {})) if state != NEW else {}
+        steps.update(flow[state])
+        for key, step in steps.items():
+            if key == '*':
+                defaults[state] = build(step, {})
+                continue
+            for event, reply_id, values in _expand(key):
+                table[(state, event, reply_id)] = build(step, values)
+    
+    # Rows written by an older flow still get the global transitions
+    for key, step in flow.get(ANY_STATE, {}).items():
+        for event, reply_id, values in _expand(key):
+            table.setdefault((ANY_STATE, event, reply_id), build(step, values))
+    return table, defaults, frozenset(states)
+
+def event_of(message):
+    """(event type, reply id) for an InboundMessage; text is matched case-insensitively"""
+    if message.reply_type in (BUTTON_REPLY, LIST_REPLY):
+        return message.reply_type, message.reply_id
+    if message.text is not None:
+        return TEXT, message.text.strip().lower()
+    return OTHER, None
+
+class ConversationEngine:
+    """One dictionary lookup per message, however many states the flow has"""
+    
+    def __init__(self, flow):
+        self.table, self.defaults, self.states = compile_flow(flow)
+        logger.debug("Conversation flow compiled: %d state(s), %d transition(s)", len(self.states), len(self.table))
+    
+    def lookup(self, state, event, reply_id):
+        """The transition for a message in `state`, or None if the message is ignored there"""
+        if state not in self.states:
+            state = ANY_STATE
+        transition = self.table.get((state, event, reply_id))
+        if transition is None:
+            return self.defaults.get(state)
+        return transition
+    
+    def replies(self, transition, phone_number, stored_category):
+        """Render a transition's messages for one recipient"""
+        text = transition.text
+        if transition.needs_category:
+            text = text.format(category=stored_category)
+        if transition.interactive is None:
+            return (text_message(phone_number, text),)
+        if text is None:
+            return (transition.interactive(phone_number),)
+        return with_intro(phone_number, text, transition.interactive)
+
+# Compiled at import so a broken flow fails worker boot, not a conversation
+engine = ConversationEngine(SURVEY_FLOW)
\ No newline at end of file
@@ -1,102 +1,307 @@
 # database.py - Database Operations
 # Database operations using SQLite for storing feedback
 
+import os
+import time
 import logging
+import threading
+from collections import deque
 import mysql.connector
 from config import Config
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        return mysql.connector.connect(
-            host=Config.DB_HOST,
-            user=Config.DB_USERNAME,
-            password=Config.DB_PASSWORD,
-            database=Config.DB_NAME
-        )
-    except mysql.connector.Error as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+class PooledConnection:
+    """A connection borrowed from the pool. Calling close() returns it to the pool."""
+    
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+    
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to pool")
+        return getattr(self._entry['conn'], name)
+    
+    def close(self):
+        """Return the underlying connection to the pool"""
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool.release(entry)
 
-def init_db():
-    """Initialize database and tables if they don't exist"""
-    try:
-        # Create connection without database specified
+class ConnectionPool:
+    """Process-wide pool of MySQL connections with pre-ping, recycling and metrics"""
+    
+    def __init__(self, size, timeout, recycle, pre_ping, ping_interval):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+        
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        
+        # Metrics
+        self._borrows = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+    
+    def _connect(self):
+        now = time.monotonic()
         conn = mysql.connector.connect(
             host=Config.DB_HOST,
             user=Config.DB_USERNAME,
-            password=Config.DB_PASSWORD
+            password=Config.DB_PASSWORD,
+            database=Config.DB_NAME
         )
-        cursor = conn.cursor()
+        return {'conn': conn, 'created': now, 'last_used': now}
+    
+    def _close_quietly(self, entry):
+        try:
+            entry['conn'].close()
+        except Exception:
+            pass
+    
+    def _validate(self, entry):
+        """Recycle connections that are too old and ping ones that sat idle too long"""
+        now = time.monotonic()
+        if self.recycle and now - entry['created'] > self.recycle:
+            self._close_quietly(entry)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
         
-        # Create database if not exists
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {Config.DB_NAME}")
-        cursor.execute(f"USE {Config.DB_NAME}")
+        if self.pre_ping and now - entry['last_used'] > self.ping_interval:
+            try:
+                entry['conn'].ping(reconnect=False)
+            except mysql.connector.Error:
+                self._close_quietly(entry)
+                with self._cond:
+                    self._ping_failures += 1
+                return self._connect()
         
-        # Create tables
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_responses (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            phone_number VARCHAR(20),
-            category VARCHAR(50),
-            rating INT,
-            feedback TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            INDEX (phone_number)
-        )
-        """)
+        return entry
+    
+    def acquire(self):
+        """Borrow a connection, waiting up to the pool timeout if all are in use"""
+        start = time.monotonic()
+        deadline = start + self.timeout
         
-        # Create table for user state
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_state (
-            phone_number VARCHAR(20) PRIMARY KEY,
-            current_state VARCHAR(50),
-            selected_category VARCHAR(50),
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        )
-        """)
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        # Reserve a slot; the connection is opened outside the lock
+                        self._created += 1
+                        entry = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"Timed out after {self.timeout}s waiting for a database connection"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            
+            waited = time.monotonic() - start
+            self._in_use += 1
+            self._borrows += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        
+        try:
+            entry = self._connect() if entry is None else self._validate(entry)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._created -= 1
+                self._cond.notify()
+            raise
+        
+        return PooledConnection(self, entry)
+    
+    def release(self, entry):
+        """Return a connection to the pool, discarding it if it is no longer usable"""
+        usable = True
+        try:
+            # Never hand out a connection with pending rows or a half-finished transaction
+            if entry['conn'].unread_result:
+                entry['conn'].consume_results()
+            if entry['conn'].in_transaction:
+                entry['conn'].rollback()
+        except Exception:
+            usable = False
+            self._close_quietly(entry)
         
-        conn.commit()
-        logger.info("Database initialized successfully")
+        entry['last_used'] = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if usable:
+                self._idle.append(entry)
+            else:
+                self._created -= 1
+            self._cond.notify()
+    
+    def close_all(self):
+        """Close every idle connection"""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._created -= len(idle)
+        for entry in idle:
+            self._close_quietly(entry)
+    
+    def stats(self):
+        """Return a snapshot of pool metrics"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'borrows': self._borrows,
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_max': round(self._wait_max, 6),
+                'wait_time_avg': round(self._wait_total / self._borrows, 6) if self._borrows else 0.0
+            }
+
+# The pool is created lazily and rebuilt after a fork so gunicorn workers never share sockets
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the connection pool for the current process"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    size=Config.DB_POOL_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    recycle=Config.DB_POOL_RECYCLE,
+                    pre_ping=Config.DB_POOL_PRE_PING,
+                    ping_interval=Config.DB_POOL_PING_INTERVAL
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def get_pool_stats():
+    """Get connection pool metrics for this process, or None if it has not opened a pool yet"""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
+
+def close_pool():
+    """Close idle pooled connections, e.g. on worker shutdown"""
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close_all()
+
+def get_db_connection():
+    """Borrow a database connection from the pool. Call close() to return it."""
+    try:
+        return get_pool().acquire()
     except mysql.connector.Error as e:
-        logger.error(f"Database initialization error: {e}")
+        logger.error("Database connection error: %s", e)
         raise
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+INSERT_FEEDBACK_SQL = "INSERT INTO user_responses (phone_number, category, rating, feedback) VALUES (%s, %s, %s, %s)"
+UPDATE_CATEGORY_STATS_SQL = """
+    INSERT INTO category_stats (category, response_count, rating_sum) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        response_count = response_count + VALUES(response_count),
+        rating_sum = rating_sum + VALUES(rating_sum)
+"""
+INSERT_RESPONDENT_SQL = "INSERT IGNORE INTO survey_respondents (phone_number) VALUES (%s)"
+INCREMENT_COUNTER_SQL = """
+    INSERT INTO survey_counters (name, value) VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+"""
+
+def feedback_rollups(rows):
+    """(category, count, rating_sum) rollup updates and sorted respondent phones for feedback rows"""
+    totals = {}
+    for _, category, rating, _ in rows:
+        # Rows without a category are kept in user_responses but have no rollup, as in rebuild_survey_stats
+        if category is None:
+            continue
+        count, rating_sum = totals.get(category, (0, 0))
+        totals[category] = (count + 1, rating_sum + (rating or 0))
+    # Fixed lock order across concurrent transactions avoids deadlocks on the rollup rows
+    category_totals = [
+        (category, count, rating_sum)
+        for category, (count, rating_sum) in sorted(totals.items(), key=lambda item: str(item[0]))
+    ]
+    return category_totals, sorted({row[0] for row in rows if row[0] is not None})
+
+def record_feedback(cursor, rows):
+    """Insert (phone_number, category, rating, feedback) rows and update the rollups; the caller commits"""
+    rows = [tuple(row) for row in rows]
+    if not rows:
+        return
+    
+    # mysql.connector rewrites executemany() of an INSERT into a single multi-row statement
+    if len(rows) == 1:
+        cursor.execute(INSERT_FEEDBACK_SQL, rows[0])
+    else:
+        cursor.executemany(INSERT_FEEDBACK_SQL, rows)
+    
+    category_totals, phones = feedback_rollups(rows)
+    for totals in category_totals:
+        cursor.execute(UPDATE_CATEGORY_STATS_SQL, totals)
+    
+    if not phones:
+        return
+    # INSERT IGNORE only affects rows for first-time respondents
+    if len(phones) == 1:
+        cursor.execute(INSERT_RESPONDENT_SQL, (phones[0],))
+    else:
+        cursor.executemany(INSERT_RESPONDENT_SQL, [(phone,) for phone in phones])
+    if cursor.rowcount > 0:
+        cursor.execute(INCREMENT_COUNTER_SQL, ('unique_users', cursor.rowcount))
 
 def get_survey_stats():
-    """Get overall survey statistics"""
+    """Get overall survey statistics from the maintained rollups"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Overall response count
-        cursor.execute("SELECT COUNT(*) as total_responses FROM user_responses")
-        total = cursor.fetchone()['total_responses']
-        
         # Rating average by category
         cursor.execute("""
             SELECT 
                 category, 
-                AVG(rating) as avg_rating,
-                COUNT(*) as count
-            FROM user_responses
-            GROUP BY category
+                rating_sum / response_count as avg_rating,
+                response_count as count
+            FROM category_stats
+            WHERE response_count > 0
             ORDER BY avg_rating DESC
         """)
         
         categories = cursor.fetchall()
         
+        # Overall response count
+        total = sum(category['count'] for category in categories)
+        
         # Total unique users
-        cursor.execute("SELECT COUNT(DISTINCT phone_number) as unique_users FROM user_responses")
-        unique_users = cursor.fetchone()['unique_users']
+        cursor.execute("SELECT value FROM survey_counters WHERE name = 'unique_users'")
+        row = cursor.fetchone()
+        unique_users = row['value'] if row else 0
         
         return {
             'total_responses': total,
@@ -104,10 +309,123 @@ def get_survey_stats():
             'categories': categories
         }
     except Exception as e:
-        logger.error(f"Error getting survey stats: {str(e)}")
+        logger.error("Error getting survey stats: %s", e)
         return None
     finally:
         if 'cursor' in locals():
             cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+EXPORT_COLUMNS = ('id', 'phone_number', 'category', 'rating', 'feedback', 'timestamp')
+
+def iter_responses(category=None, since=None, until=None, after_id=0, limit=None, chunk_size=1000):
+    """Stream user_responses rows in id order, `chunk_size` at a time, as lists of tuples (EXPORT_COLUMNS).
+    Reads through an unbuffered cursor on a dedicated connection, so memory stays flat and
+    the pool is not tied up by a long export."""
+    conditions = ["id > %s"]
+    params = [after_id]
+    if category is not None:
+        conditions.append("category = %s")
+        params.append(category)
+    if since is not None:
+        conditions.append("timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < %s")
+        params.append(until)
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM user_responses WHERE {' AND '.join(conditions)} ORDER BY id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    
+    try:
+        conn = mysql.connector.connect(
+            host=Config.DB_HOST,
+            user=Config.DB_USERNAME,
+            password=Config.DB_PASSWORD,
+            database=Config.DB_NAME
+        )
+        cursor = conn.cursor(buffered=False)
+        # The server blocks on a slow consumer; give it longer than the default 60s before aborting
+        cursor.execute("SET SESSION net_write_timeout = %s", (Config.EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(query, tuple(params))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    except mysql.connector.Error as e:
+        logger.error("Error exporting responses: %s", e)
+        raise
+    finally:
+        # Closing the connection discards unread rows; closing the cursor first would read them all
+        if 'conn' in locals():
+            conn.close()
+
+def rebuild_survey_stats(check_only=False):
+    """Recompute the rollups from user_responses; returns the mismatches found (empty if none)"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Freeze the raw table so the recomputed rollups match it exactly; feedback writes wait meanwhile
+        cursor.execute("""
+            LOCK TABLES user_responses READ, category_stats WRITE,
+                survey_respondents WRITE, survey_counters WRITE
+        """)
+        
+        cursor.execute("""
+            SELECT category, COUNT(*), COALESCE(SUM(rating), 0) FROM user_responses
+            WHERE category IS NOT NULL GROUP BY category
+        """)
+        expected = {category: (int(count), int(rating_sum)) for category, count, rating_sum in cursor.fetchall()}
+        cursor.execute("SELECT category, response_count, rating_sum FROM category_stats")
+        actual = {category: (int(count), int(rating_sum)) for category, count, rating_sum in cursor.fetchall()}
+        
+        mismatches = []
+        for category in sorted(set(expected) | set(actual), key=str):
+            if expected.get(category, (0, 0)) != actual.get(category, (0, 0)):
+                mismatches.append(
+                    f"category {category}: rollup {actual.get(category, (0, 0))} != raw {expected.get(category, (0, 0))}"
+                )
+        
+        cursor.execute("SELECT COUNT(DISTINCT phone_number) FROM user_responses")
+        expected_users = cursor.fetchone()[0]
+        cursor.execute("SELECT value FROM survey_counters WHERE name = 'unique_users'")
+        row = cursor.fetchone()
+        actual_users = row[0] if row else 0
+        if expected_users != actual_users:
+            mismatches.append(f"unique_users: rollup {actual_users} != raw {expected_users}")
+        
+        if not check_only and mismatches:
+            cursor.execute("DELETE FROM category_stats")
+            cursor.execute("""
+                INSERT INTO category_stats (category, response_count, rating_sum)
+                SELECT category, COUNT(*), COALESCE(SUM(rating), 0) FROM user_responses
+                WHERE category IS NOT NULL GROUP BY category
+            """)
+            cursor.execute("DELETE FROM survey_respondents")
+            cursor.execute("""
+                INSERT INTO survey_respondents (phone_number)
+                SELECT DISTINCT phone_number FROM user_responses WHERE phone_number IS NOT NULL
+            """)
+            cursor.execute(
+                "REPLACE INTO survey_counters (name, value) SELECT 'unique_users', COUNT(*) FROM survey_respondents"
+            )
+            conn.commit()
+            logger.info("Survey stats rebuilt (%d mismatch(es) corrected)", len(mismatches))
+        
+        return mismatches
+    except mysql.connector.Error as e:
+        logger.error("Error rebuilding survey stats: %s", e)
+        raise
+    finally:
+        if 'cursor' in locals():
+            try:
+                cursor.execute("UNLOCK TABLES")
+            except mysql.connector.Error:
+                pass
+            cursor.close()
         if 'conn' in locals():
             conn.close()
\ No newline at end of file
@@ -0,0 +1,155 @@
+# dedup.py - Webhook Deduplication
+# Drops redelivered WhatsApp messages by message id before any processing
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from config import Config
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+CLAIM_SQL = "INSERT IGNORE INTO processed_messages (message_digest) VALUES (%s)"
+PURGE_SQL = "DELETE FROM processed_messages WHERE seen_at < NOW() - INTERVAL %s SECOND LIMIT 10000"
+
+# Expired ids are purged from the persistent store at most this often per process
+PURGE_INTERVAL = 300
+
+class MessageDeduplicator:
+    """Recent-id set in memory, backed by a shared table of message id digests with a TTL"""
+    
+    def __init__(self, max_recent, ttl):
+        self.max_recent = max_recent
+        self.ttl = ttl
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        
+        # Suppressed duplicates per second over the last minute
+        self._buckets = [0] * 60
+        self._bucket_times = [0] * 60
+        
+        # Metrics
+        self._checked = 0
+        self._suppressed_memory = 0
+        self._suppressed_store = 0
+        self._store_errors = 0
+    
+    @staticmethod
+    def digest(message_id):
+        """Compact fixed-size key for a WhatsApp message id"""
+        return hashlib.blake2b(message_id.encode('utf-8'), digest_size=16).digest()
+    
+    def _remember(self, key, now):
+        self._recent[key] = now
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+    
+    def _count_suppressed(self, now):
+        second = int(now)
+        slot = second % 60
+        if self._bucket_times[slot] != second:
+            self._bucket_times[slot] = second
+            self._buckets[slot] = 0
+        self._buckets[slot] += 1
+    
+    def claim(self, message_id):
+        """Return True the first time a message id is seen, False for a duplicate delivery"""
+        if not message_id:
+            return True
+        
+        key = self.digest(message_id)
+        if self.seen_recently(key):
+            return False
+        
+        # The shared table catches redeliveries that land on another worker or after a restart
+        return self.record_claim(key, self._claim_in_store(key))
+    
+    def seen_recently(self, key):
+        """Check the in-memory set for a digest; True means a duplicate, counted as suppressed"""
+        now = time.time()
+        with self._lock:
+            self._checked += 1
+            seen_at = self._recent.get(key)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self._suppressed_memory += 1
+                self._count_suppressed(now)
+                return True
+        return False
+    
+    def record_claim(self, key, claimed):
+        """Remember a digest after the store was asked about it; returns `claimed`"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now)
+            if not claimed:
+                self._suppressed_store += 1
+                self._count_suppressed(now)
+        return claimed
+    
+    def purge_due(self):
+        """True at most once per PURGE_INTERVAL; the caller then runs PURGE_SQL"""
+        if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            return True
+        return False
+    
+    def store_failed(self, error):
+        """Count a store error; the caller fails open"""
+        with self._lock:
+            self._store_errors += 1
+        logger.error("Error checking message id for duplicates: %s", error)
+    
+    def _claim_in_store(self, key):
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(CLAIM_SQL, (key,))
+            claimed = cursor.rowcount == 1
+            
+            if self.purge_due():
+                cursor.execute(PURGE_SQL, (int(self.ttl),))
+            
+            conn.commit()
+            return claimed
+        except Exception as e:
+            # Fail open: better a possible duplicate reply than dropping a real message
+            self.store_failed(e)
+            return True
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'conn' in locals():
+                conn.close()
+    
+    def stats(self):
+        """Duplicate suppression counters, including the last minute"""
+        now = int(time.time())
+        with self._lock:
+            last_minute = sum(
+                count for count, second in zip(self._buckets, self._bucket_times) if now - second < 60
+            )
+            return {
+                'checked': self._checked,
+                'recent_ids': len(self._recent),
+                'suppressed_memory': self._suppressed_memory,
+                'suppressed_store': self._suppressed_store,
+                'suppressed_total': self._suppressed_memory + self._suppressed_store,
+                'suppressed_last_minute': last_minute,
+                'store_errors': self._store_errors
+            }
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+def get_deduplicator(create=True):
+    """Return the process-wide message deduplicator (None with create=False if nothing has used it yet)"""
+    global _deduplicator
+    if _deduplicator is None and create:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                _deduplicator = MessageDeduplicator(Config.DEDUP_MEMORY_SIZE, Config.DEDUP_TTL)
+    return _deduplicator
\ No newline at end of file
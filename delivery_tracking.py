@@ -0,0 +1,167 @@
+# delivery_tracking.py - Delivery Status Tracking
+# Records sent message ids and their status callbacks, and reports delivery latency
+
+import math
+import time
+import logging
+import threading
+from config import Config
+from database import get_db_connection
+from batch_writer import BatchWriter
+from logging_setup import redact
+
+logger = logging.getLogger(__name__)
+
+# Statuses are stored as small integers to keep message_statuses compact
+STATUS_CODES = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+INSERT_SENT_SQL = """
+    INSERT IGNORE INTO outbound_messages (message_id, recipient, message_type, sent_at)
+    VALUES (%s, %s, %s, FROM_UNIXTIME(%s))
+"""
+INSERT_STATUS_SQL = """
+    INSERT IGNORE INTO message_statuses (message_id, status, status_at, error_code)
+    VALUES (%s, %s, FROM_UNIXTIME(%s), %s)
+"""
+PURGE_SENT_SQL = "DELETE FROM outbound_messages WHERE sent_at < NOW() - INTERVAL %s DAY LIMIT 10000"
+PURGE_STATUSES_SQL = "DELETE FROM message_statuses WHERE status_at < NOW() - INTERVAL %s DAY LIMIT 10000"
+
+# One row per sent message, with its delivered and read times when known. Status times are WhatsApp's
+# whole-second timestamps while sent_at is our clock in ms, so latencies resolve to about a second and a
+# fast delivery can land before sent_at; those count as 0 rather than skewing the percentiles negative
+LATENCY_SQL = """
+    SELECT o.message_type,
+           GREATEST(TIMESTAMPDIFF(MICROSECOND, o.sent_at, d.status_at), 0),
+           TIMESTAMPDIFF(MICROSECOND, d.status_at, r.status_at)
+    FROM outbound_messages o
+    LEFT JOIN message_statuses d ON d.message_id = o.message_id AND d.status = 2
+    LEFT JOIN message_statuses r ON r.message_id = o.message_id AND r.status = 3
+    WHERE o.sent_at >= NOW() - INTERVAL %s SECOND
+"""
+
+# Expired rows are purged at most this often per process
+PURGE_INTERVAL = 300
+_last_purge = time.monotonic()
+
+def _execute_batch(sql, rows, purge_sql):
+    global _last_purge
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany(sql, rows)
+        if time.monotonic() - _last_purge > PURGE_INTERVAL:
+            _last_purge = time.monotonic()
+            cursor.execute(purge_sql, (Config.STATUS_RETENTION_DAYS,))
+        conn.commit()
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def insert_sent_rows(rows):
+    """Insert (message_id, recipient, message_type, sent_at) rows"""
+    _execute_batch(INSERT_SENT_SQL, rows, PURGE_SENT_SQL)
+
+def insert_status_rows(rows):
+    """Insert (message_id, status, status_at, error_code) rows; repeated callbacks are ignored"""
+    _execute_batch(INSERT_STATUS_SQL, rows, PURGE_STATUSES_SQL)
+
+_sent_writer = None
+_status_writer = None
+_writers_lock = threading.Lock()
+
+def _init_writers():
+    global _sent_writer, _status_writer
+    with _writers_lock:
+        if _status_writer is not None:
+            return
+        # No journal: a status lost in a crash costs one latency sample, not user data
+        _sent_writer = BatchWriter(
+            'outbound_ids',
+            insert_sent_rows,
+            max_batch=Config.STATUS_BATCH_SIZE,
+            max_delay=Config.STATUS_FLUSH_INTERVAL
+        )
+        _status_writer = BatchWriter(
+            'statuses',
+            insert_status_rows,
+            max_batch=Config.STATUS_BATCH_SIZE,
+            max_delay=Config.STATUS_FLUSH_INTERVAL
+        )
+
+def get_status_writers(create=True):
+    """Return the (sent ids, statuses) batch writers, or (None, None) when STATUS_TRACKING is off
+    (or, with create=False, when this process has not started them yet)"""
+    if not Config.STATUS_TRACKING:
+        return None, None
+    if _status_writer is None and create:
+        _init_writers()
+    return _sent_writer, _status_writer
+
+def record_sent(recipient, description, response):
+    """Outbound on_sent hook: remember the message id the Graph API assigned to a send"""
+    writer = get_status_writers()[0]
+    if writer is None:
+        return
+    try:
+        message_id = response.json()['messages'][0]['id']
+    except (ValueError, KeyError, IndexError, TypeError):
+        logger.warning("No message id in Graph API response for %s to %s", description, redact(recipient))
+        return
+    writer.add((message_id, recipient, description, time.time()))
+
+def record_statuses(statuses):
+    """Buffer StatusEvent records from a webhook for bulk insert"""
+    writer = get_status_writers()[1]
+    if writer is None:
+        return
+    for status in statuses:
+        code = STATUS_CODES.get(status.status)
+        if code is None or not status.message_id or not status.timestamp:
+            continue
+        writer.add((status.message_id, code, int(status.timestamp), status.error_code))
+
+def _percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+def _summarize(values, percentiles):
+    values.sort()
+    summary = {'count': len(values)}
+    for pct in percentiles:
+        summary[f"p{pct}"] = round(_percentile(values, pct), 3) if values else None
+    return summary
+
+def get_delivery_latency(window_seconds=86400, percentiles=(50, 90, 95, 99)):
+    """Send-to-delivered and delivered-to-read latency percentiles in seconds (to about 1s), per message type"""
+    samples = {}
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(LATENCY_SQL, (int(window_seconds),))
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for message_type, to_delivered, to_read in rows:
+                sent, delivered, read = samples.setdefault(message_type, ([0], [], []))
+                sent[0] += 1
+                if to_delivered is not None:
+                    delivered.append(to_delivered / 1e6)
+                if to_read is not None:
+                    read.append(to_read / 1e6)
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+    
+    return {
+        message_type: {
+            'sent': sent[0],
+            'send_to_delivered': _summarize(delivered, percentiles),
+            'delivered_to_read': _summarize(read, percentiles)
+        }
+        for message_type, (sent, delivered, read) in sorted(samples.items())
+    }
\ No newline at end of file
@@ -0,0 +1,169 @@
+# export.py - Response Export
+# Streams user_responses as CSV or newline-delimited JSON, over HTTP or to a file
+
+import io
+import os
+import csv
+import hmac
+import json
+import time
+import logging
+from datetime import datetime, date
+from flask import Blueprint, request, Response, jsonify
+from config import Config
+from database import iter_responses, EXPORT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+export_bp = Blueprint('export', __name__)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+def parse_time(value):
+    """Accept unix seconds or an ISO 8601 date/datetime; None passes through"""
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (OverflowError, OSError) as e:
+        # inf or a timestamp beyond what the platform can represent
+        raise ValueError(f"timestamp out of range: {value}") from e
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def csv_chunks(chunks, header=True):
+    """Encode row chunks as CSV, one bytes object per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows([_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only: nothing matched
+        yield buffer.getvalue().encode('utf-8')
+
+def ndjson_chunks(chunks):
+    """Encode row chunks as one JSON object per line, one bytes object per chunk"""
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, map(_value, row))), ensure_ascii=False, separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+def encode(fmt, chunks, header=True):
+    return csv_chunks(chunks, header) if fmt == 'csv' else ndjson_chunks(chunks)
+
+def _last_complete_row(tail, fmt, whole_file):
+    """(offset just past the last complete row in `tail`, its id), or None if `tail` holds none"""
+    end = tail.rfind(b'\n')
+    while end != -1:
+        start = tail.rfind(b'\n', 0, end)
+        if start == -1 and not whole_file:
+            # The line may begin before the tail; the caller reads further back
+            return None
+        if fmt == 'ndjson':
+            try:
+                return end + 1, int(json.loads(tail[start + 1:end])['id'])
+            except (ValueError, KeyError, TypeError):
+                pass
+        else:
+            # A quoted feedback can span lines, so widen the candidate a line at a time until it is one full row
+            first = start
+            while first != -1 or whole_file:
+                rows = list(csv.reader(io.StringIO(tail[first + 1:end + 1].decode('utf-8', 'replace'))))
+                if len(rows) == 1 and len(rows[0]) == len(EXPORT_COLUMNS) and rows[0][0].isdigit():
+                    return end + 1, int(rows[0][0])
+                if first == -1:
+                    break
+                first = tail.rfind(b'\n', 0, first)
+        end = start
+    return None
+
+def truncate_partial_export(path, fmt):
+    """Cut whatever follows the last complete row of an interrupted export, so appending continues cleanly,
+    and return that row's id; 0 when no row is complete (a CSV keeps its header)"""
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        # Only the tail is needed, however large the file
+        window = 64 * 1024
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            found = _last_complete_row(f.read(size - start), fmt, whole_file=start == 0)
+            if found is not None or start == 0:
+                break
+            window *= 4
+        
+        if found is not None:
+            keep, last_id = start + found[0], found[1]
+        else:
+            f.seek(0)
+            header = (','.join(EXPORT_COLUMNS) + '\n').encode('utf-8')
+            keep = len(header) if fmt == 'csv' and f.readline() == header else 0
+            last_id = 0
+        if keep < size:
+            f.truncate(keep)
+        return last_id
+
+def _authorized():
+    supplied = request.headers.get('Authorization', '')
+    return hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {Config.EXPORT_TOKEN}".encode('utf-8'))
+
+def _counted(chunks, stats):
+    for rows in chunks:
+        stats['rows'] += len(rows)
+        stats['last_id'] = rows[-1][0]
+        yield rows
+
+@export_bp.route('/export/responses', methods=['GET'])
+def export_responses():
+    """Chunked export of user_responses.
+    Query: format=csv|ndjson, category, since, until (unix seconds or ISO 8601), after_id, limit"""
+    if not Config.EXPORT_TOKEN:
+        return Response("Export is disabled\n", status=404, mimetype='text/plain')
+    if not _authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    try:
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    category = request.args.get('category') or None
+    
+    stats = {'rows': 0, 'last_id': after_id}
+    
+    def generate():
+        started = time.monotonic()
+        chunks = iter_responses(category=category, since=since, until=until, after_id=after_id,
+                                limit=limit, chunk_size=Config.EXPORT_CHUNK_ROWS)
+        try:
+            yield from encode(fmt, _counted(chunks, stats))
+        finally:
+            chunks.close()
+            logger.info("Exported %d response(s) as %s in %.1fs, last id %s",
+                        stats['rows'], fmt, time.monotonic() - started, stats['last_id'])
+    
+    # No Content-Length, so the WSGI server sends it chunked as it is produced
+    return Response(generate(), mimetype=FORMATS[fmt], headers={
+        'Content-Disposition': f"attachment; filename=responses.{fmt}",
+        'X-Accel-Buffering': 'no'
+    })
\ No newline at end of file
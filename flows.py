@@ -0,0 +1,191 @@
+# flows.py - WhatsApp Flows Endpoint
+# Encrypted data-exchange endpoint that collects every category rating in one Flow submission
+
+import json
+import time
+import base64
+import logging
+from functools import lru_cache
+from flask import Blueprint, request, jsonify, Response
+from config import Config
+from session_manager import SessionManager
+from dedup import get_deduplicator, CLAIM_SQL
+from webhook_handler import signature_valid
+from whatsapp_api import phone_from_flow_token
+from logging_setup import redact
+
+try:
+    # Optional: without it the endpoint answers 404
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    AESGCM = None
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+flows_bp = Blueprint('flows', __name__)
+
+FLOWS_VERSION = "3.0"
+
+# Screens of the survey Flow
+RATE_SCREEN = 'RATE'
+SUCCESS_SCREEN = 'SUCCESS'
+
+# Meta re-fetches the public key on 421 and reports a failed signature check on 432
+DECRYPT_FAILED = 421
+SIGNATURE_FAILED = 432
+
+class FlowDecryptError(Exception):
+    """The request could not be decrypted with our private key"""
+
+@lru_cache(maxsize=1)
+def get_private_key():
+    """Parse the private key once per process; RSA key parsing costs far more than a decryption"""
+    with open(Config.PRIVATE_KEY_PATH, 'rb') as f:
+        password = Config.PRIVATE_KEY_PASSWORD.encode('utf-8') if Config.PRIVATE_KEY_PASSWORD else None
+        return serialization.load_pem_private_key(f.read(), password=password)
+
+@flows_bp.record_once
+def _load_key(state):
+    """Parse the key when the blueprint is registered, not on the first Flow request"""
+    if AESGCM is None:
+        return
+    try:
+        get_private_key()
+    except Exception as e:
+        logger.error("Error loading Flows private key: %s", e)
+
+def decrypt_request(body, private_key):
+    """Decrypt a data-exchange request body; returns (payload, aes_key, iv)"""
+    try:
+        encrypted_key = base64.b64decode(body['encrypted_aes_key'])
+        encrypted_data = base64.b64decode(body['encrypted_flow_data'])
+        iv = base64.b64decode(body['initial_vector'])
+        aes_key = private_key.decrypt(encrypted_key, padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        ))
+        # The GCM tag is the last 16 bytes of encrypted_flow_data, which is what AESGCM expects
+        payload = json.loads(AESGCM(aes_key).decrypt(iv, encrypted_data, None))
+    except (KeyError, TypeError, ValueError, InvalidTag) as e:
+        raise FlowDecryptError(str(e) or type(e).__name__)
+    return payload, aes_key, iv
+
+def encrypt_response(payload, aes_key, iv):
+    """Encrypt a response with the request's AES key and the bit-flipped IV; returns base64 text"""
+    flipped_iv = bytes(byte ^ 0xFF for byte in iv)
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.b64encode(AESGCM(aes_key).encrypt(flipped_iv, data, None)).decode('ascii')
+
+def _rate_screen(error_message=None):
+    data = {"categories": [{"id": category, "title": category.title()} for category in Config.CATEGORIES]}
+    if error_message:
+        data["error_message"] = error_message
+    return {"version": FLOWS_VERSION, "screen": RATE_SCREEN, "data": data}
+
+def parse_ratings(data):
+    """Ratings submitted on the RATE screen, as [(category, rating)]; raises ValueError if invalid"""
+    ratings = []
+    for category in Config.CATEGORIES:
+        value = data.get(category)
+        if value in (None, ''):
+            continue
+        rating = int(value)
+        if not 1 <= rating <= 5:
+            raise ValueError(f"rating for {category} must be 1-5")
+        ratings.append((category, rating))
+    if not ratings:
+        raise ValueError("no categories rated")
+    return ratings
+
+def submit_survey(phone_number, flow_token, ratings, feedback=None):
+    """Persist every rating and complete the survey in one transaction, once per flow token.
+    Returns False if the token was already submitted."""
+    deduplicator = get_deduplicator()
+    key = deduplicator.digest(f"flow:{flow_token}")
+    if deduplicator.seen_recently(key):
+        return False
+    with SessionManager.transaction() as work:
+        # The token is claimed with the rows, so a save that fails leaves it free for the client's retry
+        work.cursor.execute(CLAIM_SQL, (key,))
+        claimed = work.cursor.rowcount == 1
+        if claimed:
+            work.save_feedback_rows([(phone_number, category, rating, feedback) for category, rating in ratings])
+            work.set_user_state(phone_number, 'COMPLETED', None)
+    return deduplicator.record_claim(key, claimed)
+
+def handle_flow_request(payload):
+    """Response payload for a decrypted data-exchange request"""
+    action = payload.get('action')
+    data = payload.get('data') or {}
+    
+    if action == 'ping':
+        return {"version": FLOWS_VERSION, "data": {"status": "active"}}
+    
+    if data.get('error'):
+        # Error notification from the client about our previous response
+        logger.warning("Flow client reported an error: %s", data.get('error_message') or data['error'])
+        return {"version": FLOWS_VERSION, "data": {"acknowledged": True}}
+    
+    if action in ('INIT', 'BACK'):
+        return _rate_screen()
+    
+    if action == 'data_exchange' and payload.get('screen') == RATE_SCREEN:
+        flow_token = payload.get('flow_token')
+        # Tokens expire before their dedup claim is purged, so a submitted token can never be replayed
+        phone_number = phone_from_flow_token(flow_token, max_age=Config.DEDUP_TTL)
+        if phone_number is None:
+            logger.warning("Flow submission with an invalid or expired flow token")
+            return _rate_screen("This survey link has expired. Please send 'restart' to get a new one.")
+        try:
+            ratings = parse_ratings(data)
+        except ValueError as e:
+            return _rate_screen(f"Please check your ratings: {e}")
+        
+        # Each token submits once; a retried request is answered without writing the rows again
+        try:
+            saved = submit_survey(phone_number, flow_token, ratings, data.get('feedback') or None)
+        except Exception as e:
+            logger.error("Could not save Flow survey from %s: %s", redact(phone_number), e)
+            return _rate_screen("We couldn't save your ratings just now. Please submit again.")
+        if saved:
+            logger.info("Flow survey from %s saved with %d rating(s)", redact(phone_number), len(ratings))
+        return {
+            "version": FLOWS_VERSION,
+            "screen": SUCCESS_SCREEN,
+            "data": {"extension_message_response": {"params": {"flow_token": flow_token}}}
+        }
+    
+    logger.warning("Unhandled Flow request: action=%s screen=%s", action, payload.get('screen'))
+    return _rate_screen()
+
+@flows_bp.route('/flows', methods=['POST'])
+def flows_endpoint():
+    """WhatsApp Flows data-exchange endpoint"""
+    if AESGCM is None:
+        return Response("Flows need the cryptography package\n", status=404, mimetype='text/plain')
+    
+    raw = request.get_data()
+    if not signature_valid(raw, request.headers.get('X-Hub-Signature-256')):
+        return Response(status=SIGNATURE_FAILED)
+    
+    try:
+        private_key = get_private_key()
+    except (OSError, ValueError) as e:
+        logger.error("Flows private key unavailable: %s", e)
+        return jsonify({"error": "Server configuration error"}), 500
+    
+    started = time.perf_counter()
+    try:
+        payload, aes_key, iv = decrypt_request(json.loads(raw), private_key)
+    except (FlowDecryptError, ValueError) as e:
+        logger.warning("Could not decrypt Flow request: %s", e)
+        return Response(status=DECRYPT_FAILED)
+    
+    response = encrypt_response(handle_flow_request(payload), aes_key, iv)
+    logger.debug("Flow %s handled in %.1f ms", payload.get('action'), (time.perf_counter() - started) * 1000)
+    return Response(response, mimetype='text/plain')
\ No newline at end of file
@@ -0,0 +1,29 @@
+# gunicorn.conf.py - Gunicorn Server Settings and Hooks
+# Loads the app once in the master and starts every deployment with an empty metrics directory
+
+import os
+import time
+
+# Import and build the app in the master so forked workers start with it already loaded.
+# Worker pools, the DB pool and the log listener are all per-process and restart after fork.
+# Set GUNICORN_PRELOAD=false to load in each worker instead (e.g. to reload code on HUP).
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def on_starting(server):
+    """Runs once in the master, before any worker is forked"""
+    from metrics import clear_metrics_dir
+    clear_metrics_dir()
+
+def when_ready(server):
+    """Runs in the master just before the first workers are forked"""
+    if preload_app:
+        # Connections opened by the preloaded schema check must not be shared with children
+        from database import close_pool
+        close_pool()
+
+def post_fork(server, worker):
+    worker.boot_started = time.monotonic()
+
+def post_worker_init(worker):
+    """Log how long each worker took from fork to serving"""
+    worker.log.info("Worker %s booted in %.0f ms", worker.pid, (time.monotonic() - worker.boot_started) * 1000)
\ No newline at end of file
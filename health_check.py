@@ -2,54 +2,165 @@
 # Health check endpoint with public/private key verification
 
 import os
+import time
 import logging
+import threading
 import hmac
 import hashlib
 import base64
 import json
+from functools import lru_cache
 from flask import Blueprint, request, jsonify, Response
 from config import Config
-from database import get_db_connection
+from database import get_db_connection, get_pool_stats
+from webhook_handler import webhook_workers
+from message_handler import message_dispatcher
+from whatsapp_api import get_outbound_stats
+from session_cache import get_session_cache
+from session_manager import get_feedback_writer
+from dedup import get_deduplicator
+from delivery_tracking import get_status_writers
+from logging_setup import get_logging_stats
+from throttle import get_throttle
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Create blueprint
 health_bp = Blueprint('health', __name__)
 
+# Read once per process; a missing key is logged once and stays missing until restart
+@lru_cache(maxsize=1)
 def load_private_key():
     """Load private key from file"""
     try:
         with open(Config.PRIVATE_KEY_PATH, 'rb') as f:
             return f.read()
     except Exception as e:
-        logger.error(f"Error loading private key: {str(e)}")
+        logger.error("Error loading private key: %s", e)
         return None
 
+@lru_cache(maxsize=1)
 def load_public_key():
     """Load public key from file"""
     try:
         with open(Config.PUBLIC_KEY_PATH, 'rb') as f:
             return f.read()
     except Exception as e:
-        logger.error(f"Error loading public key: {str(e)}")
+        logger.error("Error loading public key: %s", e)
         return None
 
+@health_bp.record_once
+def _load_keys(state):
+    """Load the key files when the blueprint is registered, not on the first signed request"""
+    load_private_key()
+    load_public_key()
+
+class DatabaseProbe:
+    """Checks the database from a background thread so health requests never wait on it.
+    A result older than `ttl` counts as not ready, which also covers a stuck prober."""
+    
+    def __init__(self, interval, ttl):
+        self.interval = interval
+        self.ttl = ttl
+        self._pid = None
+        self._lock = threading.Lock()
+        self._ok = False
+        self._checked_at = None
+        self._latency = None
+        self._error = None
+        self._probes = 0
+        self._failures = 0
+    
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        # First result inline so the very first health request has an answer
+        self.probe()
+        threading.Thread(target=self._run, name='db-probe', daemon=True).start()
+    
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            self.probe()
+    
+    def probe(self):
+        """Run one SELECT 1 through the pool and record the outcome"""
+        started = time.monotonic()
+        error = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        except Exception as e:
+            error = str(e)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'conn' in locals():
+                conn.close()
+        
+        finished = time.monotonic()
+        with self._lock:
+            if error is not None and self._error is None:
+                logger.error("Database health check failed: %s", error)
+            elif error is None and self._error is not None:
+                logger.info("Database health check recovered")
+            self._ok = error is None
+            self._error = error
+            self._checked_at = finished
+            self._latency = finished - started
+            self._probes += 1
+            self._failures += error is not None
+    
+    def status(self):
+        """Latest result without any I/O: (ready, details)"""
+        self._ensure_started()
+        with self._lock:
+            age = time.monotonic() - self._checked_at if self._checked_at is not None else None
+            ready = self._ok and age is not None and age <= self.ttl
+            if age is None:
+                error = "not checked yet"
+            elif self._error is not None:
+                error = self._error
+            else:
+                error = None if ready else "stale"
+            return ready, {
+                "database_connected": ready,
+                "checked_seconds_ago": round(age, 3) if age is not None else None,
+                "latency_ms": round(self._latency * 1000, 2) if self._latency is not None else None,
+                "error": error
+            }
+    
+    def stats(self):
+        with self._lock:
+            return {"probes": self._probes, "failures": self._failures, "interval": self.interval, "ttl": self.ttl}
+
+db_probe = DatabaseProbe(Config.HEALTH_PROBE_INTERVAL, Config.HEALTH_PROBE_TTL)
+
+@health_bp.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness: the process can serve requests. No I/O, so a slow database never restarts workers."""
+    return Response("ok", mimetype='text/plain')
+
+@health_bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: the cached database probe is recent and passing"""
+    ready, details = db_probe.status()
+    return jsonify(dict(details, status="ready" if ready else "not_ready")), 200 if ready else 503
+
 @health_bp.route('/health', methods=['GET', 'POST'])
 def health_check():
     """Health check endpoint with public/private key verification"""
     
-    # Check database connection
-    db_connected = False
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        db_connected = True
-        cursor.close()
-    except Exception as e:
-        logger.error(f"Database health check failed: {str(e)}")
+    # Database state comes from the background probe
+    db_connected, _ = db_probe.status()
     
     # Prepare health data
     health_data = {
@@ -82,7 +193,7 @@ def health_check():
             
             # Compare signatures
             if hmac.compare_digest(calculated_signature, signature_header):
-                logger.info("Health check signature verified")
+                logger.debug("Health check signature verified")
                 health_data["whatsapp_api_connected"] = True
                 return jsonify(health_data), 200
             else:
@@ -90,11 +201,44 @@ def health_check():
                 return jsonify({"error": "Invalid signature"}), 401
             
         except Exception as e:
-            logger.error(f"Error processing health check: {str(e)}")
+            logger.error("Error processing health check: %s", e)
             return jsonify({"error": "Server error"}), 500
     
     # DEFAULT: Return Base64 encoded response for WhatsApp Flow health checks
     json_data = json.dumps(health_data)
     base64_data = base64.b64encode(json_data.encode('utf-8')).decode('utf-8')
-    logger.info(f"Returning Base64 encoded health check: {base64_data}")
-    return Response(base64_data, mimetype='text/plain')
\ No newline at end of file
+    logger.debug("Returning Base64 encoded health check: %s", base64_data)
+    return Response(base64_data, mimetype='text/plain')
+
+def _stats_authorized():
+    supplied = request.headers.get('Authorization', '')
+    return hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {Config.STATS_TOKEN}".encode('utf-8'))
+
+@health_bp.route('/health/stats', methods=['GET'])
+def health_stats():
+    """Runtime metrics for this worker process. Only reads what the process has already started;
+    anything not in use yet is reported as null."""
+    if not Config.STATS_TOKEN:
+        return Response("Stats are disabled\n", status=404, mimetype='text/plain')
+    if not _stats_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    cache = get_session_cache(create=False)
+    writer = get_feedback_writer(create=False)
+    sent_writer, status_writer = get_status_writers(create=False)
+    throttle = get_throttle(create=False)
+    deduplicator = get_deduplicator(create=False)
+    return jsonify({
+        "db_pool": get_pool_stats(),
+        "db_probe": db_probe.stats(),
+        "webhook_queue": webhook_workers.stats(),
+        "message_shards": message_dispatcher.stats(),
+        "outbound": get_outbound_stats(),
+        "session_cache": cache.stats() if cache is not None else None,
+        "feedback_writer": writer.stats() if writer is not None else None,
+        "dedup": deduplicator.stats() if deduplicator is not None else None,
+        "throttle": throttle.stats() if throttle is not None else None,
+        "sent_ids_writer": sent_writer.stats() if sent_writer is not None else None,
+        "status_writer": status_writer.stats() if status_writer is not None else None,
+        "logging": get_logging_stats()
+    }), 200
\ No newline at end of file
@@ -0,0 +1,149 @@
+# logging_setup.py - Logging Configuration
+# One process-wide logging setup: records are queued on the hot path and formatted by a background listener
+
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from config import Config
+
+# Attributes every LogRecord has; anything else came from `extra=` and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Phone numbers inside JSON payload dumps
+_PAYLOAD_PHONE = re.compile(rb'("(?:wa_id|from|to|recipient_id)"\s*:\s*")(\d+)(")')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra=` fields as top-level keys"""
+    
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class _Redacted:
+    """Defers masking to whenever the record is actually formatted"""
+    __slots__ = ('value', 'mask')
+    
+    def __init__(self, value, mask):
+        self.value = value
+        self.mask = mask
+    
+    def __str__(self):
+        return self.mask(self.value) if Config.LOG_REDACT_PHONES else str(self.value)
+    
+    __repr__ = __str__
+
+def _mask_phone(phone_number):
+    phone_number = str(phone_number)
+    return '*' * max(len(phone_number) - 4, 0) + phone_number[-4:]
+
+def _mask_payload(raw):
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+    masked = _PAYLOAD_PHONE.sub(lambda m: m.group(1) + b'*' * max(len(m.group(2)) - 4, 0) + m.group(2)[-4:] + m.group(3), raw)
+    return masked.decode('utf-8', 'replace')
+
+def redact(phone_number):
+    """Log argument that shows only the last four digits of a phone number"""
+    return _Redacted(phone_number, _mask_phone)
+
+def redact_payload(raw):
+    """Log argument for a raw webhook or API body with the phone numbers in it masked"""
+    return _Redacted(raw, _mask_payload)
+
+def should_log_payload(logger):
+    """True when a payload dump is enabled for this logger and this call falls in the sample"""
+    return logger.isEnabledFor(logging.DEBUG) and random.random() < Config.LOG_PAYLOAD_SAMPLE_RATE
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener untouched; drops them rather than block when the queue is full"""
+    
+    dropped = 0
+    
+    def prepare(self, record):
+        # Formatting happens on the listener thread; log arguments must not be mutated after the call
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+_listener = None
+_listener_lock = threading.Lock()
+_hooks_registered = False
+
+def _build_handler():
+    handler = logging.StreamHandler(sys.stderr)
+    if Config.LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return handler
+
+def _start_listener(root):
+    global _listener
+    records = queue.Queue(Config.LOG_QUEUE_SIZE)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_NonBlockingQueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, _build_handler(), respect_handler_level=True)
+    _listener.start()
+
+def _restart_after_fork():
+    # The listener thread does not survive fork(); give the child its own
+    global _listener
+    if _listener is not None:
+        _listener = None
+        _start_listener(logging.getLogger())
+
+def configure_logging():
+    """Install the queued handler on the root logger. Safe to call more than once."""
+    global _hooks_registered
+    with _listener_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger()
+        root.setLevel(Config.LOG_LEVEL)
+        _start_listener(root)
+        if not _hooks_registered:
+            _hooks_registered = True
+            atexit.register(stop_logging)
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=_restart_after_fork)
+
+def stop_logging():
+    """Flush queued records, stop the listener thread and log synchronously from then on"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        # Drain hooks that run after this still get their messages out
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = None
+
+def get_logging_stats():
+    """Records dropped because the log queue was full"""
+    return {'dropped': _NonBlockingQueueHandler.dropped}
\ No newline at end of file
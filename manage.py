@@ -0,0 +1,249 @@
+# manage.py - Management Commands
+# Command line entry point for maintenance tasks
+#
+# Usage: python manage.py migrate [--check] [--to VERSION]
+#        python manage.py rebuild-stats [--check]
+#        python manage.py check-flow
+#        python manage.py delivery-latency [--hours N]
+#        python manage.py throttle-stats [--top N]
+#        python manage.py broadcast CAMPAIGN RECIPIENTS [--template NAME [--language CODE]]
+#                                   [--concurrency N] [--resend-unknown]
+#        python manage.py export [--format csv|ndjson] [--output FILE [--resume]] [--category C]
+#                                [--since T] [--until T] [--after-id N] [--limit N]
+
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+def migrate(args):
+    """Apply pending schema migrations, or only report them with --check"""
+    from migrations import migrate as apply_migrations, get_schema_version, pending_migrations, SCHEMA_VERSION
+    
+    if args.check:
+        version = get_schema_version()
+        pending = pending_migrations(version)
+        for migration in pending:
+            print(f"pending {migration.version}: {migration.description}")
+        print(f"Database schema at version {version}, code expects {SCHEMA_VERSION}")
+        return 1 if pending else 0
+    
+    applied = apply_migrations(target=args.to)
+    for migration in applied:
+        print(f"applied {migration.version}: {migration.description}")
+    if not applied:
+        print("No migrations to apply")
+    return 0
+
+def rebuild_stats(args):
+    """Recompute survey rollups from user_responses, or only verify them with --check"""
+    from database import rebuild_survey_stats
+    
+    mismatches = rebuild_survey_stats(check_only=args.check)
+    for mismatch in mismatches:
+        print(mismatch)
+    
+    if not mismatches:
+        print("Survey stats are consistent with user_responses")
+        return 0
+    if args.check:
+        print(f"{len(mismatches)} mismatch(es) found; run without --check to rebuild")
+        return 1
+    print(f"Survey stats rebuilt, {len(mismatches)} mismatch(es) corrected")
+    return 0
+
+def check_flow(args):
+    """Validate the conversation flow and summarize its compiled transition table"""
+    from conversation import SURVEY_FLOW, validate_flow, ConversationEngine
+    
+    problems = validate_flow(SURVEY_FLOW)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} problem(s) in the conversation flow")
+        return 1
+    engine = ConversationEngine(SURVEY_FLOW)
+    print(f"Conversation flow OK: {len(engine.states)} state(s), {len(engine.table)} transition(s)")
+    return 0
+
+def delivery_latency(args):
+    """Print send-to-delivered and delivered-to-read latency percentiles per message type"""
+    from delivery_tracking import get_delivery_latency
+    
+    report = get_delivery_latency(window_seconds=args.hours * 3600)
+    if not report:
+        print(f"No messages sent in the last {args.hours} hour(s)")
+        return 0
+    
+    print(f"{'message type':<20} {'stage':<18} {'count':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8}")
+    for message_type, stages in report.items():
+        print(f"{message_type:<20} {'sent':<18} {stages['sent']:>7}")
+        for stage in ('send_to_delivered', 'delivered_to_read'):
+            summary = stages[stage]
+            cells = ''.join(
+                f" {summary[p]:>8.2f}" if summary[p] is not None else f" {'-':>8}"
+                for p in ('p50', 'p90', 'p95', 'p99')
+            )
+            print(f"{'':<20} {stage:<18} {summary['count']:>7}{cells}")
+    print("Status times are whole seconds, so latencies are accurate to about 1s")
+    return 0
+
+def throttle_stats(args):
+    """List the senders throttled most often on this host, from the table the workers share"""
+    from config import Config
+    from throttle import get_throttle
+    
+    throttle = get_throttle()
+    if throttle is None:
+        print("Throttling is disabled (THROTTLE_ENABLED=false)")
+        return 0
+    offenders = throttle.top_offenders(args.top)
+    print(f"Limit: {throttle.limit} messages per {Config.THROTTLE_WINDOW:g}s, "
+          f"repeated replies debounced for {Config.THROTTLE_DEBOUNCE:g}s")
+    if not offenders:
+        print("No sender has been throttled")
+        return 0
+    print(f"{'sender':<20} {'throttled':>10}")
+    for offender in offenders:
+        print(f"{offender['sender']:<20} {offender['throttled']:>10}")
+    return 0
+
+def broadcast(args):
+    """Send survey invitations to every number in a recipient file; rerun the same campaign to resume"""
+    from broadcast import Broadcast, BroadcastError, format_progress
+    
+    live = sys.stderr.isatty()
+    def show(progress):
+        # Rewrite one line on a terminal, append lines when redirected to a log
+        print(('\r' if live else '') + format_progress(progress), end='' if live else '\n', file=sys.stderr, flush=True)
+    
+    try:
+        run = Broadcast(args.campaign, args.recipients, template=args.template, language=args.language,
+                        concurrency=args.concurrency)
+        summary = run.run(resend_unknown=args.resend_unknown, on_progress=show)
+    except (BroadcastError, OSError) as e:
+        print(f"Broadcast failed: {e}", file=sys.stderr)
+        return 1
+    if live:
+        print(file=sys.stderr)
+    
+    progress = run.progress()
+    print(f"This run: {progress['sent']} sent, {progress['failed']} failed, {progress['skipped']} already claimed, "
+          f"{progress['invalid']} line(s) without a phone number, {progress['elapsed']:.0f}s")
+    print("Campaign " + args.campaign + ": " + ", ".join(f"{count} {status}" for status, count in sorted(summary.items())))
+    if summary.get('unknown'):
+        print(f"{summary['unknown']} recipient(s) were being sent when an earlier run died; "
+              "rerun with --resend-unknown to send them anyway")
+    if run.interrupted:
+        print("Interrupted; run the same command again to resume")
+        return 130
+    return 0
+
+def _time_arg(value):
+    """argparse type for --since/--until, so a bad value is a usage error rather than a traceback"""
+    from export import parse_time
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time {value!r} (expected unix seconds or ISO 8601)")
+
+def export(args):
+    """Stream user_responses to a file or stdout; --resume continues after the last id in --output"""
+    from config import Config
+    from database import iter_responses
+    from export import encode, truncate_partial_export
+    
+    after_id = args.after_id
+    resuming = False
+    if args.resume and args.output and os.path.exists(args.output):
+        # An interrupted run can leave half a row at the end; drop it before appending
+        size = os.path.getsize(args.output)
+        last_id = truncate_partial_export(args.output, args.format)
+        if os.path.getsize(args.output) < size:
+            print(f"Removed {size - os.path.getsize(args.output)} byte(s) of an incomplete row", file=sys.stderr)
+        resuming = os.path.getsize(args.output) > 0
+        if resuming:
+            after_id = max(after_id, last_id)
+            print(f"Resuming after id {after_id}", file=sys.stderr)
+    
+    rows = 0
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+    
+    chunks = iter_responses(category=args.category, since=args.since, until=args.until,
+                            after_id=after_id, limit=args.limit, chunk_size=Config.EXPORT_CHUNK_ROWS)
+    out = open(args.output, 'ab' if resuming else 'wb') if args.output else sys.stdout.buffer
+    try:
+        # A resumed CSV already has its header
+        for data in encode(args.format, counted(chunks), header=not resuming):
+            out.write(data)
+        out.flush()
+    finally:
+        if args.output:
+            out.close()
+    print(f"Exported {rows} response(s)", file=sys.stderr)
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TTD Survey Bot management commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    schema = commands.add_parser('migrate', help="Create the database and apply pending schema migrations")
+    schema.add_argument('--check', action='store_true', help="Only list pending migrations; exit 1 if any")
+    schema.add_argument('--to', type=int, help="Stop after this version (default: latest)")
+    schema.set_defaults(func=migrate)
+    
+    rebuild = commands.add_parser('rebuild-stats', help="Recompute the survey statistics rollups")
+    rebuild.add_argument('--check', action='store_true', help="Only verify the rollups, do not modify them")
+    rebuild.set_defaults(func=rebuild_stats)
+    
+    flow = commands.add_parser('check-flow', help="Validate the conversation flow definition")
+    flow.set_defaults(func=check_flow)
+    
+    latency = commands.add_parser('delivery-latency', help="Report delivery and read latency percentiles")
+    latency.add_argument('--hours', type=int, default=24, help="Only messages sent in the last N hours (default 24)")
+    latency.set_defaults(func=delivery_latency)
+    
+    offenders = commands.add_parser('throttle-stats', help="Report the most throttled senders on this host")
+    offenders.add_argument('--top', type=int, default=10, help="Number of senders to list (default 10)")
+    offenders.set_defaults(func=throttle_stats)
+    
+    invite = commands.add_parser('broadcast', help="Send survey invitations to a recipient file, resumably")
+    invite.add_argument('campaign', help="Campaign name; rerunning a campaign resumes it")
+    invite.add_argument('recipients', help="File with one phone number per line (first CSV column)")
+    invite.add_argument('--template', help="Approved template to send (default: the interactive survey start, "
+                                           "only deliverable within 24 hours of the recipient's last message)")
+    invite.add_argument('--language', default='en', help="Template language code (default en)")
+    invite.add_argument('--concurrency', type=int, help="Parallel sends (default BROADCAST_CONCURRENCY)")
+    invite.add_argument('--resend-unknown', action='store_true',
+                        help="Also send recipients whose outcome an earlier, crashed run did not record")
+    invite.set_defaults(func=broadcast)
+    
+    dump = commands.add_parser('export', help="Stream survey responses as CSV or NDJSON")
+    dump.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    dump.add_argument('--output', help="File to write (default: stdout)")
+    dump.add_argument('--resume', action='store_true', help="Append to --output after the last id it contains")
+    dump.add_argument('--category', help="Only this category")
+    dump.add_argument('--since', type=_time_arg, help="Only responses at or after this time (unix seconds or ISO 8601)")
+    dump.add_argument('--until', type=_time_arg, help="Only responses before this time (unix seconds or ISO 8601)")
+    dump.add_argument('--after-id', type=int, default=0, help="Only responses with a larger id")
+    dump.add_argument('--limit', type=int, help="Stop after this many responses")
+    dump.set_defaults(func=export)
+    
+    args = parser.parse_args(argv)
+    
+    from logging_setup import configure_logging
+    configure_logging()
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -1,95 +1,116 @@
 # message_handler.py - Message Processing
 # Processes incoming messages and interactions
 
+import time
 import logging
+from collections import namedtuple
 from flask import Blueprint, request, jsonify
-from whatsapp_api import send_text_message, send_interactive_buttons, send_rating_buttons, send_category_list
+from whatsapp_api import send_message, text_message
+from conversation import engine, event_of, NEW
 from session_manager import SessionManager
+from config import Config
+from worker_pool import ShardedDispatcher
+from dedup import get_deduplicator
+from webhook_parser import parse_payload
+from metrics import HANDLE_MESSAGE_SECONDS, HANDLE_MESSAGE_ERRORS, MESSAGES_DROPPED
+from delivery_tracking import record_statuses
+from throttle import admit, ALLOWED, NOTICE, NOTICE_TEXT
+from logging_setup import redact
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Create blueprint
 message_bp = Blueprint('message', __name__)
 
+# What one inbound message leads to, decided without any I/O:
+#   state     - state to store, or None to leave it unchanged
+#   category  - category to store with the state (None keeps the stored one)
+#   feedback  - (category, rating) to save in the same transaction, or None
+#   replies   - rendered (description, payload) messages to send, in order
+Decision = namedtuple('Decision', ['state', 'category', 'feedback', 'replies'])
+
+NO_ACTION = Decision(None, None, None, ())
+
+def decide(message, phone_number, user_state):
+    """Conversation logic for one InboundMessage given the sender's stored state"""
+    state = user_state['current_state'] if user_state else NEW
+    transition = engine.lookup(state, *event_of(message))
+    if transition is None:
+        return NO_ACTION
+    
+    stored_category = user_state['selected_category'] if user_state else None
+    feedback = (stored_category, transition.rating) if transition.rating is not None else None
+    return Decision(
+        transition.state,
+        transition.category,
+        feedback,
+        engine.replies(transition, phone_number, stored_category)
+    )
+
+def execute(phone_number, decision):
+    """Persist a decision, then queue its replies"""
+    if decision.feedback is not None:
+        # Save the feedback and advance the state in one transaction
+        category, rating = decision.feedback
+        with SessionManager.transaction() as work:
+            work.save_feedback(phone_number, category, rating)
+            work.set_user_state(phone_number, decision.state, decision.category)
+    elif decision.state is not None:
+        SessionManager.set_user_state(phone_number, decision.state, decision.category)
+    
+    for rendered in decision.replies:
+        send_message(phone_number, rendered)
+
 def handle_message(message, phone_number):
-    """Handle incoming WhatsApp message"""
+    """Handle an incoming WhatsApp message (an InboundMessage record)"""
+    started = time.perf_counter()
+    
     # Get current user state
     user_state = SessionManager.get_user_state(phone_number)
-    
-    if not user_state:
-        # New user or restarting conversation
-        SessionManager.set_user_state(phone_number, 'WELCOME')
-        send_text_message(phone_number, "Welcome to the Tirumala Tirupati Devasthanam Feedback Survey. Your opinion matters to us!")
-        send_category_list(phone_number)
+    state = user_state['current_state'] if user_state else NEW
+    try:
+        execute(phone_number, decide(message, phone_number, user_state))
+    except Exception:
+        HANDLE_MESSAGE_ERRORS.labels(state).inc()
+        raise
+    finally:
+        HANDLE_MESSAGE_SECONDS.labels(state).observe(time.perf_counter() - started)
+
+def _handle_dispatched(item):
+    message, phone_number = item
+    # Meta redelivers when our 200 is slow; drop repeats before any work. Claimed on the shard, after a
+    # successful enqueue, so a message the shards rejected is never recorded as seen.
+    if not get_deduplicator().claim(message.id):
+        logger.info("Duplicate delivery of message %s suppressed", message.id)
         return
-    
-    current_state = user_state['current_state']
-    
-    # Handle text messages
-    if 'text' in message:
-        text = message['text']['body'].strip()
-        
-        # If user sends "restart" at any point, reset the conversation
-        if text.lower() == 'restart':
-            SessionManager.set_user_state(phone_number, 'WELCOME')
-            send_text_message(phone_number, "Welcome back to the TTD Feedback Survey.")
-            send_category_list(phone_number)
-            return
-    
-    # Handle interactive responses (button clicks or list selections)
-    if 'interactive' in message:
-        if message['interactive']['type'] == 'button_reply':
-            # Handle button replies (like ratings)
-            button_id = message['interactive']['button_reply']['id']
-            
-            if current_state == 'AWAITING_RATING':
-                # Extract rating from button ID (format: rating_X)
-                rating = int(button_id.split('_')[1])
-                category = user_state['selected_category']
-                
-                # Save the feedback
-                SessionManager.save_feedback(phone_number, category, rating)
-                
-                # Thank the user and ask if they want to provide feedback in another category
-                send_text_message(phone_number, f"Thank you for your {rating}-star rating for {category}. Your feedback is valuable to us.")
-                send_interactive_buttons(
-                    phone_number, 
-                    "Provide More Feedback?", 
-                    "Would you like to provide feedback on another category?",
-                    ["Yes", "No"]
-                )
-                SessionManager.set_user_state(phone_number, 'AWAITING_MORE_FEEDBACK')
-                
-            elif current_state == 'AWAITING_MORE_FEEDBACK':
-                if button_id == 'btn_1':  # Yes
-                    send_category_list(phone_number)
-                    SessionManager.set_user_state(phone_number, 'WELCOME')
-                else:  # No
-                    send_text_message(phone_number, "Thank you for completing our survey. Your feedback helps us improve. Have a blessed day! 🙏")
-                    SessionManager.set_user_state(phone_number, 'COMPLETED')
-        
-        elif message['interactive']['type'] == 'list_reply':
-            # Handle list selections (like category selection)
-            category = message['interactive']['list_reply']['id']
-            
-            # Set user state and selected category
-            SessionManager.set_user_state(phone_number, 'AWAITING_RATING', category)
-            
-            # Ask for rating
-            send_text_message(phone_number, f"Please rate your experience with {category}:")
-            send_rating_buttons(phone_number)
+    # One sender tapping fast or a client stuck in a loop must not spend everyone's API quota
+    verdict = admit(message)
+    if verdict == NOTICE:
+        send_message(phone_number, text_message(phone_number, NOTICE_TEXT))
+    if verdict != ALLOWED:
+        return
+    handle_message(message, phone_number)
+
+# Each sender is pinned to one shard so their messages are handled in order (within this process),
+# while different senders are handled in parallel
+message_dispatcher = ShardedDispatcher(
+    'message',
+    _handle_dispatched,
+    shards=Config.MESSAGE_SHARDS,
+    queue_size=Config.MESSAGE_SHARD_QUEUE_SIZE,
+    enqueue_timeout=Config.MESSAGE_SHARD_ENQUEUE_TIMEOUT,
+    drain_timeout=Config.WEBHOOK_DRAIN_TIMEOUT
+)
 
 # Function to process incoming webhook data
-def process_webhook(data):
-    """Process incoming webhook data from WhatsApp"""
-    # Check if this is a WhatsApp message notification
-    if 'object' in data and data['object'] == 'whatsapp_business_account':
-        if 'entry' in data and data['entry']:
-            for entry in data['entry']:
-                if 'changes' in entry and entry['changes']:
-                    for change in entry['changes']:
-                        if 'value' in change and 'messages' in change['value']:
-                            for message in change['value']['messages']:
-                                handle_message(message, change['value']['contacts'][0]['wa_id'])
\ No newline at end of file
+def process_webhook(payload):
+    """Process an incoming webhook payload from WhatsApp (raw body bytes or a decoded dict)"""
+    messages, statuses = parse_payload(payload)
+    if statuses:
+        record_statuses(statuses)
+    
+    for message in messages:
+        if not message_dispatcher.submit(message.wa_id, (message, message.wa_id)):
+            # Meta already has our 200 and will not redeliver, so this message is lost; make it visible
+            MESSAGES_DROPPED.labels('shard_queue_full').inc()
+            logger.error("Message shard queue full, dropped message %s from %s", message.id, redact(message.wa_id))
\ No newline at end of file
@@ -0,0 +1,52 @@
+# message_templates.py - Pre-serialized Message Payloads
+# Builds static message payloads once and splices dynamic fields in at send time
+
+import json
+
+# Compact UTF-8 JSON, matching what we send on the wire
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+class Slot:
+    """Placeholder for a value filled in when a template is rendered"""
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def marker(self):
+        return f"\x00slot:{self.name}\x00"
+
+class PayloadTemplate:
+    """A JSON payload serialized once; render() splices slot values into the cached bytes"""
+    
+    def __init__(self, payload):
+        slots = []
+        
+        def mark(value):
+            if isinstance(value, Slot):
+                slots.append(value.name)
+                return value.marker()
+            if isinstance(value, dict):
+                return {key: mark(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [mark(item) for item in value]
+            return value
+        
+        serialized = _encode(mark(payload))
+        
+        # Split the serialized text around each quoted marker so only the slot values are encoded per call
+        self.slots = slots
+        self._segments = []
+        for name in slots:
+            quoted = _encode(Slot(name).marker())
+            head, serialized = serialized.split(quoted, 1)
+            self._segments.append(head.encode('utf-8'))
+        self._segments.append(serialized.encode('utf-8'))
+    
+    def render(self, **values):
+        """Return the payload bytes with each slot replaced by its JSON-encoded value"""
+        segments = self._segments
+        parts = [segments[0]]
+        for index, name in enumerate(self.slots, start=1):
+            parts.append(_encode(values[name]).encode('utf-8'))
+            parts.append(segments[index])
+        return b''.join(parts)
\ No newline at end of file
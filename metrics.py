@@ -0,0 +1,115 @@
+# metrics.py - Prometheus Metrics
+# Per-stage latency histograms and counters, aggregated across worker processes
+
+import os
+import glob
+import time
+import logging
+from functools import wraps
+from flask import Blueprint, Response
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Every worker writes its samples to mmap files in a shared directory; a scrape sums them.
+# The directory has to be known before prometheus_client is imported.
+if Config.METRICS_ENABLED:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', Config.METRICS_DIR)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+try:
+    # Optional: without it every metric below is a no-op
+    from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError:
+    Counter = Histogram = None
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+class _NoopMetric:
+    """Stands in for a metric when metrics are disabled or prometheus_client is missing"""
+    
+    def labels(self, *args, **kwargs):
+        return self
+    
+    def observe(self, value):
+        pass
+    
+    def inc(self, amount=1):
+        pass
+
+_NOOP = _NoopMetric()
+
+def _histogram(name, documentation, labelnames=(), buckets=None):
+    if Histogram is None or not Config.METRICS_ENABLED:
+        return _NOOP
+    return Histogram(name, documentation, labelnames, buckets=buckets or Histogram.DEFAULT_BUCKETS)
+
+def _counter(name, documentation, labelnames=()):
+    if Counter is None or not Config.METRICS_ENABLED:
+        return _NOOP
+    return Counter(name, documentation, labelnames)
+
+# Signature checks take microseconds, so they get their own buckets
+SIGNATURE_SECONDS = _histogram(
+    'ttd_webhook_signature_seconds', "Webhook HMAC signature verification time",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+)
+WEBHOOK_REQUESTS = _counter(
+    'ttd_webhook_requests_total', "Webhook POSTs by outcome", ['result']
+)
+SESSION_DB_SECONDS = _histogram(
+    'ttd_session_db_seconds', "SessionManager database call time", ['operation']
+)
+GRAPH_API_SECONDS = _histogram(
+    'ttd_graph_api_request_seconds', "Time of each Graph API send attempt", ['message_type']
+)
+OUTBOUND_MESSAGES = _counter(
+    'ttd_outbound_messages_total', "Outbound sends by final result", ['message_type', 'result']
+)
+HANDLE_MESSAGE_SECONDS = _histogram(
+    'ttd_handle_message_seconds', "Total handle_message time by conversation state", ['state'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+HANDLE_MESSAGE_ERRORS = _counter(
+    'ttd_handle_message_errors_total', "handle_message calls that raised, by conversation state", ['state']
+)
+MESSAGES_DROPPED = _counter(
+    'ttd_messages_dropped_total', "Inbound messages dropped before handling, by reason", ['reason']
+)
+THROTTLE_VERDICTS = _counter(
+    'ttd_throttle_verdicts_total', "Inbound messages by per-sender throttle verdict", ['result']
+)
+
+def timed(histogram, *labels):
+    """Decorator recording the wall time of each call in a labelled histogram"""
+    metric = histogram.labels(*labels) if labels else histogram
+    
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def clear_metrics_dir():
+    """Remove sample files left by earlier runs; call once before any worker starts"""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        os.unlink(path)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint, summed over every worker process"""
+    if Histogram is None or not Config.METRICS_ENABLED:
+        return Response("Metrics are disabled\n", status=404, mimetype='text/plain')
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
\ No newline at end of file
@@ -0,0 +1,237 @@
+# migrations.py - Schema Migrations
+# Versioned DDL applied by `python manage.py migrate`; app startup only checks the recorded version
+
+import logging
+from collections import namedtuple
+import mysql.connector
+from config import Config
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'description', 'statements'])
+
+# Append new migrations at the end; never edit one that has shipped. MySQL commits DDL implicitly,
+# so every statement must be safe to re-run if a migration fails half way.
+MIGRATIONS = [
+    Migration(1, "Survey responses and user state", [
+        """
+        CREATE TABLE IF NOT EXISTS user_responses (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            phone_number VARCHAR(20),
+            category VARCHAR(50),
+            rating INT,
+            feedback TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX (phone_number)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            phone_number VARCHAR(20) PRIMARY KEY,
+            current_state VARCHAR(50),
+            selected_category VARCHAR(50),
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    # Rollups maintained alongside every feedback insert, seeded from the responses an upgraded
+    # deployment already has (recomputed, so re-running the seed is harmless)
+    Migration(2, "Feedback rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category VARCHAR(50) PRIMARY KEY,
+            response_count INT NOT NULL DEFAULT 0,
+            rating_sum BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS survey_respondents (
+            phone_number VARCHAR(20) PRIMARY KEY
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS survey_counters (
+            name VARCHAR(50) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO category_stats (category, response_count, rating_sum)
+        SELECT category, COUNT(*), COALESCE(SUM(rating), 0) FROM user_responses
+        WHERE category IS NOT NULL GROUP BY category
+        ON DUPLICATE KEY UPDATE response_count = VALUES(response_count), rating_sum = VALUES(rating_sum)
+        """,
+        """
+        INSERT IGNORE INTO survey_respondents (phone_number)
+        SELECT DISTINCT phone_number FROM user_responses WHERE phone_number IS NOT NULL
+        """,
+        """
+        REPLACE INTO survey_counters (name, value) SELECT 'unique_users', COUNT(*) FROM survey_respondents
+        """
+    ]),
+    # Digests of processed WhatsApp message ids, for duplicate suppression
+    Migration(3, "Processed message digests", [
+        """
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_digest BINARY(16) PRIMARY KEY,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX (seen_at)
+        )
+        """
+    ]),
+    # Ids of messages we sent, joined with status callbacks for delivery latency
+    Migration(4, "Delivery tracking", [
+        """
+        CREATE TABLE IF NOT EXISTS outbound_messages (
+            message_id VARCHAR(128) PRIMARY KEY,
+            recipient VARCHAR(20),
+            message_type VARCHAR(32),
+            sent_at TIMESTAMP(3) NOT NULL,
+            INDEX (sent_at)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS message_statuses (
+            message_id VARCHAR(128) NOT NULL,
+            status TINYINT NOT NULL,
+            status_at TIMESTAMP NOT NULL,
+            error_code INT NULL,
+            PRIMARY KEY (message_id, status),
+            INDEX (status_at)
+        )
+        """
+    ]),
+    # Invitation campaigns: the file offset to resume from and each recipient's claim and send result
+    Migration(5, "Broadcast campaigns", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_campaigns (
+            name VARCHAR(64) PRIMARY KEY,
+            source VARCHAR(255) NOT NULL,
+            message_type VARCHAR(32) NOT NULL,
+            file_offset BIGINT NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            campaign VARCHAR(64) NOT NULL,
+            phone_number VARCHAR(20) NOT NULL,
+            status TINYINT NOT NULL,
+            message_id VARCHAR(128) NULL,
+            seeded_state VARCHAR(50) NULL,
+            previous_state VARCHAR(50) NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign, phone_number),
+            INDEX (campaign, status)
+        )
+        """
+    ])
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+CREATE_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+CURRENT_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) FROM schema_version"
+RECORD_VERSION_SQL = "INSERT INTO schema_version (version, description) VALUES (%s, %s)"
+
+# Unknown database / unknown table: nothing has been migrated yet
+_NOT_MIGRATED_ERRNOS = (1049, 1146)
+
+# Serializes concurrent `migrate` runs, e.g. from several deploy jobs
+MIGRATE_LOCK = 'ttd_survey_migrate'
+MIGRATE_LOCK_TIMEOUT = 60
+
+class SchemaError(RuntimeError):
+    """The database schema is older than this code expects"""
+
+def get_schema_version():
+    """Version recorded in schema_version, or 0 if the database has never been migrated"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(CURRENT_VERSION_SQL)
+        return int(cursor.fetchone()[0])
+    except mysql.connector.Error as e:
+        if getattr(e, 'errno', None) in _NOT_MIGRATED_ERRNOS:
+            return 0
+        raise
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def check_schema():
+    """Fast startup check: one query, no DDL. Raises SchemaError if migrations are pending."""
+    version = get_schema_version()
+    if version < SCHEMA_VERSION:
+        raise SchemaError(
+            f"Database schema is at version {version}, this code needs {SCHEMA_VERSION}; "
+            "run `python manage.py migrate`"
+        )
+    if version > SCHEMA_VERSION:
+        # Expected briefly while rolling back a deploy; migrations only ever add
+        logger.warning("Database schema version %d is newer than this code (%d)", version, SCHEMA_VERSION)
+    return version
+
+def pending_migrations(version):
+    """Migrations after `version`, in order"""
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+def migrate(target=None):
+    """Create the database if needed and apply pending migrations up to `target` (default: latest).
+    Returns the migrations applied."""
+    target = SCHEMA_VERSION if target is None else target
+    try:
+        # Server-level connection: the database itself may not exist yet
+        conn = mysql.connector.connect(
+            host=Config.DB_HOST,
+            user=Config.DB_USERNAME,
+            password=Config.DB_PASSWORD
+        )
+        cursor = conn.cursor()
+        
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {Config.DB_NAME}")
+        cursor.execute(f"USE {Config.DB_NAME}")
+        
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATE_LOCK, MIGRATE_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise SchemaError("Another migration is still running")
+        
+        try:
+            cursor.execute(CREATE_VERSION_TABLE_SQL)
+            cursor.execute(CURRENT_VERSION_SQL)
+            version = int(cursor.fetchone()[0])
+            
+            applied = []
+            for migration in pending_migrations(version):
+                if migration.version > target:
+                    break
+                logger.info("Applying migration %d: %s", migration.version, migration.description)
+                for statement in migration.statements:
+                    cursor.execute(statement)
+                cursor.execute(RECORD_VERSION_SQL, (migration.version, migration.description))
+                conn.commit()
+                applied.append(migration)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATE_LOCK,))
+            cursor.fetchone()
+        
+        logger.info("Database schema at version %d", applied[-1].version if applied else version)
+        return applied
+    except mysql.connector.Error as e:
+        logger.error("Database migration error: %s", e)
+        raise
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
\ No newline at end of file
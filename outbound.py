@@ -0,0 +1,231 @@
+# outbound.py - Outbound Message Pipeline
+# Rate-limited, retrying delivery of Graph API calls, ordered per recipient
+
+import time
+import random
+import logging
+import threading
+import requests
+from worker_pool import ShardedDispatcher
+from logging_setup import redact
+from metrics import GRAPH_API_SECONDS, OUTBOUND_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Graph API error codes that mean "slow down" even when the HTTP status is 400
+THROUGHPUT_ERROR_CODES = {4, 80007, 130429}
+PAIR_RATE_ERROR_CODES = {131056}
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, holding at most `burst`"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def try_acquire(self):
+        """Take one token if available. Returns 0, or the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+    
+    def acquire(self):
+        """Take one token, sleeping until one is available. Returns True if the caller was throttled."""
+        throttled = False
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return throttled
+            throttled = True
+            time.sleep(wait)
+    
+    def penalize(self, seconds):
+        """Drain the bucket so every sender backs off, e.g. after a 429"""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket kept in a SharedSlots record, so every process on the host draws from the same tokens
+    and a 429 seen by any of them backs them all off"""
+    
+    # Record: (tokens in millionths, last refill in microseconds of time.monotonic(), one clock host-wide).
+    # An all-zero record, or one from before a reboot, starts full.
+    SCALE = 1000000
+    
+    def __init__(self, rate, burst, slots, index=0):
+        super().__init__(rate, burst)
+        self.slots = slots
+        self.index = index
+    
+    def _refill(self, record):
+        tokens, updated = record
+        now = int(time.monotonic() * 1000000)
+        if not updated or updated > now:
+            return self.burst * self.SCALE, now
+        # rate tokens per second is rate millionths per microsecond
+        return min(self.burst * self.SCALE, tokens + int((now - updated) * self.rate)), now
+    
+    def try_acquire(self):
+        wait = 0
+        
+        def take(record):
+            nonlocal wait
+            tokens, now = self._refill(record)
+            if tokens >= self.SCALE:
+                return tokens - self.SCALE, now
+            wait = (self.SCALE - tokens) / self.SCALE / self.rate
+            return tokens, now
+        
+        self.slots.update(self.index, take)
+        return wait
+    
+    def penalize(self, seconds):
+        def drain(record):
+            tokens, now = self._refill(record)
+            return min(tokens, int(-seconds * self.rate * self.SCALE)), now
+        
+        self.slots.update(self.index, drain)
+
+def response_error_code(response):
+    """Graph API error code from a failed response body, if it has one"""
+    try:
+        return response.json().get('error', {}).get('code')
+    except ValueError:
+        return None
+
+def classify_failure(status_code, error_code):
+    """(rate_limited, retryable) for a failed Graph API response"""
+    # Account-wide throughput limits slow every sender; a per-recipient limit only this one
+    rate_limited = status_code == 429 or error_code in THROUGHPUT_ERROR_CODES
+    retryable = rate_limited or error_code in PAIR_RATE_ERROR_CODES or status_code >= 500
+    return rate_limited, retryable
+
+def retry_delay(attempt, retry_after, backoff_base, backoff_max):
+    """Seconds to wait before retry `attempt`, honouring a Retry-After header when present"""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), backoff_max)
+    # Full jitter keeps retrying workers from synchronising
+    return random.uniform(0, min(backoff_max, backoff_base * (2 ** attempt)))
+
+class OutboundQueue:
+    """Delivers messages through `post(data)` with throttling, retries and per-recipient ordering.
+    `on_sent(recipient, description, response)` is called after each successful send."""
+    
+    def __init__(self, post, bucket, shards, queue_size, enqueue_timeout,
+                 max_retries, backoff_base, backoff_max, on_sent=None):
+        self.post = post
+        self.on_sent = on_sent
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        # Retries block the recipient's shard, so a later message can never overtake an earlier one
+        self.dispatcher = ShardedDispatcher(
+            'outbound',
+            self._deliver_item,
+            shards=shards,
+            queue_size=queue_size,
+            enqueue_timeout=enqueue_timeout,
+            drain_order=2
+        )
+        
+        self._lock = threading.Lock()
+        self._counts = {'sent': 0, 'retried': 0, 'dropped': 0, 'failed': 0, 'throttled': 0}
+    
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+    
+    def submit(self, recipient, data, description):
+        """Queue a message for delivery. Returns False if it was dropped."""
+        if not self.dispatcher.shards:
+            return self.deliver(recipient, data, description) is not None
+        
+        if not self.dispatcher.submit(recipient, (recipient, data, description)):
+            self._count('dropped')
+            OUTBOUND_MESSAGES.labels(description, 'queue_full').inc()
+            logger.error("Outbound queue full, dropped %s to %s", description, redact(recipient))
+            return False
+        return True
+    
+    def _deliver_item(self, item):
+        self.deliver(*item)
+    
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        return retry_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+    
+    def deliver(self, recipient, data, description):
+        """Send one message on the calling thread, retrying 429/5xx with backoff. Returns the response or None."""
+        for attempt in range(self.max_retries + 1):
+            if self.bucket.acquire():
+                self._count('throttled')
+            
+            response = None
+            started = time.perf_counter()
+            try:
+                response = self.post(data)
+                GRAPH_API_SECONDS.labels(description).observe(time.perf_counter() - started)
+                if response.ok:
+                    self._count('sent')
+                    OUTBOUND_MESSAGES.labels(description, 'sent').inc()
+                    logger.debug("Sent %s to %s", description, redact(recipient))
+                    if self.on_sent is not None:
+                        self._notify_sent(recipient, description, response)
+                    return response
+                
+                rate_limited, retryable = classify_failure(response.status_code, response_error_code(response))
+                error = f"HTTP {response.status_code}: {response.text}"
+            except requests.exceptions.RequestException as e:
+                GRAPH_API_SECONDS.labels(description).observe(time.perf_counter() - started)
+                rate_limited = False
+                retryable = True
+                error = str(e)
+            
+            if not retryable:
+                self._count('failed')
+                OUTBOUND_MESSAGES.labels(description, 'failed').inc()
+                logger.error("Failed to send %s to %s: %s", description, redact(recipient), error)
+                return None
+            
+            if attempt == self.max_retries:
+                break
+            
+            delay = self._backoff(attempt, response)
+            self._count('retried')
+            OUTBOUND_MESSAGES.labels(description, 'retried').inc()
+            logger.warning("Retrying %s to %s in %.2fs (%s)", description, redact(recipient), delay, error)
+            if rate_limited:
+                # The next acquire() waits this out, along with every other sender
+                self.bucket.penalize(delay)
+            else:
+                time.sleep(delay)
+        
+        self._count('dropped')
+        OUTBOUND_MESSAGES.labels(description, 'dropped').inc()
+        logger.error("Failed to send %s to %s after %d attempts: %s", description, redact(recipient), self.max_retries + 1, error)
+        return None
+    
+    def _notify_sent(self, recipient, description, response):
+        try:
+            self.on_sent(recipient, description, response)
+        except Exception as e:
+            # Bookkeeping must never turn a delivered message into a retry
+            logger.error("Error in on_sent hook for %s to %s: %s", description, redact(recipient), e)
+    
+    def stats(self):
+        """Delivery counters plus queue depth"""
+        with self._lock:
+            counts = dict(self._counts)
+        dispatcher_stats = self.dispatcher.stats()
+        counts['queued'] = sum(shard['depth'] for shard in dispatcher_stats['per_shard'])
+        return counts
\ No newline at end of file
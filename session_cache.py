@@ -0,0 +1,122 @@
+# session_cache.py - User State Cache
+# Bounded LRU/TTL cache of user_state rows with cross-worker invalidation
+
+import time
+import random
+import threading
+from collections import OrderedDict
+from config import Config
+from shared_state import SharedSlots
+
+# Every worker on the host shares a table of generation tokens. A writer bumps the
+# token for a phone number after committing, and a cached entry is only used while
+# the token still matches the one seen when it was loaded. Workers on other hosts
+# are bounded by the TTL.
+class SessionCache:
+    """In-process LRU/TTL cache of user_state rows"""
+    
+    def __init__(self, max_size, ttl, generations):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generations = generations
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+    
+    def generation(self, phone_number):
+        """Current generation token; read this before loading from the DB"""
+        return self.generations.get(self.generations.index(phone_number))[0]
+    
+    def get(self, phone_number):
+        """Return (True, row) on a hit or (False, None) on a miss. Rows may be None for unknown users."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is None:
+                self._misses += 1
+                return False, None
+            
+            row, token, expires = entry
+            if expires < now:
+                del self._entries[phone_number]
+                self._expirations += 1
+                self._misses += 1
+                return False, None
+            if token != self.generation(phone_number):
+                # Another worker changed this user's state
+                del self._entries[phone_number]
+                self._invalidations += 1
+                self._misses += 1
+                return False, None
+            
+            self._entries.move_to_end(phone_number)
+            self._hits += 1
+            return True, row
+    
+    def put(self, phone_number, row, token):
+        """Cache a row loaded or written under the given generation token"""
+        with self._lock:
+            self._entries[phone_number] = (row, token, time.monotonic() + self.ttl)
+            self._entries.move_to_end(phone_number)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+    
+    def peek(self, phone_number):
+        """(found, row) for a cached entry that get() would still serve, without touching metrics or LRU order"""
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is None:
+                return False, None
+            row, token, expires = entry
+            if expires < time.monotonic() or token != self.generation(phone_number):
+                return False, None
+            return True, row
+    
+    def invalidate(self, phone_number):
+        """Drop the local entry and bump the shared token. Call after the DB write commits."""
+        token = random.getrandbits(63) or 1
+        self.generations.set(self.generations.index(phone_number), token)
+        with self._lock:
+            self._entries.pop(phone_number, None)
+        return token
+    
+    def stats(self):
+        """Hit, miss and eviction counters"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_session_cache(create=True):
+    """Return the process-wide session cache, or None when caching is disabled
+    (or, with create=False, when nothing has used it yet)"""
+    global _cache
+    if Config.SESSION_CACHE_SIZE <= 0:
+        return None
+    if _cache is None and create:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SessionCache(
+                    Config.SESSION_CACHE_SIZE,
+                    Config.SESSION_CACHE_TTL,
+                    SharedSlots('session_generations', Config.SESSION_CACHE_SLOTS)
+                )
+    return _cache
\ No newline at end of file
@@ -1,27 +1,178 @@
 # session_manager.py - User Session Management
 # Manages user conversation state
 
+import time
 import logging
-from database import get_db_connection
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from config import Config
+from database import get_db_connection, record_feedback
+from session_cache import get_session_cache
+from batch_writer import BatchWriter
+from logging_setup import redact
+from metrics import SESSION_DB_SECONDS, timed
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# A missing category keeps whatever category the row already has
+UPSERT_STATE_SQL = """
+    INSERT INTO user_state (phone_number, current_state, selected_category) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE current_state = VALUES(current_state), selected_category = VALUES(selected_category)
+"""
+UPSERT_STATE_KEEP_CATEGORY_SQL = """
+    INSERT INTO user_state (phone_number, current_state, selected_category) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE current_state = VALUES(current_state)
+"""
+
+def _upsert_state_query(phone_number, state, category):
+    sql = UPSERT_STATE_SQL if category is not None else UPSERT_STATE_KEEP_CATEGORY_SQL
+    return sql, (phone_number, state, category)
+
+def insert_feedback_rows(rows):
+    """Insert (phone_number, category, rating, feedback) rows and their rollups in one transaction"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        record_feedback(cursor, rows)
+        conn.commit()
+        logger.debug("Feedback batch saved: %d row(s)", len(rows))
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+_feedback_writer = None
+_feedback_writer_lock = threading.Lock()
+
+def get_feedback_writer(create=True):
+    """Return the buffered feedback writer, or None when FEEDBACK_BATCHING is off
+    (or, with create=False, when this process has not started it yet)"""
+    global _feedback_writer
+    if not Config.FEEDBACK_BATCHING:
+        return None
+    if _feedback_writer is None and create:
+        with _feedback_writer_lock:
+            if _feedback_writer is None:
+                _feedback_writer = BatchWriter(
+                    'feedback',
+                    insert_feedback_rows,
+                    max_batch=Config.FEEDBACK_BATCH_SIZE,
+                    max_delay=Config.FEEDBACK_FLUSH_INTERVAL,
+                    journal_dir=Config.FEEDBACK_JOURNAL_DIR
+                )
+    return _feedback_writer
+
+class UnitOfWork:
+    """Feedback rows and state changes written on one connection and committed together"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.state_changes = []
+        self.changed_elsewhere = []
+        self.buffered_feedback = []
+    
+    def save_feedback(self, phone_number, category, rating, feedback=None):
+        """Queue a feedback row in this transaction"""
+        if get_feedback_writer() is not None:
+            # Journaled and bulk-inserted once the state change commits
+            self.buffered_feedback.append([phone_number, category, rating, feedback])
+            return
+        record_feedback(self.cursor, [(phone_number, category, rating, feedback)])
+    
+    def save_feedback_rows(self, rows):
+        """Queue several (phone_number, category, rating, feedback) rows in this transaction as one batch"""
+        if get_feedback_writer() is not None:
+            self.buffered_feedback.extend(list(row) for row in rows)
+            return
+        record_feedback(self.cursor, rows)
+    
+    def set_user_state(self, phone_number, state, category=None):
+        """Upsert a user's state in this transaction"""
+        self.cursor.execute(*_upsert_state_query(phone_number, state, category))
+        self.state_changes.append((phone_number, state, category))
+    
+    def set_user_states(self, phone_numbers, state):
+        """Upsert many users into the same state in this transaction, keeping their stored categories"""
+        rows = [(phone_number, state, None) for phone_number in phone_numbers]
+        if not rows:
+            return
+        self.cursor.executemany(UPSERT_STATE_KEEP_CATEGORY_SQL, rows)
+        self.state_changes.extend(rows)
+    
+    def states_changed(self, phone_numbers):
+        """Note users whose state the caller's own SQL may have changed; every worker re-reads them after this"""
+        self.changed_elsewhere.extend((phone_number, None, None) for phone_number in phone_numbers)
+
 class SessionManager:
     """Manages user session and conversation state"""
     
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """Yield a UnitOfWork; everything done with it commits once on exit or rolls back on error"""
+        started = time.perf_counter()
+        conn = get_db_connection()
+        work = UnitOfWork(conn)
+        staged = None
+        try:
+            yield work
+            if work.buffered_feedback:
+                # Journaled before the commit, so a crash right after it cannot lose acknowledged feedback
+                staged = get_feedback_writer().stage(work.buffered_feedback)
+            conn.commit()
+        except Exception as e:
+            logger.error("Error in session transaction, rolled back: %s", e)
+            try:
+                conn.rollback()
+            finally:
+                SessionManager._invalidate_states(work.state_changes + work.changed_elsewhere)
+                if staged is not None:
+                    get_feedback_writer().discard(staged)
+            raise
+        finally:
+            work.cursor.close()
+            conn.close()
+            SESSION_DB_SECONDS.labels('transaction').observe(time.perf_counter() - started)
+        
+        if staged is not None:
+            get_feedback_writer().release(staged)
+        
+        SessionManager._invalidate_states(work.changed_elsewhere)
+        
+        for phone_number, state, category in work.state_changes:
+            SessionManager._cache_state(phone_number, state, category)
+            logger.debug("User state updated: %s -> %s (%s)", redact(phone_number), state, category or 'N/A')
+    
     @staticmethod
     def get_user_state(phone_number):
         """Get the current state of a user based on their phone number"""
+        cache = get_session_cache()
+        token = None
+        if cache is not None:
+            hit, row = cache.get(phone_number)
+            if hit:
+                return row
+            # Read the generation before the DB so a concurrent write invalidates what we load
+            token = cache.generation(phone_number)
+        return SessionManager._load_user_state(phone_number, cache, token)
+    
+    @staticmethod
+    @timed(SESSION_DB_SECONDS, 'get_user_state')
+    def _load_user_state(phone_number, cache, token):
+        """Read a user_state row from the DB and cache it under the given generation token"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor(dictionary=True)
             cursor.execute("SELECT * FROM user_state WHERE phone_number = %s", (phone_number,))
             result = cursor.fetchone()
+            if cache is not None:
+                cache.put(phone_number, result, token)
             return result
         except Exception as e:
-            logger.error(f"Error getting user state: {str(e)}")
+            logger.error("Error getting user state: %s", e)
             return None
         finally:
             if 'cursor' in locals():
@@ -30,36 +181,23 @@ class SessionManager:
                 conn.close()
     
     @staticmethod
+    @timed(SESSION_DB_SECONDS, 'set_user_state')
     def set_user_state(phone_number, state, category=None):
         """Set or update the state of a user"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            # Check if user exists
-            cursor.execute("SELECT * FROM user_state WHERE phone_number = %s", (phone_number,))
-            if cursor.fetchone():
-                if category is not None:
-                    cursor.execute(
-                        "UPDATE user_state SET current_state = %s, selected_category = %s WHERE phone_number = %s",
-                        (state, category, phone_number)
-                    )
-                else:
-                    cursor.execute(
-                        "UPDATE user_state SET current_state = %s WHERE phone_number = %s",
-                        (state, phone_number)
-                    )
-            else:
-                cursor.execute(
-                    "INSERT INTO user_state (phone_number, current_state, selected_category) VALUES (%s, %s, %s)",
-                    (phone_number, state, category)
-                )
+            # Insert or update in one round trip
+            cursor.execute(*_upsert_state_query(phone_number, state, category))
             
             conn.commit()
-            logger.info(f"User state updated: {phone_number} -> {state} ({category if category else 'N/A'})")
+            SessionManager._cache_state(phone_number, state, category)
+            logger.debug("User state updated: %s -> %s (%s)", redact(phone_number), state, category or 'N/A')
             return True
         except Exception as e:
-            logger.error(f"Error setting user state: {str(e)}")
+            logger.error("Error setting user state: %s", e)
+            SessionManager._invalidate_states([(phone_number, state, category)])
             return False
         finally:
             if 'cursor' in locals():
@@ -68,22 +206,58 @@ class SessionManager:
                 conn.close()
     
     @staticmethod
+    def _invalidate_states(state_changes):
+        """A failed write may or may not have landed; make every worker re-read these users"""
+        cache = get_session_cache()
+        if cache is not None:
+            for phone_number, _, _ in state_changes:
+                cache.invalidate(phone_number)
+    
+    @staticmethod
+    def _cache_state(phone_number, state, category):
+        """Write-through: bump the shared generation and cache the row we just committed"""
+        cache = get_session_cache()
+        if cache is None:
+            return
+        known, previous = cache.peek(phone_number)
+        token = cache.invalidate(phone_number)
+        if category is None and previous:
+            # An update without a category keeps the stored one
+            category = previous['selected_category']
+        elif category is None and not known:
+            # We don't know what category the DB row kept, so let the next read load it
+            return
+        cache.put(phone_number, {
+            'phone_number': phone_number,
+            'current_state': state,
+            'selected_category': category,
+            'last_updated': datetime.now()
+        }, token)
+    
+    @staticmethod
+    @timed(SESSION_DB_SECONDS, 'save_feedback')
     def save_feedback(phone_number, category, rating, feedback=None):
         """Save user feedback to the database"""
+        writer = get_feedback_writer()
+        if writer is not None:
+            try:
+                writer.add([phone_number, category, rating, feedback])
+                return True
+            except Exception as e:
+                logger.error("Error journaling feedback: %s", e)
+                return False
+        
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            cursor.execute(
-                "INSERT INTO user_responses (phone_number, category, rating, feedback) VALUES (%s, %s, %s, %s)",
-                (phone_number, category, rating, feedback)
-            )
+            record_feedback(cursor, [(phone_number, category, rating, feedback)])
             
             conn.commit()
-            logger.info(f"Feedback saved: {phone_number} -> {category} ({rating} stars)")
+            logger.debug("Feedback saved: %s -> %s (%s stars)", redact(phone_number), category, rating)
             return True
         except Exception as e:
-            logger.error(f"Error saving feedback: {str(e)}")
+            logger.error("Error saving feedback: %s", e)
             return False
         finally:
             if 'cursor' in locals():
@@ -92,6 +266,7 @@ class SessionManager:
                 conn.close()
     
     @staticmethod
+    @timed(SESSION_DB_SECONDS, 'get_user_stats')
     def get_user_stats(phone_number):
         """Get statistics about user feedback submissions"""
         try:
@@ -110,7 +285,7 @@ class SessionManager:
             result = cursor.fetchone()
             return result
         except Exception as e:
-            logger.error(f"Error getting user stats: {str(e)}")
+            logger.error("Error getting user stats: %s", e)
             return None
         finally:
             if 'cursor' in locals():
@@ -0,0 +1,61 @@
+# shared_state.py - Cross-Process Shared Slots
+# Fixed-size table of integers in an mmap'd file, shared by every worker on the host
+
+import os
+import zlib
+import mmap
+import fcntl
+import struct
+import threading
+from config import Config
+
+class SharedSlots:
+    """A table of `slots` records of `fields` signed 64-bit integers, backed by a shared file"""
+    
+    def __init__(self, name, slots, fields=1, directory=None):
+        self.slots = slots
+        self.fields = fields
+        self._record = struct.Struct(f'<{fields}q')
+        self._lock = threading.Lock()
+        
+        directory = directory or Config.SHARED_STATE_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.slots")
+        
+        size = slots * self._record.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Only grow the file; a concurrent worker may already have sized it
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    
+    def index(self, key):
+        """Slot index for a key. Keys may collide; callers must tolerate sharing a slot."""
+        return hash_key(key) % self.slots
+    
+    def get(self, index):
+        return self._record.unpack_from(self._map, index * self._record.size)
+    
+    def set(self, index, *values):
+        self._record.pack_into(self._map, index * self._record.size, *values)
+    
+    def records(self):
+        """Iterate over every record (unlocked snapshot reads, for reporting)"""
+        return self._record.iter_unpack(self._map)
+    
+    def update(self, index, func):
+        """Atomically replace a record with func(record) across threads and processes"""
+        offset = index * self._record.size
+        with self._lock:
+            # Lock just this record's byte range so other slots stay uncontended
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._record.size, offset)
+            try:
+                values = func(self._record.unpack_from(self._map, offset))
+                self._record.pack_into(self._map, offset, *values)
+                return values
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._record.size, offset)
+
+def hash_key(key):
+    """Stable 32-bit hash, identical in every process (unlike hash())"""
+    return zlib.crc32(str(key).encode('utf-8'))
\ No newline at end of file
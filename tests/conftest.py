@@ -0,0 +1,7 @@
+# conftest.py - Test Setup
+# Makes the application modules importable from the tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
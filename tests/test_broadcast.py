@@ -0,0 +1,125 @@
+# test_broadcast.py - Broadcast Interruption Tests
+# A Ctrl-C at each hand-off must release every claimed recipient once and never send one twice
+
+import os
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import nullcontext
+from unittest import mock
+from config import Config
+import broadcast
+from broadcast import Broadcast, QUEUED, SENT, RELEASED
+
+class FakeResponse:
+    def json(self):
+        return {'messages': [{'id': 'wamid.1'}]}
+
+class FakeOutbound:
+    def deliver(self, recipient, data, description):
+        return FakeResponse()
+
+class InterruptTest(unittest.TestCase):
+    """Runs a Broadcast against in-memory claims, interrupting it at a chosen point"""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'recipients.csv')
+        self.phones = [f"9190000000{i:02d}" for i in range(6)]
+        with open(self.path, 'w') as f:
+            f.write('phone,name\n' + ''.join(f"{phone},Visitor\n" for phone in self.phones))
+        
+        self.status = {}
+        self.writes = Counter()
+        
+        def write_results(rows):
+            for _, phone_number, status, _ in rows:
+                self.status[phone_number] = status
+                self.writes[phone_number] += 1
+        
+        patches = [
+            mock.patch.object(Config, 'BROADCAST_JOURNAL_DIR', os.path.join(self.tmp.name, 'journal')),
+            mock.patch.object(Config, 'SHARED_STATE_DIR', os.path.join(self.tmp.name, 'shared')),
+            mock.patch.object(Config, 'BROADCAST_RATE', 10000.0),
+            mock.patch.object(broadcast, 'write_results', write_results),
+            mock.patch.object(broadcast, 'get_outbound', FakeOutbound),
+            mock.patch.object(broadcast, 'campaign_lock', lambda campaign: nullcontext()),
+            mock.patch.object(broadcast, 'open_campaign', lambda campaign, source, message_type: (source, message_type, 0)),
+            mock.patch.object(broadcast, 'reclaim_recipients', self.reclaim),
+            mock.patch.object(broadcast, 'campaign_summary', lambda campaign: dict(Counter(self.status.values()))),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.tmp.cleanup)
+    
+    def reclaim(self, campaign, statuses, state, on_claimed=None):
+        on_claimed([])
+        return []
+    
+    def claim(self, campaign, phone_numbers, state, file_offset, on_claimed=None):
+        fresh = [phone_number for phone_number in phone_numbers if phone_number not in self.status]
+        for phone_number in fresh:
+            self.status[phone_number] = QUEUED
+        on_claimed(fresh)
+        return fresh
+    
+    def run_broadcast(self, claim=None, submit=None):
+        run = Broadcast('spring', self.path, template='survey_invite', chunk_size=3)
+        if submit is not None:
+            real_submit = run.pool.submit
+            run.pool.submit = lambda item: submit(real_submit, item)
+        with mock.patch.object(broadcast, 'claim_recipients', claim or self.claim):
+            run.run()
+        return run
+    
+    def test_uninterrupted_run_sends_everyone_once(self):
+        run = self.run_broadcast()
+        self.assertFalse(run.interrupted)
+        self.assertEqual(self.status, {phone_number: SENT for phone_number in self.phones})
+        self.assertEqual(set(self.writes.values()), {1})
+    
+    def test_interrupt_after_claim_commits_releases_the_chunk(self):
+        def claim_then_interrupt(*args, **kwargs):
+            self.claim(*args, **kwargs)
+            # The claim has committed; the interrupt lands before run() sees the return value
+            raise KeyboardInterrupt
+        
+        run = self.run_broadcast(claim=claim_then_interrupt)
+        self.assertTrue(run.interrupted)
+        self.assertEqual(self.status, {phone_number: RELEASED for phone_number in self.phones[:3]})
+        self.assertEqual(set(self.writes.values()), {1})
+    
+    def test_interrupt_after_hand_off_does_not_release_a_queued_item(self):
+        calls = []
+        
+        def submit_then_interrupt(real_submit, item):
+            accepted = real_submit(item)
+            calls.append(item)
+            if len(calls) == 2:
+                # The pool has taken the item; the interrupt lands before the loop moves on
+                raise KeyboardInterrupt
+            return accepted
+        
+        run = self.run_broadcast(submit=submit_then_interrupt)
+        self.assertTrue(run.interrupted)
+        self.assertEqual(set(self.status), set(self.phones[:3]))
+        self.assertEqual(set(self.writes.values()), {1})
+        self.assertEqual(self.status[self.phones[2]], RELEASED)
+    
+    def test_interrupt_before_hand_off_leaves_the_item_unknown(self):
+        def interrupt_second(real_submit, item):
+            if item[0] == self.phones[1]:
+                raise KeyboardInterrupt
+            return real_submit(item)
+        
+        run = self.run_broadcast(submit=interrupt_second)
+        self.assertTrue(run.interrupted)
+        # Neither sent nor released, so it is never sent twice; --resend-unknown picks it up
+        self.assertEqual(self.status[self.phones[1]], QUEUED)
+        self.assertEqual(self.writes[self.phones[1]], 0)
+        self.assertEqual(self.status[self.phones[2]], RELEASED)
+        self.assertEqual(set(self.writes.values()), {1})
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,85 @@
+# test_survey_stats.py - Survey Rollup Tests
+# Feedback without a category stays out of the rollups, in the live path and in rebuild-stats alike
+
+import sqlite3
+import unittest
+from unittest import mock
+import database
+from database import feedback_rollups, rebuild_survey_stats
+
+SCHEMA = """
+    CREATE TABLE user_responses (id INTEGER PRIMARY KEY, phone_number TEXT, category TEXT, rating INT, feedback TEXT);
+    CREATE TABLE category_stats (category TEXT NOT NULL PRIMARY KEY, response_count INT NOT NULL, rating_sum INT NOT NULL);
+    CREATE TABLE survey_respondents (phone_number TEXT NOT NULL PRIMARY KEY);
+    CREATE TABLE survey_counters (name TEXT NOT NULL PRIMARY KEY, value INT NOT NULL);
+"""
+
+class SQLiteCursor:
+    """Just enough of a mysql.connector cursor over SQLite for rebuild_survey_stats"""
+    
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+    
+    def execute(self, sql, params=()):
+        if sql.split()[0] in ('LOCK', 'UNLOCK'):
+            return
+        self.cursor.execute(sql.replace('%s', '?'), params)
+    
+    def fetchone(self):
+        return self.cursor.fetchone()
+    
+    def fetchall(self):
+        return self.cursor.fetchall()
+    
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnection:
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def cursor(self):
+        return SQLiteCursor(self.conn)
+    
+    def commit(self):
+        self.conn.commit()
+    
+    def close(self):
+        pass
+
+class NullCategoryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript(SCHEMA)
+        self.db.executemany(
+            "INSERT INTO user_responses (phone_number, category, rating) VALUES (?, ?, ?)",
+            [('911', 'QLINE', 5), ('912', 'QLINE', 3), ('913', None, 4)]
+        )
+        # The rollups as the live path maintains them
+        self.db.execute("INSERT INTO category_stats VALUES ('QLINE', 2, 8)")
+        self.db.executemany("INSERT INTO survey_respondents VALUES (?)", [('911',), ('912',), ('913',)])
+        self.db.execute("INSERT INTO survey_counters VALUES ('unique_users', 3)")
+        self.db.commit()
+        patch = mock.patch.object(database, 'get_db_connection', lambda: SQLiteConnection(self.db))
+        patch.start()
+        self.addCleanup(patch.stop)
+    
+    def test_live_rollups_skip_rows_without_a_category(self):
+        category_totals, phones = feedback_rollups([('911', 'QLINE', 5, None), ('913', None, 4, None)])
+        self.assertEqual(category_totals, [('QLINE', 1, 5)])
+        self.assertEqual(phones, ['911', '913'])
+    
+    def test_check_reports_no_drift_for_a_null_category(self):
+        self.assertEqual(rebuild_survey_stats(check_only=True), [])
+    
+    def test_rebuild_leaves_the_null_category_out(self):
+        self.db.execute("DELETE FROM category_stats")
+        self.db.commit()
+        self.assertEqual(len(rebuild_survey_stats()), 1)
+        self.assertEqual(self.db.execute("SELECT * FROM category_stats").fetchall(), [('QLINE', 2, 8)])
+        self.assertEqual(rebuild_survey_stats(check_only=True), [])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+# throttle.py - Per-Sender Throttling
+# Sliding-window rate limit and tap debounce per wa_id, in a table shared by every worker on the host
+
+import time
+import logging
+import threading
+from collections import Counter
+from config import Config
+from shared_state import SharedSlots, hash_key
+from logging_setup import redact
+from metrics import THROTTLE_VERDICTS
+
+logger = logging.getLogger(__name__)
+
+# Verdicts for one inbound message
+ALLOWED = 'allowed'
+DEBOUNCED = 'debounced'    # same button/list reply again within the debounce window; dropped silently
+NOTICE = 'notice'          # first message over the limit; dropped, and the sender is told once
+THROTTLED = 'throttled'    # further messages over the limit; dropped silently
+
+# Record fields, one 64-byte record per slot:
+#   owner        - wa_id as an integer (a slot taken over by another sender starts afresh)
+#   window_start - start of the current fixed window, ms
+#   current      - messages counted in the current window
+#   previous     - messages counted in the window before it
+#   reply_sig    - signature of the last interactive reply
+#   reply_at     - when it was last seen, ms
+#   noticed      - 1 once the sender has been told they are throttled, until they are allowed again
+#   throttled    - messages throttled since the slot was taken
+FIELDS = 8
+
+# Number that can never be a wa_id, for senders whose id is not numeric
+_HASHED = 1 << 62
+
+NOTICE_TEXT = "You're sending messages too quickly. Please wait a minute and then continue the survey."
+
+def _owner(wa_id):
+    if wa_id.isdigit() and len(wa_id) <= 18:
+        return int(wa_id)
+    return _HASHED | hash_key(wa_id)
+
+def _reply_signature(message):
+    if message.reply_type is None:
+        return 0
+    return hash_key(f"{message.reply_type}:{message.reply_id}") or 1
+
+class SenderThrottle:
+    """Per-wa_id limits. The window is sliding, estimated from the current and previous fixed windows:
+    count = previous * (unexpired share of the previous window) + current."""
+    
+    def __init__(self, slots, limit, window, debounce):
+        self.slots = slots
+        self.limit = limit
+        self.window_ms = int(window * 1000)
+        self.debounce_ms = int(debounce * 1000)
+        self._lock = threading.Lock()
+        self._counts = Counter()
+    
+    def check(self, message, now=None):
+        """Verdict for an InboundMessage; counts it against its sender"""
+        now_ms = int((time.time() if now is None else now) * 1000)
+        owner = _owner(message.wa_id)
+        signature = _reply_signature(message)
+        verdict = ALLOWED
+        
+        def apply(record):
+            nonlocal verdict
+            if record[0] != owner:
+                record = (owner, now_ms, 0, 0, 0, 0, 0, 0)
+            _, start, current, previous, reply_sig, reply_at, noticed, throttled = record
+            
+            # Roll the fixed windows forward
+            elapsed = now_ms - start
+            if elapsed >= self.window_ms:
+                previous = current if elapsed < 2 * self.window_ms else 0
+                current = 0
+                start = now_ms - elapsed % self.window_ms
+                elapsed = now_ms - start
+            
+            if signature and signature == reply_sig and now_ms - reply_at < self.debounce_ms:
+                # Repeated taps extend the window, so a stuck client stays debounced
+                verdict = DEBOUNCED
+                return owner, start, current, previous, reply_sig, now_ms, noticed, throttled
+            
+            estimate = previous * (self.window_ms - elapsed) / self.window_ms + current
+            if estimate >= self.limit:
+                verdict = THROTTLED if noticed else NOTICE
+                noticed = 1
+                throttled += 1
+            else:
+                noticed = 0
+            # Throttled messages count too, so a sender looping on us stays limited until they stop
+            current += 1
+            if signature:
+                reply_sig, reply_at = signature, now_ms
+            return owner, start, current, previous, reply_sig, reply_at, noticed, throttled
+        
+        self.slots.update(self.slots.index(message.wa_id), apply)
+        with self._lock:
+            self._counts[verdict] += 1
+        THROTTLE_VERDICTS.labels(verdict).inc()
+        return verdict
+    
+    def top_offenders(self, count=10):
+        """Senders with the most throttled messages, across every worker on this host"""
+        offenders = [(record[7], record[0]) for record in self.slots.records() if record[7] > 0]
+        offenders.sort(reverse=True)
+        return [
+            {"sender": str(redact(str(owner))) if not owner & _HASHED else f"#{owner & 0xFFFFFFFF:08x}",
+             "throttled": throttled}
+            for throttled, owner in offenders[:count]
+        ]
+    
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "limit": self.limit,
+            "window": self.window_ms / 1000,
+            "verdicts": {verdict: counts.get(verdict, 0) for verdict in (ALLOWED, DEBOUNCED, NOTICE, THROTTLED)},
+            "top_offenders": self.top_offenders(5)
+        }
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+def get_throttle(create=True):
+    """Return the process-wide sender throttle, or None when throttling is disabled
+    (or, with create=False, when nothing has used it yet)"""
+    global _throttle
+    if not Config.THROTTLE_ENABLED:
+        return None
+    if _throttle is None and create:
+        with _throttle_lock:
+            if _throttle is None:
+                _throttle = SenderThrottle(
+                    SharedSlots('throttle', Config.THROTTLE_SLOTS, fields=FIELDS),
+                    Config.THROTTLE_LIMIT,
+                    Config.THROTTLE_WINDOW,
+                    Config.THROTTLE_DEBOUNCE
+                )
+    return _throttle
+
+def admit(message):
+    """Throttle verdict for an inbound message; ALLOWED when throttling is disabled"""
+    throttle = get_throttle()
+    if throttle is None:
+        return ALLOWED
+    verdict = throttle.check(message)
+    if verdict == NOTICE:
+        logger.warning("Throttling %s: over %d messages in %ds", redact(message.wa_id),
+                       throttle.limit, throttle.window_ms // 1000)
+    elif verdict != ALLOWED:
+        logger.debug("Dropped %s message %s from %s", verdict, message.id, redact(message.wa_id))
+    return verdict
\ No newline at end of file
@@ -2,21 +2,62 @@
 # Handles webhook verification and incoming requests
 
 import os
-import json
+import time
 import logging
 import hmac
 import hashlib
 from flask import Blueprint, request, Response
 from config import Config
 from message_handler import process_webhook
+from worker_pool import WorkerPool
+from metrics import SIGNATURE_SECONDS, WEBHOOK_REQUESTS
+from logging_setup import should_log_payload, redact_payload
+from webhook_parser import classify, KIND_MESSAGES, KIND_STATUSES
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Create blueprint
 webhook_bp = Blueprint('webhook', __name__)
 
+# Webhooks are acknowledged immediately and parsed in the background on a single thread: with
+# several, two payloads from one sender could reach its shard in the opposite order
+if Config.WEBHOOK_WORKERS > 1:
+    logger.warning("WEBHOOK_WORKERS=%d ignored; webhooks are parsed on one thread to keep each sender's order",
+                   Config.WEBHOOK_WORKERS)
+webhook_workers = WorkerPool(
+    'webhook',
+    process_webhook,
+    workers=min(Config.WEBHOOK_WORKERS, 1),
+    queue_size=Config.WEBHOOK_QUEUE_SIZE,
+    enqueue_timeout=Config.WEBHOOK_ENQUEUE_TIMEOUT,
+    drain_timeout=Config.WEBHOOK_DRAIN_TIMEOUT
+)
+
+def signature_valid(raw, signature):
+    """Check an X-Hub-Signature-256 header against the raw body; requests without one are let through"""
+    if not signature:
+        return True
+    started = time.perf_counter()
+    
+    # Extract signature
+    signature = signature.replace('sha256=', '')
+    
+    # Calculate expected signature
+    expected_signature = hmac.new(
+        Config.APP_SECRET.encode('utf-8'),
+        raw,
+        hashlib.sha256
+    ).hexdigest()
+    
+    # Compare signatures
+    valid = hmac.compare_digest(signature, expected_signature)
+    SIGNATURE_SECONDS.observe(time.perf_counter() - started)
+    return valid
+
+def wants_payload(kind):
+    """Status callbacks (sent/delivered/read) are only queued when delivery tracking wants them"""
+    return kind == KIND_MESSAGES or (kind == KIND_STATUSES and Config.STATUS_TRACKING)
+
 @webhook_bp.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     # Handle verification request from WhatsApp
@@ -35,32 +76,35 @@ def webhook():
     
     # Handle incoming messages
     if request.method == 'POST':
-        # Verify request signature using app secret
-        signature = request.headers.get('X-Hub-Signature-256', '')
+        # Enforce the size limit before reading or parsing anything
+        if request.content_length is not None and request.content_length > Config.MAX_WEBHOOK_BYTES:
+            logger.warning("Webhook body too large: %d bytes", request.content_length)
+            WEBHOOK_REQUESTS.labels('too_large').inc()
+            return Response(status=413)
+        raw = request.get_data(cache=False)
+        if len(raw) > Config.MAX_WEBHOOK_BYTES:
+            logger.warning("Webhook body too large: %d bytes", len(raw))
+            WEBHOOK_REQUESTS.labels('too_large').inc()
+            return Response(status=413)
         
-        if signature:
-            # Extract signature
-            signature = signature.replace('sha256=', '')
-            
-            # Calculate expected signature
-            expected_signature = hmac.new(
-                Config.APP_SECRET.encode('utf-8'),
-                request.data,
-                hashlib.sha256
-            ).hexdigest()
-            
-            # Compare signatures
-            if not hmac.compare_digest(signature, expected_signature):
-                logger.warning("Invalid signature")
-                return Response(status=403)
+        # Verify request signature using app secret
+        if not signature_valid(raw, request.headers.get('X-Hub-Signature-256', '')):
+            logger.warning("Invalid signature")
+            WEBHOOK_REQUESTS.labels('invalid_signature').inc()
+            return Response(status=403)
         
-        # Process the webhook payload
-        data = request.json
-        logger.info(f"Received webhook: {json.dumps(data)}")
+        kind = classify(raw)
+        logger.debug("Received %s webhook (%d bytes)", kind, len(raw))
+        if should_log_payload(logger):
+            logger.debug("Webhook payload: %s", redact_payload(raw))
+        if not wants_payload(kind):
+            WEBHOOK_REQUESTS.labels('ignored').inc()
+            return Response(status=200)
         
-        try:
-            process_webhook(data)
-        except Exception as e:
-            logger.error(f"Error processing webhook: {str(e)}")
+        # Hand the raw body to the worker pool, which parses it once; a full queue asks Meta to retry later
+        if not webhook_workers.submit(raw):
+            WEBHOOK_REQUESTS.labels('queue_full').inc()
+            return Response(status=503, headers={'Retry-After': '5'})
         
+        WEBHOOK_REQUESTS.labels('accepted').inc()
         return Response(status=200)
\ No newline at end of file
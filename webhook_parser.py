@@ -0,0 +1,106 @@
+# webhook_parser.py - Webhook Payload Parsing
+# Single-pass parsing of raw webhook bytes into lightweight message records
+
+import json
+from collections import namedtuple
+
+try:
+    # Optional fast decoder; falls back to the standard library
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Payload kinds, decided from the raw bytes without decoding them
+KIND_MESSAGES = 'messages'
+KIND_STATUSES = 'statuses'
+KIND_OTHER = 'other'
+
+# An inbound user message, flattened to the fields handle_message needs
+InboundMessage = namedtuple('InboundMessage', [
+    'id',           # WhatsApp message id (wamid...)
+    'wa_id',        # sender
+    'type',         # text, interactive, image, ...
+    'timestamp',    # unix seconds as sent by WhatsApp
+    'text',         # text body, or None
+    'reply_type',   # button_reply / list_reply for interactive replies, else None
+    'reply_id',     # id of the tapped button or list row
+    'reply_title'   # title of the tapped button or list row
+])
+
+# A delivery status callback for a message we sent
+StatusEvent = namedtuple('StatusEvent', [
+    'message_id',   # id returned when we sent the message
+    'recipient',    # recipient wa_id
+    'status',       # sent, delivered, read or failed
+    'timestamp',    # unix seconds as sent by WhatsApp
+    'error_code'    # first error code for failed messages, else None
+])
+
+def classify(raw):
+    """Cheaply tell message payloads from status callbacks by scanning the raw bytes"""
+    if b'"messages"' in raw:
+        return KIND_MESSAGES
+    if b'"statuses"' in raw:
+        return KIND_STATUSES
+    return KIND_OTHER
+
+def loads(raw):
+    """Decode a JSON body with the fastest available decoder"""
+    return _loads(raw)
+
+def _to_record(message, default_wa_id):
+    text = None
+    reply_type = reply_id = reply_title = None
+    
+    if 'text' in message:
+        text = message['text'].get('body', '')
+    if 'interactive' in message:
+        interactive = message['interactive']
+        reply_type = interactive.get('type')
+        reply = interactive.get(reply_type) or {}
+        reply_id = reply.get('id')
+        reply_title = reply.get('title')
+    
+    return InboundMessage(
+        id=message.get('id'),
+        wa_id=message.get('from') or default_wa_id,
+        type=message.get('type'),
+        timestamp=message.get('timestamp'),
+        text=text,
+        reply_type=reply_type,
+        reply_id=reply_id,
+        reply_title=reply_title
+    )
+
+def _to_status(status):
+    errors = status.get('errors') or [{}]
+    return StatusEvent(
+        message_id=status.get('id'),
+        recipient=status.get('recipient_id'),
+        status=status.get('status'),
+        timestamp=status.get('timestamp'),
+        error_code=errors[0].get('code')
+    )
+
+def parse_payload(payload):
+    """Return (messages, statuses) records from a webhook payload (raw bytes or an already-decoded dict)"""
+    data = loads(payload) if isinstance(payload, (bytes, bytearray, str)) else payload
+    if not isinstance(data, dict) or data.get('object') != 'whatsapp_business_account':
+        return [], []
+    
+    records = []
+    statuses = []
+    for entry in data.get('entry') or ():
+        for change in entry.get('changes') or ():
+            value = change.get('value') or {}
+            for status in value.get('statuses') or ():
+                statuses.append(_to_status(status))
+            messages = value.get('messages')
+            if not messages:
+                continue
+            contacts = value.get('contacts') or [{}]
+            default_wa_id = contacts[0].get('wa_id')
+            for message in messages:
+                records.append(_to_record(message, default_wa_id))
+    return records, statuses
\ No newline at end of file
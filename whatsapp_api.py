@@ -1,48 +1,117 @@
 # whatsapp_api.py - WhatsApp API Functions
 # Handles communication with the WhatsApp Cloud API
 
+import os
+import hmac
+import hashlib
 import logging
+import secrets
+import time
+import threading
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
 from config import Config
+from outbound import SharedTokenBucket, OutboundQueue
+from shared_state import SharedSlots
+from message_templates import PayloadTemplate, Slot
+from delivery_tracking import record_sent
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def send_text_message(phone_number, message):
-    """Send a simple text message via WhatsApp API"""
-    url = f"https://graph.facebook.com/v18.0/{Config.PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
+class WhatsAppClient:
+    """Keep-alive HTTP client for the WhatsApp Cloud API messages endpoint"""
     
-    data = {
+    def __init__(self, phone_number_id, access_token, pool_size, connect_timeout, read_timeout):
+        self.url = f"{Config.GRAPH_API_URL}/{Config.GRAPH_API_VERSION}/{phone_number_id}/messages"
+        self.timeout = (connect_timeout, read_timeout)
+        
+        # One connection pool sized for our worker concurrency; block rather than open extras
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        })
+    
+    def post(self, data):
+        """POST a message payload (dict, or pre-serialized JSON bytes) and return the raw response"""
+        if isinstance(data, bytes):
+            return self.session.post(self.url, data=data, timeout=self.timeout)
+        return self.session.post(self.url, json=data, timeout=self.timeout)
+    
+    def close(self):
+        self.session.close()
+
+# One client and outbound queue per process; sessions and threads are not shared across a fork
+_client = None
+_outbound = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Throughput limits apply per business phone number, so each phone number id has one bucket that
+# every process on the host (gunicorn workers, the async app, manage.py broadcast) draws from
+_buckets = {}
+
+def get_bucket(phone_number_id):
+    """Return this process's handle on the host-wide token bucket for a business phone number"""
+    key = (os.getpid(), phone_number_id)
+    if key not in _buckets:
+        slots = SharedSlots(f"graph_api_{phone_number_id}", 1, fields=2)
+        _buckets[key] = SharedTokenBucket(Config.GRAPH_API_RATE, Config.GRAPH_API_BURST, slots)
+    return _buckets[key]
+
+def _init_client():
+    global _client, _outbound, _client_pid
+    with _client_lock:
+        if _client_pid == os.getpid():
+            return
+        _client = WhatsAppClient(
+            Config.PHONE_NUMBER_ID,
+            Config.ACCESS_TOKEN,
+            pool_size=Config.GRAPH_API_POOL_SIZE,
+            connect_timeout=Config.GRAPH_API_CONNECT_TIMEOUT,
+            read_timeout=Config.GRAPH_API_READ_TIMEOUT
+        )
+        _outbound = OutboundQueue(
+            _client.post,
+            get_bucket(Config.PHONE_NUMBER_ID),
+            shards=Config.OUTBOUND_SHARDS,
+            queue_size=Config.OUTBOUND_QUEUE_SIZE,
+            enqueue_timeout=Config.OUTBOUND_ENQUEUE_TIMEOUT,
+            max_retries=Config.OUTBOUND_MAX_RETRIES,
+            backoff_base=Config.OUTBOUND_BACKOFF_BASE,
+            backoff_max=Config.OUTBOUND_BACKOFF_MAX,
+            on_sent=record_sent if Config.STATUS_TRACKING else None
+        )
+        _client_pid = os.getpid()
+
+def get_outbound():
+    """Return the outbound send queue for the current process"""
+    if _client_pid != os.getpid():
+        _init_client()
+    return _outbound
+
+def get_outbound_stats():
+    """Counts of sent, retried, dropped, failed and throttled messages in this process,
+    or None if it has not sent anything yet"""
+    if _client_pid != os.getpid():
+        return None
+    return _outbound.stats()
+
+def build_text_payload(phone_number, message):
+    """Build a simple text message payload"""
+    return {
         "messaging_product": "whatsapp",
         "to": phone_number,
         "type": "text",
         "text": {"body": message}
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        logger.info(f"Message sent to {phone_number}")
-        return response
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send message: {str(e)}")
-        if response := getattr(e, 'response', None):
-            logger.error(f"Response: {response.text}")
-        return None
 
-def send_interactive_buttons(phone_number, header_text, body_text, buttons):
-    """Send a message with interactive buttons"""
-    url = f"https://graph.facebook.com/v18.0/{Config.PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
+def build_buttons_payload(phone_number, header_text, body_text, buttons):
+    """Build a message payload with interactive buttons"""
     # Prepare buttons in the required format
     button_items = []
     for idx, button in enumerate(buttons, start=1):
@@ -54,7 +123,7 @@ def send_interactive_buttons(phone_number, header_text, body_text, buttons):
             }
         })
     
-    data = {
+    return {
         "messaging_product": "whatsapp",
         "to": phone_number,
         "type": "interactive",
@@ -72,26 +141,29 @@ def send_interactive_buttons(phone_number, header_text, body_text, buttons):
             }
         }
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        logger.info(f"Interactive message sent to {phone_number}")
-        return response
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send interactive message: {str(e)}")
-        if response := getattr(e, 'response', None):
-            logger.error(f"Response: {response.text}")
-        return None
 
-def send_rating_buttons(phone_number):
-    """Send rating buttons (1-5 stars)"""
-    url = f"https://graph.facebook.com/v18.0/{Config.PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.ACCESS_TOKEN}",
-        "Content-Type": "application/json"
+def build_template_payload(phone_number, template_name, language_code):
+    """Build an approved template message payload, the only kind we may send outside the 24-hour window"""
+    return {
+        "messaging_product": "whatsapp",
+        "to": phone_number,
+        "type": "template",
+        "template": {
+            "name": template_name,
+            "language": {"code": language_code}
+        }
     }
-    
+
+# Static body texts; a preceding text reply can be merged in front of them (see with_intro)
+RATING_BODY = "Please select a rating from 1 to 5 stars:"
+CATEGORY_LIST_BODY = "Please select a category to provide your feedback:"
+SURVEY_FLOW_BODY = "Tap below to rate every category in one go."
+
+# Cloud API limit on the body text of an interactive message, in characters
+INTERACTIVE_BODY_MAX = 1024
+
+def build_rating_payload(phone_number, body_text=RATING_BODY):
+    """Build the rating buttons (1-5 stars) payload"""
     # Prepare rating buttons
     buttons = []
     for rating in range(1, 6):
@@ -104,7 +176,7 @@ def send_rating_buttons(phone_number):
             }
         })
     
-    data = {
+    return {
         "messaging_product": "whatsapp",
         "to": phone_number,
         "type": "interactive",
@@ -115,33 +187,16 @@ def send_rating_buttons(phone_number):
                 "text": "Rate Your Experience"
             },
             "body": {
-                "text": "Please select a rating from 1 to 5 stars:"
+                "text": body_text
             },
             "action": {
                 "buttons": buttons
             }
         }
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        logger.info(f"Rating buttons sent to {phone_number}")
-        return response
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send rating buttons: {str(e)}")
-        if response := getattr(e, 'response', None):
-            logger.error(f"Response: {response.text}")
-        return None
 
-def send_category_list(phone_number):
-    """Send a list of categories for selection"""
-    url = f"https://graph.facebook.com/v18.0/{Config.PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {Config.ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
+def build_category_list_payload(phone_number, body_text=CATEGORY_LIST_BODY):
+    """Build the category selection list payload"""
     # Prepare rows for each category
     category_rows = []
     for category in Config.CATEGORIES:
@@ -150,7 +205,7 @@ def send_category_list(phone_number):
             "title": category
         })
     
-    data = {
+    return {
         "messaging_product": "whatsapp",
         "to": phone_number,
         "type": "interactive",
@@ -161,7 +216,7 @@ def send_category_list(phone_number):
                 "text": "TTD Feedback Survey"
             },
             "body": {
-                "text": "Please select a category to provide your feedback:"
+                "text": body_text
             },
             "footer": {
                 "text": "Thank you for your valuable feedback"
@@ -177,14 +232,147 @@ def send_category_list(phone_number):
             }
         }
     }
-    
+
+def build_flow_payload(phone_number, body_text, flow_token):
+    """Build a message that opens the survey Flow, which starts with a data exchange"""
+    return {
+        "messaging_product": "whatsapp",
+        "to": phone_number,
+        "type": "interactive",
+        "interactive": {
+            "type": "flow",
+            "header": {
+                "type": "text",
+                "text": "TTD Feedback Survey"
+            },
+            "body": {
+                "text": body_text
+            },
+            "footer": {
+                "text": "Thank you for your valuable feedback"
+            },
+            "action": {
+                "name": "flow",
+                "parameters": {
+                    "flow_message_version": "3",
+                    "flow_id": Config.SURVEY_FLOW_ID,
+                    "flow_token": flow_token,
+                    "flow_cta": "Start Survey",
+                    "flow_action": "data_exchange"
+                }
+            }
+        }
+    }
+
+# Payloads are built and serialized once at import; only the recipient and dynamic text vary per send
+TEXT_TEMPLATE = PayloadTemplate(build_text_payload(Slot('to'), Slot('body')))
+RATING_TEMPLATE = PayloadTemplate(build_rating_payload(Slot('to'), Slot('body')))
+CATEGORY_LIST_TEMPLATE = PayloadTemplate(build_category_list_payload(Slot('to'), Slot('body')))
+FLOW_TEMPLATE = PayloadTemplate(build_flow_payload(Slot('to'), Slot('body'), Slot('flow_token')))
+
+@lru_cache(maxsize=64)
+def _buttons_template(header_text, buttons):
+    return PayloadTemplate(build_buttons_payload(Slot('to'), header_text, Slot('body'), buttons))
+
+@lru_cache(maxsize=32)
+def _approved_template(template_name, language_code):
+    return PayloadTemplate(build_template_payload(Slot('to'), template_name, language_code))
+
+def _body(body_text, intro):
+    """Interactive body with `intro` merged in front, or None if that would exceed the Cloud API limit"""
+    if intro is None:
+        return body_text
+    merged = f"{intro}\n\n{body_text}"
+    return merged if len(merged) <= INTERACTIVE_BODY_MAX else None
+
+# Rendered messages are (description, payload bytes), ready for any transport
+
+def text_message(phone_number, message):
+    """Render a simple text message"""
+    return "message", TEXT_TEMPLATE.render(to=phone_number, body=message)
+
+def template_message(phone_number, template_name, language_code):
+    """Render an approved template message"""
+    return "template", _approved_template(template_name, language_code).render(to=phone_number)
+
+# Interactive renderers take an optional `intro` text for the body and return None when it does not fit
+
+def interactive_buttons(phone_number, header_text, body_text, buttons, intro=None):
+    """Render a message with interactive buttons"""
+    body = _body(body_text, intro)
+    if body is None:
+        return None
+    return "interactive message", _buttons_template(header_text, tuple(buttons)).render(to=phone_number, body=body)
+
+def rating_buttons(phone_number, intro=None):
+    """Render the rating buttons (1-5 stars)"""
+    body = _body(RATING_BODY, intro)
+    if body is None:
+        return None
+    return "rating buttons", RATING_TEMPLATE.render(to=phone_number, body=body)
+
+def category_list(phone_number, intro=None):
+    """Render the list of categories"""
+    body = _body(CATEGORY_LIST_BODY, intro)
+    if body is None:
+        return None
+    return "category list", CATEGORY_LIST_TEMPLATE.render(to=phone_number, body=body)
+
+def _flow_token_signature(phone_number, issued, nonce):
+    message = f"{phone_number}.{issued}.{nonce}".encode('utf-8')
+    return hmac.new(Config.APP_SECRET.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+def make_flow_token(phone_number):
+    """Signed, single-use token naming the respondent and when it was issued; the Flow sends it back with every request"""
+    issued = str(int(time.time()))
+    nonce = secrets.token_hex(8)
+    return f"{phone_number}.{issued}.{nonce}.{_flow_token_signature(phone_number, issued, nonce)}"
+
+def phone_from_flow_token(flow_token, max_age=None):
+    """The phone number a token was issued to, or None if it was not issued by us or is over max_age seconds old"""
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        logger.info(f"Category list sent to {phone_number}")
-        return response
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send category list: {str(e)}")
-        if response := getattr(e, 'response', None):
-            logger.error(f"Response: {response.text}")
-        return None
\ No newline at end of file
+        phone_number, issued, nonce, signature = (flow_token or '').split('.')
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature, _flow_token_signature(phone_number, issued, nonce)):
+        return None
+    if max_age is not None and time.time() - int(issued) > max_age:
+        return None
+    return phone_number
+
+def survey_flow(phone_number, intro=None):
+    """Render the message that opens the survey Flow"""
+    body = _body(SURVEY_FLOW_BODY, intro)
+    if body is None:
+        return None
+    return "survey flow", FLOW_TEMPLATE.render(to=phone_number, body=body, flow_token=make_flow_token(phone_number))
+
+def with_intro(phone_number, intro, render, *args):
+    """Replies for a text followed by an interactive message: a single send with the text merged into
+    the interactive body when it fits, otherwise both messages in order"""
+    if Config.COALESCE_REPLIES:
+        merged = render(phone_number, *args, intro=intro)
+        if merged is not None:
+            return (merged,)
+    return (text_message(phone_number, intro), render(phone_number, *args))
+
+def send_message(phone_number, rendered):
+    """Queue a rendered (description, payload) message for delivery"""
+    description, data = rendered
+    return get_outbound().submit(phone_number, data, description)
+
+def send_text_message(phone_number, message):
+    """Send a simple text message via WhatsApp API"""
+    return send_message(phone_number, text_message(phone_number, message))
+
+def send_interactive_buttons(phone_number, header_text, body_text, buttons):
+    """Send a message with interactive buttons"""
+    return send_message(phone_number, interactive_buttons(phone_number, header_text, body_text, buttons))
+
+def send_rating_buttons(phone_number):
+    """Send rating buttons (1-5 stars)"""
+    return send_message(phone_number, rating_buttons(phone_number))
+
+def send_category_list(phone_number):
+    """Send a list of categories for selection"""
+    return send_message(phone_number, category_list(phone_number))
\ No newline at end of file
@@ -0,0 +1,249 @@
+# worker_pool.py - Background Worker Pool
+# Bounded in-process queue drained by a pool of worker threads
+
+import os
+import time
+import zlib
+import queue
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Placed on the queue to tell a worker to exit
+_STOP = object()
+
+# Everything with queued work in this process, drained in drain_order at exit
+_drainables = []
+
+def register_drain(obj):
+    """Register an object with drain_order and shutdown() to be drained at exit"""
+    _drainables.append(obj)
+
+class WorkerPool:
+    """Runs handler(item) on background threads fed from a bounded queue"""
+    
+    def __init__(self, name, handler, workers, queue_size, enqueue_timeout=0, drain_timeout=30, drain_order=0):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.drain_timeout = drain_timeout
+        self.drain_order = drain_order
+        
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._pid = None
+        self._accepting = True
+        self._lock = threading.Lock()
+        
+        # Metrics
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+        self._lag_total = 0.0
+        self._busy_total = 0.0
+        
+        register_drain(self)
+    
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            self._accepting = True
+            logger.info("Started %d %s worker(s), queue size %d", self.workers, self.name, self.queue_size)
+    
+    def submit(self, item):
+        """Queue an item for processing. Returns False if the queue stayed full (backpressure)."""
+        if self.workers <= 0:
+            # Inline mode: process on the caller's thread
+            self._execute(item, time.monotonic())
+            return True
+        
+        self._ensure_started()
+        if not self._accepting:
+            with self._lock:
+                self._rejected += 1
+            return False
+        
+        entry = (time.monotonic(), item)
+        try:
+            if self.enqueue_timeout:
+                self._queue.put(entry, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            logger.warning("%s queue full (%d), rejecting item", self.name, self.queue_size)
+            return False
+        
+        with self._lock:
+            self._enqueued += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+    
+    def _execute(self, item, enqueued_at):
+        started = time.monotonic()
+        lag = started - enqueued_at
+        try:
+            self.handler(item)
+            failed = False
+        except Exception as e:
+            failed = True
+            logger.error("Error in %s worker: %s", self.name, e)
+        
+        with self._lock:
+            self._processed += 1
+            if failed:
+                self._failed += 1
+            self._lag_last = lag
+            self._lag_max = max(self._lag_max, lag)
+            self._lag_total += lag
+            self._busy_total += time.monotonic() - started
+    
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is _STOP:
+                    return
+                enqueued_at, item = entry
+                self._execute(item, enqueued_at)
+            finally:
+                self._queue.task_done()
+    
+    def shutdown(self, timeout=None):
+        """Stop accepting new items and wait for queued ones to finish"""
+        if self._pid != os.getpid() or not self._accepting:
+            return
+        if timeout is None:
+            timeout = self.drain_timeout
+        self._accepting = False
+        pending = self._queue.qsize()
+        logger.info("Draining %s queue (%d pending)", self.name, pending)
+        
+        # Sentinels go behind the queued work so everything already accepted is processed
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        
+        if any(thread.is_alive() for thread in self._threads):
+            logger.warning("%s drain timed out with %d item(s) left", self.name, self._queue.qsize())
+        else:
+            logger.info("%s queue drained", self.name)
+    
+    def stats(self):
+        """Return a snapshot of queue metrics"""
+        with self._lock:
+            oldest_lag = 0.0
+            if self._queue.qsize():
+                try:
+                    # Peek at the head of the queue to report how long the oldest item has waited
+                    head = self._queue.queue[0]
+                    if head is not _STOP:
+                        oldest_lag = time.monotonic() - head[0]
+                except IndexError:
+                    pass
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'depth': self._queue.qsize(),
+                'max_depth': self._max_depth,
+                'enqueued': self._enqueued,
+                'processed': self._processed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'lag_oldest': round(oldest_lag, 6),
+                'lag_last': round(self._lag_last, 6),
+                'lag_max': round(self._lag_max, 6),
+                'lag_avg': round(self._lag_total / self._processed, 6) if self._processed else 0.0,
+                'busy_avg': round(self._busy_total / self._processed, 6) if self._processed else 0.0
+            }
+
+class ShardedDispatcher:
+    """Routes items to single-threaded shards by key so items with the same key run in order"""
+    
+    def __init__(self, name, handler, shards, queue_size, enqueue_timeout=30, drain_timeout=30, drain_order=1):
+        self.name = name
+        self.handler = handler
+        self._started = time.monotonic()
+        self.shards = [
+            WorkerPool(
+                f"{name}-shard{i}",
+                handler,
+                workers=1,
+                queue_size=queue_size,
+                enqueue_timeout=enqueue_timeout,
+                drain_timeout=drain_timeout,
+                drain_order=drain_order
+            )
+            for i in range(shards)
+        ]
+    
+    def shard_for(self, key):
+        """Stable shard index for a key (identical in every process)"""
+        return zlib.crc32(str(key).encode('utf-8')) % len(self.shards)
+    
+    def submit(self, key, item):
+        """Queue an item on its key's shard, or run it inline when sharding is disabled"""
+        if not self.shards:
+            self.handler(item)
+            return True
+        return self.shards[self.shard_for(key)].submit(item)
+    
+    def shutdown(self, timeout=None):
+        for shard in self.shards:
+            shard.shutdown(timeout)
+    
+    def stats(self):
+        """Per-shard throughput plus an imbalance ratio (busiest shard / mean shard)"""
+        uptime = max(time.monotonic() - self._started, 1e-9)
+        shards = []
+        for shard in self.shards:
+            shard_stats = shard.stats()
+            shards.append({
+                'depth': shard_stats['depth'],
+                'processed': shard_stats['processed'],
+                'failed': shard_stats['failed'],
+                'rejected': shard_stats['rejected'],
+                'lag_max': shard_stats['lag_max'],
+                'throughput': round(shard_stats['processed'] / uptime, 3)
+            })
+        
+        processed = [shard['processed'] for shard in shards]
+        mean = sum(processed) / len(processed) if processed else 0
+        return {
+            'shards': len(shards),
+            'processed': sum(processed),
+            'imbalance': round(max(processed) / mean, 3) if mean else 0.0,
+            'per_shard': shards
+        }
+
+def shutdown_all():
+    """Drain every pool and writer in this process, upstream first"""
+    for obj in sorted(_drainables, key=lambda o: o.drain_order):
+        obj.shutdown()
+
+atexit.register(shutdown_all)
\ No newline at end of file